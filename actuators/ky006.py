@@ -1,38 +1,168 @@
 # Passive buzzer KY-006
 
-from machine import Pin, PWM
-import time
+from machine import Pin, PWM, Timer
+import micropython
 
 class KY006:
+    """
+    Buzzer alarm sequencer.
+
+    sound_alarm() only queues the alarm and returns immediately; the tones are
+    advanced from a one-shot TimerService job, or a one-shot machine.Timer
+    callback. Alarms are played one at a time by priority (flame first): a
+    higher priority alarm interrupts the one playing, which is queued again to
+    replay from its start.
+
+    The timer callback can run between any two bytecodes of the caller, so
+    sound_alarm() and stop() never touch the queue or the alarm playing: they
+    set a request flag and schedule _apply_requests() with micropython.schedule,
+    which runs in the same context as the timer callbacks and never in the
+    middle of one. tick() applies pending requests too, in case the schedule
+    queue was full.
+    """
     PIN = 13
-    
+    TIMER_ID = 0
+
     PATTERNS = {
         'flame': [(300, 500)],  # "flame"
         'co2': [(800, 200), (300, 200), (1000, 200), (1400, 200), (900, 200)],  # "car-bon di-ox-ide"
         'nh3': [(600, 300), (700, 300), (600, 300), (500, 300)]  # "am-mo-ni-a"
     }
-    
-    def __init__(self, pin=PIN):
+
+    PRIORITIES = {
+        'flame': 0,
+        'co2': 1,
+        'nh3': 2
+    }
+
+    def __init__(self, pin=PIN, timer_id=TIMER_ID, timers=None):
+        """
+        :param timer_id: Hardware timer of the tones when no TimerService is given, None to call tick() by hand.
+        :param timers: Optional TimerService running the tones.
+        """
         self.pwm_pin = pin
         self.pwm = PWM(Pin(self.pwm_pin, Pin.OUT), freq=1)
         self.pwm.duty_u16(0)
-        
+        self.timers = timers
+        self.job = timers.add("ky006", self._timer_callback) if timers is not None else None
+        self.timer = Timer(timer_id) if timer_id is not None and timers is None else None
+        self.current = None  # Alarm playing
+        self.step = 0  # Index of the tone playing
+        self.queue = []  # Waiting alarms, highest priority first
+        self.played = 0
+        self.alarms = tuple(self.PATTERNS)
+        self.requested = bytearray(len(self.alarms))  # Alarms asked for by sound_alarm(), by index in alarms
+        self.stop_requested = False
+        self._apply_ref = self._apply_requests  # Bound once, for micropython.schedule
+
+    @property
+    def is_active(self):
+        return self.current is not None
+
     def sound_alarm(self, alarm_type):
+        """Queues an alarm and returns immediately. An alarm already playing or queued is not repeated."""
         try:
-            print(f"Danger alarm activated: {alarm_type}")
-            if alarm_type in self.PATTERNS:
-                pattern = self.PATTERNS[alarm_type]
-                for freq, duration in pattern:
-                    # print(f"Alarm {alarm_type} with frequency {freq} Hz for {duration} ms")
-                    self.pwm.freq(freq)
-                    self.pwm.duty_u16(32767)
-                    time.sleep(duration / 1000)
-                    self.pwm.duty_u16(0)
-                    time.sleep(0.000001)  # Short pause between syllables
-                self.pwm.freq(1)  # Back to idle frequency
-                # print(f"Completed alarm for {alarm_type}")
-            else:
+            if alarm_type not in self.PATTERNS:
                 raise ValueError("Invalid alarm type")
-
+            self.requested[self.alarms.index(alarm_type)] = 1
+            self._schedule_requests()
         except Exception as e:
             print(f"An error occurred in sound_alarm: {e}")
+
+    def stop(self):
+        """Silences the buzzer and drops the queued alarms, once the request is applied."""
+        self.stop_requested = True
+        self._schedule_requests()
+
+    def _schedule_requests(self):
+        try:
+            micropython.schedule(self._apply_ref, 0)
+        except RuntimeError:
+            pass  # Schedule queue full, the next tick or request applies it
+
+    def _apply_requests(self, _=None):
+        # Returns the duration of the tone it started, if any
+        started = None
+        if self.stop_requested:
+            self.stop_requested = False
+            self.queue = []
+            self.current = None
+            if self.job is not None:
+                self.timers.cancel(self.job)
+            if self.timer is not None:
+                self.timer.deinit()
+            self.pwm.duty_u16(0)
+            self.pwm.freq(1)  # Back to idle frequency
+        for i in range(len(self.alarms)):
+            if not self.requested[i]:
+                continue
+            self.requested[i] = 0
+            alarm_type = self.alarms[i]
+            if alarm_type == self.current or alarm_type in self.queue:
+                continue
+            print(f"Danger alarm activated: {alarm_type}")
+            if self.current is None:
+                started = self._start(alarm_type)
+            elif self.PRIORITIES[alarm_type] < self.PRIORITIES[self.current]:
+                self._enqueue(self.current)
+                started = self._start(alarm_type)
+            else:
+                self._enqueue(alarm_type)
+        return started
+
+    def tick(self):
+        """
+        Ends the tone playing and starts the next one.
+
+        Called by the timer; without a timer, call it when the delay returned by
+        the previous call (or by sound_alarm's start) has elapsed.
+
+        :return: Milliseconds until the next call is due, or None when idle.
+        """
+        delay = self._advance()
+        if self.stop_requested or any(self.requested):
+            started = self._apply_requests()  # Left over from a full schedule queue
+            if started is not None:
+                delay = started
+            elif self.current is None:
+                delay = None
+        return delay
+
+    def _advance(self):
+        self.pwm.duty_u16(0)
+        if self.current is None:
+            return None
+        self.step += 1
+        if self.step >= len(self.PATTERNS[self.current]):
+            self.played += 1
+            if self.queue:
+                return self._start(self.queue.pop(0))
+            self.current = None
+            self.pwm.freq(1)  # Back to idle frequency
+            return None
+        return self._play()
+
+    def _enqueue(self, alarm_type):
+        priority = self.PRIORITIES[alarm_type]
+        i = 0
+        while i < len(self.queue) and self.PRIORITIES[self.queue[i]] <= priority:
+            i += 1
+        self.queue.insert(i, alarm_type)
+
+    def _start(self, alarm_type):
+        self.current = alarm_type
+        self.step = 0
+        return self._play()
+
+    def _play(self):
+        freq, duration = self.PATTERNS[self.current][self.step]
+        self.pwm.freq(freq)
+        self.pwm.duty_u16(32767)
+        if self.job is not None:
+            self.timers.schedule(self.job, duration)
+        elif self.timer is not None:
+            self.timer.init(period=duration, mode=Timer.ONE_SHOT, callback=self._timer_callback)
+        return duration
+
+    def _timer_callback(self, timer):
+        self.tick()
@@ -4,6 +4,9 @@ Communication Module
 This module contains drivers and formatters for UART communication.
 """
 
+from .binary_frame import BinaryFrameDecoder, BinaryFrameEncoder
+from .command_handler import CommandHandler
 from .ds1302 import DS1302
-from .json_parser import JSONParser
+from .json_parser import JSONDeltaDecoder, JSONParser
+from .telemetry_record import TelemetryRecord
 from .uart_comm import UARTComm
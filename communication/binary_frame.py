@@ -0,0 +1,295 @@
+# Compact binary telemetry frames
+# Frame layout (little endian):
+#   sync (2) | type (1) | sequence (2) | count (1) | length (2) | payload (length) | CRC-16/CCITT (2)
+# Each payload entry is a channel ID (1 byte) followed by its value, encoded as
+# declared in the channel table. Keys without an ID are sent as an extension
+# entry carrying the key and the value as strings.
+
+try:
+    import ustruct as struct
+except ImportError:
+    import struct
+
+from array import array
+
+SYNC = b'\xa5\x5a'
+FRAME_TELEMETRY = 0x01
+HEADER_SIZE = 8
+CRC_SIZE = 2
+MAX_FRAME_SIZE = 512
+
+# Value types of the channel table, besides the struct format characters
+TYPE_BOOL = 'bool'
+TYPE_TIME = 'time'  # ISO 8601 string packed as 6 bytes: year - 2000, month, day, hour, minute, second
+TYPE_STRING = 'str'  # Length-prefixed UTF-8
+
+EXTENSION_ID = 0xFF
+
+# Channel ID, key, type, scale (value is sent as round(value * scale))
+CHANNELS = (
+    (0x01, "timestamp", TYPE_TIME, 1),
+    (0x02, "temperature", 'h', 100),
+    (0x03, "pressure", 'H', 10),
+    (0x04, "humidity", 'H', 100),
+    (0x05, "bus_voltage", 'H', 1000),
+    (0x06, "current", 'h', 10),
+    (0x07, "power", 'H', 1),
+    (0x08, "battery_percentage", 'H', 100),
+    (0x09, "flame", TYPE_BOOL, 1),
+    (0x0A, "raw_nh3", 'H', 1),
+    (0x0B, "nh3", 'i', 10),
+    (0x0C, "nh3_alarm", TYPE_BOOL, 1),
+    (0x0D, "co2", 'H', 1),
+    (0x0E, "co2_alarm", TYPE_BOOL, 1),
+    (0x10, "gyroscope.x", 'h', 500),
+    (0x11, "gyroscope.y", 'h', 500),
+    (0x12, "gyroscope.z", 'h', 500),
+    (0x13, "accelerometer.x", 'h', 100),
+    (0x14, "accelerometer.y", 'h', 100),
+    (0x15, "accelerometer.z", 'h', 100),
+    (0x16, "magnetometer.x", 'h', 10),
+    (0x17, "magnetometer.y", 'h', 10),
+    (0x18, "magnetometer.z", 'h', 10),
+    (0x19, "orientation.heading", 'H', 100),
+    (0x1A, "orientation.pitch", 'h', 100),
+    (0x1B, "orientation.roll", 'h', 100),
+    (0x1C, "quaternion.w", 'h', 10000),
+    (0x1D, "quaternion.x", 'h', 10000),
+    (0x1E, "quaternion.y", 'h', 10000),
+    (0x1F, "quaternion.z", 'h', 10000),
+    (0x20, "distance.front", 'h', 10),
+    (0x21, "distance.left", 'h', 10),
+    (0x22, "distance.right", 'h', 10),
+    (0x23, "distance.rear", 'h', 10),
+    (0x30, "speed.front_left", 'h', 10),
+    (0x31, "speed.front_right", 'h', 10),
+    (0x32, "speed.rear_left", 'h', 10),
+    (0x33, "speed.rear_right", 'h', 10),
+    (0x38, "traveled.front_left", 'I', 1000),
+    (0x39, "traveled.front_right", 'I', 1000),
+    (0x3A, "traveled.rear_left", 'I', 1000),
+    (0x3B, "traveled.rear_right", 'I', 1000),
+    (0x40, "position.x", 'i', 1000),
+    (0x41, "position.y", 'i', 1000),
+    (0x42, "position.heading", 'H', 100),
+    (0x43, "position.var_x", 'I', 1000000),
+    (0x44, "position.var_y", 'I', 1000000),
+    (0x45, "position.cov_xy", 'i', 1000000),
+    (0x46, "position.var_heading", 'I', 1000000),
+)
+
+_LIMITS = {
+    'b': (-128, 127),
+    'B': (0, 255),
+    'h': (-32768, 32767),
+    'H': (0, 65535),
+    'i': (-2147483648, 2147483647),
+    'I': (0, 4294967295),
+}
+
+def _make_crc_table():
+    table = array('H', [0] * 256)
+    for i in range(256):
+        crc = i << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021) if crc & 0x8000 else (crc << 1)
+        table[i] = crc & 0xFFFF
+    return table
+
+_CRC_TABLE = _make_crc_table()
+
+def crc16(data, start=0, end=None, crc=0xFFFF):
+    """CRC-16/CCITT-FALSE of data[start:end]."""
+    if end is None:
+        end = len(data)
+    table = _CRC_TABLE
+    for i in range(start, end):
+        crc = ((crc << 8) & 0xFFFF) ^ table[((crc >> 8) ^ data[i]) & 0xFF]
+    return crc
+
+class BinaryFrameEncoder:
+    """Builds telemetry frames into a preallocated buffer."""
+
+    def __init__(self, channels=CHANNELS, max_size=MAX_FRAME_SIZE):
+        self.channels = {key: (channel_id, kind, scale) for channel_id, key, kind, scale in channels}
+        self.buffer = bytearray(max_size)
+        self.sequence = 0
+
+    def encode(self, values, frame_type=FRAME_TELEMETRY):
+        """
+        Encodes a flat mapping of channel keys to values.
+
+        :param values: Dictionary such as {"gyroscope.x": 0.01, "flame": False}.
+        :return: A memoryview over the internal buffer, valid until the next call.
+        """
+        buffer = self.buffer
+        offset = HEADER_SIZE
+        count = 0
+        for key, value in values.items():
+            if value is None:
+                continue
+            channel = self.channels.get(key)
+            if channel is None:
+                offset = self._pack_extension(offset, key, value)
+            else:
+                offset = self._pack_channel(offset, channel, value)
+            count += 1
+
+        return memoryview(buffer)[:self._finish(offset, count, frame_type)]
+
+    def encode_record(self, record, frame_type=FRAME_TELEMETRY):
+        """
+        Encodes the valid channels of a TelemetryRecord without allocating.
+
+        The record must use the same channel table as the encoder.
+
+        :return: The frame length; the frame is self.buffer[:length].
+        """
+        if HEADER_SIZE + len(record.valid) * 7 + CRC_SIZE > len(self.buffer):
+            raise ValueError("Telemetry frame too large")
+        offset = record.pack_into(self.buffer, HEADER_SIZE)
+        return self._finish(offset, record.count, frame_type)
+
+    def _finish(self, offset, count, frame_type):
+        buffer = self.buffer
+        buffer[0] = SYNC[0]
+        buffer[1] = SYNC[1]
+        struct.pack_into('<BHBH', buffer, 2, frame_type, self.sequence, count, offset - HEADER_SIZE)
+        struct.pack_into('<H', buffer, offset, crc16(buffer, 2, offset))
+        self.sequence = (self.sequence + 1) & 0xFFFF
+        return offset + CRC_SIZE
+
+    def _check_space(self, offset, size):
+        if offset + size + CRC_SIZE > len(self.buffer):
+            raise ValueError("Telemetry frame too large")
+
+    def _pack_channel(self, offset, channel, value):
+        channel_id, kind, scale = channel
+        buffer = self.buffer
+        if kind == TYPE_BOOL:
+            self._check_space(offset, 2)
+            buffer[offset] = channel_id
+            buffer[offset + 1] = 1 if value else 0
+            return offset + 2
+        if kind == TYPE_TIME:
+            self._check_space(offset, 7)
+            buffer[offset] = channel_id
+            # "YYYY-MM-DDTHH:MM:SS"
+            struct.pack_into('<BBBBBB', buffer, offset + 1, int(value[0:4]) - 2000, int(value[5:7]), int(value[8:10]),
+                             int(value[11:13]), int(value[14:16]), int(value[17:19]))
+            return offset + 7
+        if kind == TYPE_STRING:
+            return self._pack_string(self._pack_id(offset, channel_id), value)
+        size = struct.calcsize(kind)
+        self._check_space(offset, 1 + size)
+        buffer[offset] = channel_id
+        if kind == 'f':
+            struct.pack_into('<f', buffer, offset + 1, value * scale)
+        else:
+            low, high = _LIMITS[kind]
+            raw = int(round(value * scale))
+            struct.pack_into('<' + kind, buffer, offset + 1, low if raw < low else high if raw > high else raw)
+        return offset + 1 + size
+
+    def _pack_id(self, offset, channel_id):
+        self._check_space(offset, 1)
+        self.buffer[offset] = channel_id
+        return offset + 1
+
+    def _pack_string(self, offset, text):
+        data = str(text).encode('utf-8')[:255]
+        self._check_space(offset, 1 + len(data))
+        self.buffer[offset] = len(data)
+        self.buffer[offset + 1:offset + 1 + len(data)] = data
+        return offset + 1 + len(data)
+
+    def _pack_extension(self, offset, key, value):
+        offset = self._pack_id(offset, EXTENSION_ID)
+        offset = self._pack_string(offset, key)
+        return self._pack_string(offset, value)
+
+class BinaryFrameDecoder:
+    """Host-side decoder for the frames built by BinaryFrameEncoder."""
+
+    def __init__(self, channels=CHANNELS):
+        self.channels = {channel_id: (key, kind, scale) for channel_id, key, kind, scale in channels}
+        self.pending = bytearray()
+        self.crc_errors = 0
+
+    def decode(self, frame):
+        """
+        Decodes a single complete frame.
+
+        :return: A tuple (sequence, values) where values maps channel keys to values.
+        :raises ValueError: If the sync, length or CRC is invalid.
+        """
+        frame = bytes(frame)
+        if len(frame) < HEADER_SIZE + CRC_SIZE or frame[0:2] != SYNC:
+            raise ValueError("Missing frame header")
+        frame_type, sequence, count, length = struct.unpack_from('<BHBH', frame, 2)
+        end = HEADER_SIZE + length
+        if len(frame) < end + CRC_SIZE:
+            raise ValueError("Truncated frame")
+        if struct.unpack_from('<H', frame, end)[0] != crc16(frame, 2, end):
+            raise ValueError("CRC mismatch")
+
+        values = {}
+        offset = HEADER_SIZE
+        for _ in range(count):
+            channel_id = frame[offset]
+            offset += 1
+            if channel_id == EXTENSION_ID:
+                key, offset = self._unpack_string(frame, offset)
+                values[key], offset = self._unpack_string(frame, offset)
+                continue
+            key, kind, scale = self.channels[channel_id]
+            if kind == TYPE_BOOL:
+                values[key] = frame[offset] != 0
+                offset += 1
+            elif kind == TYPE_TIME:
+                year, month, day, hour, minute, second = struct.unpack_from('<BBBBBB', frame, offset)
+                values[key] = "{:04d}-{:02d}-{:02d}T{:02d}:{:02d}:{:02d}".format(year + 2000, month, day, hour, minute, second)
+                offset += 6
+            elif kind == TYPE_STRING:
+                values[key], offset = self._unpack_string(frame, offset)
+            else:
+                raw = struct.unpack_from('<' + kind, frame, offset)[0]
+                values[key] = raw / scale if scale != 1 else raw
+                offset += struct.calcsize(kind)
+        return sequence, values
+
+    def feed(self, data):
+        """
+        Appends received bytes and returns every complete frame found, as decode() tuples.
+
+        Corrupted frames are dropped and the stream resynchronises on the next sync word.
+        """
+        self.pending.extend(data)
+        frames = []
+        while True:
+            start = self.pending.find(SYNC)
+            if start < 0:
+                # Keep a trailing first sync byte, it may be completed by the next chunk
+                del self.pending[:max(0, len(self.pending) - 1)]
+                return frames
+            del self.pending[:start]
+            if len(self.pending) < HEADER_SIZE:
+                return frames
+            length = struct.unpack_from('<H', self.pending, 6)[0]
+            size = HEADER_SIZE + length + CRC_SIZE
+            if size > MAX_FRAME_SIZE:
+                self.crc_errors += 1
+                del self.pending[:1]
+                continue
+            if len(self.pending) < size:
+                return frames
+            try:
+                frames.append(self.decode(self.pending[:size]))
+                del self.pending[:size]
+            except (ValueError, KeyError, IndexError):
+                self.crc_errors += 1
+                del self.pending[:1]
+
+    def _unpack_string(self, frame, offset):
+        length = frame[offset]
+        return bytes(frame[offset + 1:offset + 1 + length]).decode('utf-8'), offset + 1 + length
@@ -0,0 +1,55 @@
+# Command/response protocol over the UART link
+# Request (one JSON line from the host):  {"id": 7, "cmd": "set_period", "args": {"task": "l3gd20", "period": 50}}
+# Reply (one JSON line to the host):      {"id": 7, "ok": true, "result": null}
+#                                         {"id": 7, "ok": false, "error": "Unknown task l3gd2"}
+# Replies carry the request ID, so the host can pipeline commands without waiting.
+
+import json
+
+class CommandHandler:
+    """Dispatches command lines from the host to the registered functions."""
+
+    def __init__(self):
+        self.commands = {}
+        self.received = 0
+        self.failed = 0
+        self.register("ping", lambda args: "pong")
+        self.register("help", lambda args: sorted(self.commands))
+
+    def register(self, name, func):
+        """
+        Registers a command.
+
+        :param name: Command name, matched against the "cmd" field.
+        :param func: Called with the "args" dictionary of the request; its return value is the reply result.
+        """
+        self.commands[name] = func
+
+    def handle(self, line):
+        """
+        Runs one command line.
+
+        :param line: The request as bytes or string.
+        :return: The JSON reply line (without newline).
+        """
+        self.received += 1
+        request_id = None
+        try:
+            if isinstance(line, (bytes, bytearray)):
+                line = line.decode('utf-8')
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("Request must be a JSON object")
+            request_id = request.get("id")
+            name = request.get("cmd")
+            func = self.commands.get(name)
+            if func is None:
+                raise ValueError(f"Unknown command {name}")
+            result = func(request.get("args") or {})
+            return json.dumps({"id": request_id, "ok": True, "result": result})
+        except Exception as e:
+            self.failed += 1
+            return json.dumps({"id": request_id, "ok": False, "error": str(e)})
+
+    def stats(self):
+        return {"received": self.received, "failed": self.failed}
@@ -2,13 +2,38 @@
 import json
 
 class JSONParser:
-    def __init__(self):
+    """
+    Builds the JSON telemetry message from dotted keys ("gyroscope.x").
+
+    In delta mode, a full keyframe is sent every keyframe_interval messages
+    (or after request_keyframe()), and the messages in between only carry the
+    keys whose value moved beyond the channel deadband since it was last sent.
+    Every delta mode message carries "seq" and "keyframe" fields so the host
+    (see JSONDeltaDecoder) can rebuild the full state and detect lost frames.
+    """
+    KEYFRAME_INTERVAL = 10
+
+    def __init__(self, delta=False, keyframe_interval=KEYFRAME_INTERVAL, deadbands=None):
+        """
+        :param keyframe_interval: Messages per keyframe in delta mode; 0 or 1 sends a keyframe every message.
+        """
+        if keyframe_interval < 0:
+            raise ValueError("Keyframe interval cannot be negative")
         self.json_message = {}
+        self.values = {}
+        self.delta = delta
+        self.keyframe_interval = keyframe_interval or 1  # 0 means every message, not a division by zero
+        self.deadbands = deadbands if deadbands is not None else {}
+        self.sent = {}
+        self.sequence = 0
+        self.keyframe_requested = True
+        self.keyframe = True  # Whether the last message carried the full state (always outside delta mode)
 
     def print_json(self):
         print(self.json_message)
 
     def add_data(self, key, value):
+        self.values[key] = value
         keys = key.split('.')
         d = self.json_message
         for k in keys[:-1]:
@@ -17,14 +42,103 @@ class JSONParser:
             d = d[k]
         d[keys[-1]] = value
 
+    def request_keyframe(self):
+        """Forces the next delta mode message to be a full keyframe."""
+        self.keyframe_requested = True
+
     def get_json_message(self):
         try:
-            message = json.dumps(self.json_message)
-            return message
+            if not self.delta:
+                return json.dumps(self.json_message)
+            return json.dumps(self._delta_message())
         except Exception as e:
             print(f"Failed to create JSON message: {e}")
             return None
-        
+
     def clear_json_message(self):
         self.json_message = {}
-        
\ No newline at end of file
+        self.values = {}
+
+    def _deadband(self, key):
+        deadband = self.deadbands.get(key)
+        if deadband is None:
+            deadband = self.deadbands.get(key.split('.')[0], 0)
+        return deadband
+
+    def _changed(self, key, value):
+        if key not in self.sent:
+            return True
+        last = self.sent[key]
+        if isinstance(value, bool) or isinstance(last, bool) or not isinstance(value, (int, float)) or not isinstance(last, (int, float)):
+            return value != last
+        return abs(value - last) > self._deadband(key)
+
+    def _delta_message(self):
+        keyframe = self.keyframe_requested or self.sequence % self.keyframe_interval == 0
+        if keyframe:
+            message = dict(self.json_message)
+            self.sent.update(self.values)
+            self.keyframe_requested = False
+        else:
+            message = {}
+            for key, value in self.values.items():
+                if self._changed(key, value):
+                    self.sent[key] = value
+                    keys = key.split('.')
+                    d = message
+                    for k in keys[:-1]:
+                        if k not in d:
+                            d[k] = {}
+                        d = d[k]
+                    d[keys[-1]] = value
+        message["seq"] = self.sequence
+        message["keyframe"] = keyframe
+        self.keyframe = keyframe
+        self.sequence += 1
+        return message
+
+class JSONDeltaDecoder:
+    """Host-side state rebuilder for the delta mode messages of JSONParser."""
+
+    def __init__(self):
+        self.state = {}
+        self.synced = False
+        self.sequence = None
+        self.lost_frames = 0
+
+    def apply(self, message):
+        """
+        Merges a received message (JSON string or parsed dictionary) into the state.
+
+        :return: The full rebuilt state.
+        """
+        if isinstance(message, str):
+            message = json.loads(message)
+        message = dict(message)
+        sequence = message.pop("seq", None)
+        keyframe = message.pop("keyframe", True)
+
+        if sequence is not None and self.sequence is not None:
+            missing = sequence - self.sequence - 1
+            if missing > 0:
+                self.lost_frames += missing
+                self.synced = False
+        self.sequence = sequence
+
+        if keyframe:
+            self.state = {}
+            self.synced = True
+        self._merge(self.state, message)
+        return self.state
+
+    @property
+    def needs_keyframe(self):
+        """True until a keyframe arrives after startup or after a lost frame."""
+        return not self.synced
+
+    def _merge(self, target, update):
+        for key, value in update.items():
+            if isinstance(value, dict) and isinstance(target.get(key), dict):
+                self._merge(target[key], value)
+            else:
+                target[key] = value
@@ -0,0 +1,129 @@
+# Fixed-schema telemetry record
+# Holds the latest value of every channel of the binary frame channel table in
+# preallocated arrays, so building a frame each cycle needs no dict or string.
+
+try:
+    import ustruct as struct
+except ImportError:
+    import struct
+
+from array import array
+from .binary_frame import CHANNELS, TYPE_BOOL, TYPE_TIME, _LIMITS
+
+class TelemetryRecord:
+    """
+    Channel values stored as scaled integers, indexed by their position in the schema.
+
+    Resolve indexes once with index_of() at startup and update with set();
+    pack_into() then writes the valid channels as binary frame entries.
+
+    On the board, pack_into() allocates nothing. set() allocates one float for
+    the scaling multiply of a float value, a 16-byte heap block per float
+    channel published (tests/telemetry_alloc_bench.py).
+    """
+    __slots__ = ("keys", "index", "ids", "kinds", "formats", "sizes", "scales", "raw", "valid", "time", "count")
+
+    def __init__(self, channels=CHANNELS):
+        size = len(channels)
+        self.keys = tuple(channel[1] for channel in channels)
+        self.index = {channel[1]: i for i, channel in enumerate(channels)}
+        self.ids = bytearray(channel[0] for channel in channels)
+        self.kinds = tuple(channel[2] for channel in channels)
+        self.scales = tuple(channel[3] for channel in channels)
+        for key, kind in zip(self.keys, self.kinds):
+            if kind not in _LIMITS and kind not in (TYPE_BOOL, TYPE_TIME):
+                raise ValueError(f"Channel {key} has no fixed-size integer encoding")
+        self.formats = tuple('<' + kind if kind in _LIMITS else None for kind in self.kinds)
+        self.sizes = bytearray(struct.calcsize(kind) if kind in _LIMITS else 0 for kind in self.kinds)
+        self.raw = array('q', [0] * size)  # Wide enough for the whole 'I' range
+        self.valid = bytearray(size)
+        self.time = bytearray(6)
+        self.count = 0
+
+    def index_of(self, key):
+        """Returns the schema index of a channel key, or None if it is not in the schema."""
+        return self.index.get(key)
+
+    def set(self, index, value):
+        """Stores a channel value, scaled and clamped to its wire type."""
+        kind = self.kinds[index]
+        if kind == TYPE_TIME:
+            self.set_time(value)
+            return
+        if kind == TYPE_BOOL:
+            self.raw[index] = 1 if value else 0
+        else:
+            low, high = _LIMITS[kind]
+            raw = int(round(value * self.scales[index]))
+            self.raw[index] = low if raw < low else high if raw > high else raw
+        self.valid[index] = 1
+
+    def set_key(self, key, value):
+        """Stores a channel value by key. Returns False if the key is not in the schema."""
+        index = self.index.get(key)
+        if index is None:
+            return False
+        self.set(index, value)
+        return True
+
+    def set_time(self, timestamp):
+        """
+        Stores the timestamp channel.
+
+        :param timestamp: An ISO 8601 string, or a DS1302 date_time() list (year, month, day, weekday, hour, minute, second).
+        """
+        time = self.time
+        if isinstance(timestamp, str):
+            time[0] = int(timestamp[0:4]) - 2000
+            time[1] = int(timestamp[5:7])
+            time[2] = int(timestamp[8:10])
+            time[3] = int(timestamp[11:13])
+            time[4] = int(timestamp[14:16])
+            time[5] = int(timestamp[17:19])
+        else:
+            time[0] = timestamp[0] - 2000
+            time[1] = timestamp[1]
+            time[2] = timestamp[2]
+            time[3] = timestamp[4]
+            time[4] = timestamp[5]
+            time[5] = timestamp[6]
+        for i in range(len(self.kinds)):
+            if self.kinds[i] == TYPE_TIME:
+                self.valid[i] = 1
+
+    def invalidate(self):
+        """Marks every channel as missing."""
+        valid = self.valid
+        for i in range(len(valid)):
+            valid[i] = 0
+
+    def pack_into(self, buffer, offset):
+        """
+        Writes the valid channels as frame entries starting at offset.
+
+        :return: The offset after the last entry. The number of entries is left in self.count.
+        """
+        kinds = self.kinds
+        raw = self.raw
+        valid = self.valid
+        ids = self.ids
+        count = 0
+        for i in range(len(valid)):
+            if not valid[i]:
+                continue
+            buffer[offset] = ids[i]
+            kind = kinds[i]
+            if kind == TYPE_BOOL:
+                buffer[offset + 1] = raw[i]
+                offset += 2
+            elif kind == TYPE_TIME:
+                time = self.time
+                for j in range(6):
+                    buffer[offset + 1 + j] = time[j]
+                offset += 7
+            else:
+                struct.pack_into(self.formats[i], buffer, offset + 1, raw[i])
+                offset += 1 + self.sizes[i]
+            count += 1
+        self.count = count
+        return offset
@@ -3,14 +3,73 @@
 from machine import UART, Pin
 import time
 
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+from .binary_frame import SYNC, HEADER_SIZE, CRC_SIZE, crc16
+
 class UARTComm:
+    """
+    UART link to the Raspberry Pi.
+
+    Outgoing messages are copied into one of two preallocated transmit buffers
+    and drained by poll() a chunk at a time, only when the UART is idle, so
+    callers never block or sleep. While one buffer drains, the next message is
+    assembled in the other one. A newer telemetry message replaces one still
+    waiting (the freshest telemetry wins) and the replaced one counts as
+    dropped; messages queued with replaceable=False, like command replies, are
+    appended to the waiting buffer instead and never replaced. Urgent messages
+    (priority=True), like alarms, jump the queue: telemetry being drained is
+    cut at the current chunk and the urgent message is sent right after it.
+    Telemetry goes out in short chunks, so an urgent message never waits long
+    for the one on the wire; other messages are written up to the FIFO size.
+
+    send_urgent() may be called from a scheduled callback (micropython.schedule),
+    which runs between any two bytecodes of a task: busy is set while a task is
+    inside a sending method, and send_urgent() refuses to interrupt it.
+
+    Incoming bytes are moved into a fixed-size ring buffer and split into
+    newline-terminated lines or binary frames (see binary_frame.py), returned
+    by read_messages() or by iterating the object with "async for".
+    """
     TX_PIN = 17
     RX_PIN = 16
     BAUD_RATE = 9600
     UART_NUM = 1
     TIMEOUT = 5000  # Timeout em milissegundos
-        
-    def __init__(self, tx_pin=TX_PIN, rx_pin=RX_PIN, baudrate=BAUD_RATE, uart_num=UART_NUM, timeout=TIMEOUT, parity=0, stop=2):
+    TX_BUFFER_SIZE = 2048
+    TX_CHUNK_SIZE = 16  # Telemetry written per poll: 20 ms on the wire at 9600 baud 8E2, the longest an urgent message waits
+    TX_FIFO_SIZE = 128  # ESP32 hardware FIFO size, so a write never blocks the writer
+    RX_BUFFER_SIZE = 1024
+    RX_CHUNK_SIZE = 64
+    RX_POLL_INTERVAL = 0.005  # Seconds between polls of an idle UART in async iteration
+
+    def __init__(self, tx_pin=TX_PIN, rx_pin=RX_PIN, baudrate=BAUD_RATE, uart_num=UART_NUM, timeout=TIMEOUT, parity=0, stop=2, tx_buffer_size=TX_BUFFER_SIZE, tx_chunk_size=TX_CHUNK_SIZE, rx_buffer_size=RX_BUFFER_SIZE):
+        self.tx_buffers = (bytearray(tx_buffer_size), bytearray(tx_buffer_size))
+        self.tx_views = (memoryview(self.tx_buffers[0]), memoryview(self.tx_buffers[1]))
+        self.tx_lengths = [0, 0]
+        self.tx_replaceable = [True, True]
+        self.tx_chunk_size = tx_chunk_size
+        self.tx_sending = None  # Index of the buffer being drained
+        self.tx_pending = None  # Index of the buffer waiting its turn
+        self.tx_offset = 0
+        self.busy = False  # Set while a task is inside a sending method
+        self.bytes_sent = 0
+        self.frames_sent = 0
+        self.dropped_frames = 0
+        self.rx_buffer = bytearray(rx_buffer_size)
+        self.rx_view = memoryview(self.rx_buffer)
+        self.rx_chunk = bytearray(self.RX_CHUNK_SIZE)
+        self.rx_head = 0  # Next byte to write
+        self.rx_tail = 0  # Oldest unread byte
+        self.rx_count = 0
+        self.rx_scan = 0  # Bytes after the tail already searched for a newline
+        self.bytes_received = 0
+        self.rx_overflows = 0
+        self.rx_crc_errors = 0
+        self.uart = None
         try:
             self.uart = UART(uart_num, baudrate=baudrate, tx=Pin(tx_pin), rx=Pin(rx_pin), timeout=timeout, parity=parity, stop=stop)
             parity_str = "even" if parity == 0 else "odd"
@@ -18,41 +77,313 @@ class UARTComm:
         except Exception as e:
             print(f"Failed to initialize UART: {e}")
 
-    def send_message(self, message, add_newline=True):
+    @property
+    def queue_depth(self):
+        """Number of messages not fully sent yet (0, 1 or 2)"""
+        return (self.tx_sending is not None) + (self.tx_pending is not None)
+
+    def stats(self):
+        return {
+            "queue_depth": self.queue_depth,
+            "bytes_sent": self.bytes_sent,
+            "frames_sent": self.frames_sent,
+            "dropped_frames": self.dropped_frames,
+            "bytes_received": self.bytes_received,
+            "rx_pending": self.rx_count,
+            "rx_overflows": self.rx_overflows,
+            "rx_crc_errors": self.rx_crc_errors
+        }
+
+    def send_message(self, message, add_newline=True, replaceable=True, priority=False):
+        """
+        Queues a text message, followed by a newline by default.
+
+        Set replaceable to False for messages that must not be superseded by newer
+        telemetry, such as command replies. Set priority to send it before every
+        queued message, aborting the telemetry being sent; it is never replaced.
+        """
+        self.busy = True
         try:
-            if add_newline:
-                self.uart.write(message.encode('utf-8') + b'\n')
-            else:
-                self.uart.write(message.encode('utf-8'))
-            print(f"Sent message: {message}")
-            time.sleep(0.1)
+            if priority:
+                return self._queue_priority(message.encode('utf-8'), None, add_newline)
+            return self._queue(message.encode('utf-8'), None, add_newline, replaceable)
         except Exception as e:
             print(f"Failed to send message: {e}")
+            return False
+        finally:
+            self.busy = False
+
+    def send_urgent(self, message):
+        """
+        Queues a priority message from a scheduled callback.
+
+        :return: False if the callback interrupted another UARTComm call, or the
+                 message could not be queued; the caller then sends it from a task.
+        """
+        if self.busy:
+            return False
+        return self.send_message(message, priority=True)
+
+    def send_frame(self, frame, length=None, replaceable=True):
+        """Queues a binary frame (or its first length bytes) as is, without newline or console echo"""
+        self.busy = True
+        try:
+            return self._queue(frame, length, False, replaceable)
+        except Exception as e:
+            print(f"Failed to send frame: {e}")
+            return False
+        finally:
+            self.busy = False
+
+    def poll(self):
+        """Writes the next chunk of the queued messages if the UART is idle. Never blocks."""
+        if self.uart is None or self.busy:
+            return
+        self.busy = True
+        try:
+            self._poll()
+        finally:
+            self.busy = False
+
+    def _poll(self, now=False):
+        # now: write even if the UART is not idle, when that cannot block
+        if self.uart is None:
+            return
+        if self.tx_sending is None:
+            if self.tx_pending is None:
+                return
+            self.tx_sending = self.tx_pending
+            self.tx_pending = None
+            self.tx_offset = 0
+        if not now and not self._tx_idle():
+            return
+        length = self.tx_lengths[self.tx_sending]
+        end = self.tx_offset + (self.tx_chunk_size if self.tx_replaceable[self.tx_sending] else self.TX_FIFO_SIZE)
+        if end > length:
+            end = length
+        written = self.uart.write(self.tx_views[self.tx_sending][self.tx_offset:end])
+        if written:
+            self.tx_offset += written
+            self.bytes_sent += written
+        if self.tx_offset >= length:
+            self.frames_sent += 1
+            self.tx_sending = None
+
+    def _tx_idle(self):
+        txdone = getattr(self.uart, "txdone", None)
+        return txdone is None or txdone()
+
+    def _queue(self, data, length, add_newline, replaceable):
+        if length is None:
+            length = len(data)
+        size = length + 1 if add_newline else length
+        capacity = len(self.tx_buffers[0])
+        if size > capacity:
+            self.dropped_frames += 1
+            print(f"Message of {size} bytes exceeds the transmit buffer")
+            return False
+
+        index = self.tx_pending
+        offset = 0
+        if index is None:
+            index = 0 if self.tx_sending is None else 1 - self.tx_sending
+        elif replaceable and self.tx_replaceable[index]:
+            # The waiting message is older telemetry, replace it
+            self.dropped_frames += 1
+        elif self.tx_lengths[index] + size <= capacity:
+            # Append after the waiting message
+            offset = self.tx_lengths[index]
+            replaceable = False
+        elif self.tx_replaceable[index]:
+            self.dropped_frames += 1
+        else:
+            self.dropped_frames += 1
+            return False
+
+        view = self.tx_views[index]
+        view[offset:offset + length] = data if len(data) == length else memoryview(data)[:length]
+        if add_newline:
+            view[offset + length] = 0x0A
+        self.tx_lengths[index] = offset + size
+        self.tx_replaceable[index] = replaceable
+        self.tx_pending = index
+        self._poll()
+        return True
+
+    def _queue_priority(self, data, length, add_newline):
+        sending = self.tx_sending
+        if sending is not None and self.tx_replaceable[sending]:
+            # Abort the telemetry being drained; the host discards the cut line or frame
+            self.dropped_frames += 1
+            self.tx_sending = None
+            cut = self.tx_offset > 0
+        else:
+            cut = False
+        if self.tx_sending is not None:
+            # A command reply is being sent, go right after it
+            if self.tx_pending is not None and self.tx_replaceable[self.tx_pending]:
+                self.dropped_frames += 1
+                self.tx_pending = None
+            return self._queue(data, length, add_newline, False)
+
+        if length is None:
+            length = len(data)
+        offset = 1 if cut else 0  # A newline ends the cut line first
+        size = offset + length + (1 if add_newline else 0)
+        if size > len(self.tx_buffers[0]):
+            self.dropped_frames += 1
+            print(f"Message of {size} bytes exceeds the transmit buffer")
+            return False
+        index = 1 if self.tx_pending == 0 else 0
+        view = self.tx_views[index]
+        if cut:
+            view[0] = 0x0A
+        view[offset:offset + length] = data if len(data) == length else memoryview(data)[:length]
+        if add_newline:
+            view[size - 1] = 0x0A
+        self.tx_lengths[index] = size
+        self.tx_replaceable[index] = False
+        self.tx_sending = index
+        self.tx_offset = 0
+        # Behind at most the telemetry chunk on the wire, a short message fits the FIFO right away
+        self._poll(cut and size <= self.TX_FIFO_SIZE - self.tx_chunk_size)
+        return True
+
+    def read_messages(self):
+        """
+        Yields every complete line (without the newline) or binary frame received so far, as bytes.
+
+        Never blocks; incomplete data stays buffered for the next call.
+        """
+        while True:
+            message = self._rx_next()
+            if message is None:
+                if not self._rx_fill():
+                    return
+                continue
+            yield message
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        """Waits for the next line or binary frame, sleeping only while nothing is pending."""
+        while True:
+            message = self._rx_next()
+            if message is not None:
+                return message
+            if not self._rx_fill():
+                await asyncio.sleep(self.RX_POLL_INTERVAL)
 
     def read_serial(self):
-        buffer = ""
+        """
+        Returns the next received line as a string, waiting up to TIMEOUT ms.
+
+        Lines received after it stay buffered for the next call. Returns an empty string on timeout.
+        """
         start_time = time.ticks_ms()
         while True:
             try:
-                if self.uart.any():
-                    data = self.uart.read()
-                    if data:
-                        buffer += data.decode('utf-8')
-                        if '\n' in buffer:
-                            lines = buffer.split('\n')
-                            for line in lines[:-1]:
-                                line = line.strip()
-                                print(f"Received serial message: {line}")
-                                return line
-                            buffer = lines[-1]
-                    start_time = time.ticks_ms()  # Reset the timeout timer
-                if time.ticks_ms() - start_time > self.TIMEOUT:
-                    if buffer:
-                        print(f"Received partial message: {buffer.strip()}")
-                    return buffer.strip()
-                time.sleep(0.1)
+                for message in self.read_messages():
+                    line = message.decode('utf-8').strip()
+                    print(f"Received serial message: {line}")
+                    return line
+                if time.ticks_diff(time.ticks_ms(), start_time) > self.TIMEOUT:
+                    return ""
+                time.sleep(0.001)
             except Exception as e:
                 print(f"Failed to read serial: {e}")
                 self.send_message("{\"error\": \"Failed to read serial\"}")
                 return None
-                
\ No newline at end of file
+
+    def _rx_fill(self):
+        """Moves the bytes waiting in the UART into the ring buffer. Returns how many were moved."""
+        if self.uart is None:
+            return 0
+        size = len(self.rx_buffer)
+        moved = 0
+        while True:
+            available = self.uart.any()
+            free = size - self.rx_count
+            if available == 0 or free == 0:
+                break
+            # Never ask for more than is waiting: readinto() would block until the UART timeout
+            n = self.uart.readinto(self.rx_chunk, min(free, len(self.rx_chunk), available))
+            if not n:
+                break
+            first = min(n, size - self.rx_head)
+            self.rx_view[self.rx_head:self.rx_head + first] = memoryview(self.rx_chunk)[:first]
+            if first < n:
+                self.rx_view[0:n - first] = memoryview(self.rx_chunk)[first:n]
+            self.rx_head = (self.rx_head + n) % size
+            self.rx_count += n
+            moved += n
+        self.bytes_received += moved
+        return moved
+
+    def _rx_take(self, length, skip):
+        """Removes length bytes (returned) plus skip separator bytes from the ring buffer."""
+        size = len(self.rx_buffer)
+        tail = self.rx_tail
+        end = tail + length
+        if end <= size:
+            data = bytes(self.rx_view[tail:end])
+        else:
+            data = bytes(self.rx_view[tail:size]) + bytes(self.rx_view[0:end - size])
+        self.rx_tail = (end + skip) % size
+        self.rx_count -= length + skip
+        self.rx_scan = 0
+        return data
+
+    def _rx_crc_ok(self, tail, frame_size):
+        """Checks the CRC of the frame starting at tail in the ring buffer, without removing it."""
+        ring = self.rx_buffer
+        size = len(ring)
+        first = tail + 2  # The CRC covers the frame after the sync bytes
+        end = tail + frame_size - CRC_SIZE
+        if first >= size:
+            first -= size
+            end -= size
+        if end <= size:
+            crc = crc16(ring, first, end)
+        else:
+            crc = crc16(ring, 0, end - size, crc16(ring, first, size))
+        return crc == ring[end % size] | (ring[(end + 1) % size] << 8)
+
+    def _rx_next(self):
+        """Returns the next complete line or binary frame in the ring buffer, or None."""
+        ring = self.rx_buffer
+        size = len(ring)
+        tail = self.rx_tail
+        count = self.rx_count
+        while count >= 2 and ring[tail] == SYNC[0] and ring[(tail + 1) % size] == SYNC[1]:
+            if count < HEADER_SIZE:
+                return None
+            frame_size = HEADER_SIZE + (ring[(tail + 6) % size] | (ring[(tail + 7) % size] << 8)) + CRC_SIZE
+            if frame_size <= size:
+                if count < frame_size:
+                    return None
+                if self._rx_crc_ok(tail, frame_size):
+                    return self._rx_take(frame_size, 0)
+                self.rx_crc_errors += 1
+            else:
+                self.rx_overflows += 1
+            # Corrupted length or CRC, drop the sync byte and look again
+            self._rx_take(1, 0)
+            tail = self.rx_tail
+            count = self.rx_count
+
+        i = self.rx_scan
+        while i < count:
+            if ring[(tail + i) % size] == 0x0A:
+                line = self._rx_take(i, 1)
+                if line and line[-1] == 0x0D:
+                    line = line[:-1]
+                return line
+            i += 1
+        self.rx_scan = count
+        if count == size:
+            # A full buffer without a newline cannot be a valid line, hand it over so it is not stuck
+            self.rx_overflows += 1
+            return self._rx_take(count, 0)
+        return None
@@ -2,9 +2,9 @@ from machine import I2C, Pin
 import time
 
 from actuators import KY006
-from communication import DS1302, UARTComm, JSONParser
+from communication import BinaryFrameEncoder, CommandHandler, DS1302, UARTComm, JSONParser, TelemetryRecord
 from utils import *
-from sensors import BME280, HC020K, HCSR04, INA219, KY026, L3GD20, LSM303, MQ135, SCD41
+from sensors import ADCSampler, BatteryEstimator, BME280, HC020K, HCSR04, HCSR04Array, I2CBus, INA219, KY026, L3GD20, LSM303, MQ135, SCD41
 
 def main():
     json_parser = None
@@ -12,21 +12,24 @@ def main():
     ds1302 = None
     hc020k = None
     hcsr04 = None
+    ranging = None
     ky006 = None
+    adc_sampler = None
+    timers = TimerService(TIMER_SERVICE_ID, TIMER_TICK_MS)
     ky026 = None
     mq135 = None
     i2c = None
     bme = None
     ina = None
+    battery = None
     l3gd20 = None
     lsm303d = None
     scd41 = None
     devices = None
     datetime_str = None
-    pressure_hpa = None
     
     try:
-        json_parser = JSONParser()
+        json_parser = JSONParser(delta=TELEMETRY_DELTA, keyframe_interval=KEYFRAME_INTERVAL, deadbands=TELEMETRY_DEADBANDS)
     except Exception as e:
         error_print(f"Error initializing JSON parser: {e}")
     
@@ -58,13 +61,13 @@ def main():
         try:
             hc020k = {}
             if ENABLE_HC020K.get("front_left", False):
-                hc020k["front_left"] = HC020K(pin=14, interrupt_type=Pin.IRQ_RISING)
+                hc020k["front_left"] = HC020K(pin=14, interrupt_type=Pin.IRQ_RISING, timers=timers)
             if ENABLE_HC020K.get("front_right", False):
-                hc020k["front_right"] = HC020K(pin=15, interrupt_type=Pin.IRQ_RISING)
+                hc020k["front_right"] = HC020K(pin=15, interrupt_type=Pin.IRQ_RISING, timers=timers)
             if ENABLE_HC020K.get("rear_left", False):
-                hc020k["rear_left"] = HC020K(pin=5, interrupt_type=Pin.IRQ_RISING)
+                hc020k["rear_left"] = HC020K(pin=5, interrupt_type=Pin.IRQ_RISING, timers=timers)
             if ENABLE_HC020K.get("rear_right", False):
-                hc020k["rear_right"] = HC020K(pin=2, interrupt_type=Pin.IRQ_FALLING)
+                hc020k["rear_right"] = HC020K(pin=2, interrupt_type=Pin.IRQ_FALLING, timers=timers)
         except Exception as e:
             json_parser.add_data("error", f"Error initializing HC020K: {e}")
             message = json_parser.get_json_message()
@@ -85,6 +88,7 @@ def main():
                 hcsr04["right"] = HCSR04(trig_pin=33, echo_pin=39)
             if ENABLE_HCSR04.get("rear", False):
                 hcsr04["rear"] = HCSR04(trig_pin=32, echo_pin=36)
+            ranging = HCSR04Array(hcsr04)  # Spacing derived from the range and the sensor cycle
         except Exception as e:
             json_parser.add_data("error", f"Error initializing HCSR04: {e}")
             message = json_parser.get_json_message()
@@ -96,7 +100,7 @@ def main():
             
     if ENABLE_KY006:
         try:
-            ky006 = KY006(pin=13)
+            ky006 = KY006(pin=13, timers=timers)
         except Exception as e:
             json_parser.add_data("error", f"Error initializing KY006: {e}")
             message = json_parser.get_json_message()
@@ -106,9 +110,15 @@ def main():
             json_parser.clear_json_message()
             error_print(f"Error initializing KY006: {e}")
             
+    if ENABLE_KY026 or ENABLE_MQ135:
+        try:
+            adc_sampler = ADCSampler(timers=timers)
+        except Exception as e:
+            error_print(f"Error initializing ADC sampler: {e}")
+
     if ENABLE_KY026:
         try:
-            ky026 = KY026(pin=4)
+            ky026 = KY026(pin=4, sampler=adc_sampler)
         except Exception as e:
             json_parser.add_data("error", f"Error initializing KY026: {e}")
             message = json_parser.get_json_message()
@@ -120,7 +130,7 @@ def main():
         
     if ENABLE_MQ135:
         try:
-            mq135 = MQ135(adc_pin=27)
+            mq135 = MQ135(adc_pin=27, sampler=adc_sampler)
         except Exception as e:
             json_parser.add_data("error", f"Error initializing MQ135: {e}")
             message = json_parser.get_json_message()
@@ -129,10 +139,22 @@ def main():
                 comm.send_message(message)
             json_parser.clear_json_message()
             error_print(f"Error initializing MQ135: {e}")
+
+    if adc_sampler:
+        try:
+            adc_sampler.start()
+        except Exception as e:
+            error_print(f"Error starting ADC sampler: {e}")
+
+    try:
+        timers.start()
+    except Exception as e:
+        error_print(f"Error starting the timer service: {e}")
     
     if ENABLE_I2C:
         try:
-            i2c = I2C(0, scl=Pin(I2C_SCL_PIN), sda=Pin(I2C_SDA_PIN), freq=I2C_FREQ)
+            i2c = I2CBus(None, factory=lambda freq: I2C(0, scl=Pin(I2C_SCL_PIN), sda=Pin(I2C_SDA_PIN), freq=freq, timeout=I2C_TIMEOUT_US), frequency=I2C_FREQ, frequencies=I2C_FREQUENCIES)
+            i2c.set_policy(SCD41.SCD41_I2C_ADDRESS, retries=0)  # The SCD41 driver retries with its own backoff
             devices = i2c.scan()
             while True:
                 if devices:
@@ -194,7 +216,10 @@ def main():
                 #         json_parser.clear_json_message()
                 #         time.sleep(1)
                 #         devices = i2c.scan()
-                ina = INA219(i2c)     
+                ina = INA219(i2c)
+                # Average 16 conversions of each ADC (8.5 ms each), smoothing motor noise between readings
+                ina.configure(bus_adc=INA219.ADC_16SAMP, shunt_adc=INA219.ADC_16SAMP)
+                battery = BatteryEstimator(BATTERY_CAPACITY_MAH)
             except Exception as e:
                 json_parser.add_data("error", f"Error initializing INA219: {e}")
                 message = json_parser.get_json_message()
@@ -219,6 +244,7 @@ def main():
                 #         time.sleep(1)
                 #         devices = i2c.scan()
                 l3gd20 = L3GD20(i2c)
+                l3gd20.start_stream()
             except Exception as e:
                 json_parser.add_data("error", f"Error initializing L3GD20: {e}")
                 message = json_parser.get_json_message()
@@ -287,7 +313,7 @@ def main():
                 #         json_parser.clear_json_message()
                 #         time.sleep(1)
                 #         devices = i2c.scan()
-                scd41 = SCD41(i2c)
+                scd41 = SCD41(i2c, mode=SCD41.mode_for_period(SCD41_SAMPLE_INTERVAL), interval_ms=SCD41_SAMPLE_INTERVAL)
             except Exception as e:
                 json_parser.add_data("error", f"Error initializing SCD41: {e}")
                 message = json_parser.get_json_message()
@@ -298,174 +324,437 @@ def main():
                 json_parser.clear_json_message()
                 error_print(f"Error initializing SCD41: {e}")
 
-    while True:
+        if I2C_AUTOTUNE and i2c:
+            try:
+                probes = [device.check_id for device in (bme, ina, l3gd20, lsm303d, scd41) if device]
+                frequency = i2c.autotune(probes)
+                print(f"I2C clock set to {frequency} Hz, errors per step: {i2c.tune_errors}")
+            except Exception as e:
+                error_print(f"Error tuning the I2C clock: {e}")
+
+    fusion = None
+    if ENABLE_IMU_FUSION and ENABLE_L3GD20 and l3gd20 and ENABLE_LSM303D and lsm303d:
+        fusion = MadgwickAHRS(FUSION_BETA)
+        fusion_dt = 1 / l3gd20.rate_hz
+
+    odometry = None
+    if hc020k:
+        left = [hc020k[key] for key in ("front_left", "rear_left") if key in hc020k]
+        right = [hc020k[key] for key in ("front_right", "rear_right") if key in hc020k]
+        if left and right:
+            odometry = Odometry(left, right, ODOMETRY_TRACK_CM)
+            odometry_ms = ticks_ms()
+
+    record = TelemetryRecord() if TELEMETRY_FORMAT == "binary" else None
+    latest = LatestValues(record)
+    scheduler = Scheduler(SAMPLING_PROFILE)
+    if i2c:
+        latest.publish_once("i2c_frequency", i2c.frequency)
+
+    def now():
+        if ENABLE_DS1302:
+            return datetime_str
+        return ticks_ms() / 60000
+
+    def read_ds1302():
+        nonlocal datetime_str
+        try:
+            timestamp = ds1302.date_time()
+            latest.publish("timestamp", format_iso_datetime(timestamp))
+            datetime_str = format_brt_datetime(timestamp, ds1302.weekday_string(timestamp[3]))
+        except Exception as e:
+            latest.publish_once("error_ds1302", f"Error reading DS1302 data: {e}")
+            error_print(f"Error reading DS1302 data: {e}")
+
+    def read_bme280():
         try:
-            if ENABLE_DS1302:
-                try:
-                    timestamp = ds1302.date_time()
-                    datetime_str_iso = format_iso_datetime(timestamp)
-                    json_parser.add_data("timestamp", datetime_str_iso)
-                    datetime_str = format_brt_datetime(timestamp, ds1302.weekday_string(timestamp[3]))
-                except Exception as e:
-                    json_parser.add_data("error_ds1302", f"Error reading DS1302 data: {e}")
-                    error_print(f"Error reading DS1302 data: {e}")
+            temp, pressure, humidity = bme.read_compensated_data()
+            if temp is not None and pressure is not None and humidity is not None:
+                pressure_hpa = pressure / 100
+                info_print(f"[{now()}] Temperature: {temp:.3f} Celsius; Pressure: {pressure_hpa:.3f} hPa; Humidity: {humidity:.3f}%")
+                latest.publish("temperature", temp)
+                latest.publish("pressure", pressure_hpa)
+                latest.publish("humidity", humidity)
+        except Exception as e:
+            latest.publish_once("error_bme280", f"Error reading BME280 data: {e}")
+            error_print(f"Error reading BME280 data: {e}")
+
+    def hc020k_reader(key, sensor):
+        def read_hc020k():
+            try:
+                speed = sensor.get_speed_cmps()
+                if speed is not None:
+                    info_print(f"[{now()}] HC020K {key} - Speed: {speed:.3f} cm/s")
+                    latest.publish(f"speed.{key}", speed)
+                distance = sensor.get_distance_traveled_m()
+                if distance is not None:
+                    info_print(f"[{now()}] HC020K {key} - Distance: {distance:.3f} m")
+                    latest.publish(f"traveled.{key}", distance)
+            except Exception as e:
+                latest.publish_once("error_hc020k", f"Error reading HC020K data: {e}")
+                error_print(f"Error reading HC020K data: {e}")
+        return read_hc020k
+
+    distance_keys = tuple(f"distance.{key}" for key in ranging.names) if ranging else ()
+
+    def read_hcsr04():
+        try:
+            ranging.step()
+            for i in range(len(distance_keys)):
+                latest.publish(distance_keys[i], ranging.filtered[i])
+        except Exception as e:
+            latest.publish_once("error_hcsr04", f"Error reading HCSR04 data: {e}")
+            error_print(f"Error reading HCSR04 data: {e}")
+
+    def read_ina219():
+        try:
+            sample = ina.snapshot()
+            battery.update(sample.current, sample.voltage)
+            latest.publish("bus_voltage", sample.voltage)
+            latest.publish("current", sample.current)
+            latest.publish("power", sample.power)
+            latest.publish("battery_percentage", battery.soc)
+            remaining = battery.remaining_minutes()
+            if remaining is not None:
+                latest.publish("battery_remaining_minutes", remaining)
+            info_print(f"[{now()}] INA219 - Bus Voltage: %.3f V, Current: %.3f mA, Power: %.3f mW, Battery: %.3f%%" % (sample.voltage, sample.current, sample.power, battery.soc))
+        except Exception as e:
+            latest.publish_once("error_ina219", f"Error reading INA219: {e}")
+            error_print(f"Error reading INA219: {e}")
+
+    def read_ky026():
+        try:
+            if ky026.is_flame_detected():
+                info_print(f"[{now()}] Flame detected!")
+                latest.publish("flame", True)
+                if ENABLE_KY006:
+                    ky006.sound_alarm('flame')
             else:
-                datetime_str = time.ticks_ms() / 60000
-
-            if ENABLE_BME280 and ENABLE_I2C:
-                try:
-                    temp, pressure, humidity = bme.read_compensated_data()
-                    if pressure is not None:
-                        pressure_hpa = pressure / 100
-                    if temp is not None and pressure is not None and humidity is not None:
-                        info_print(f"[{datetime_str}] Temperature: {temp:.3f} Celsius; Pressure: {pressure_hpa:.3f} hPa; Humidity: {humidity:.3f}%")
-                        json_parser.add_data("temperature", temp)
-                        json_parser.add_data("pressure", pressure_hpa)
-                        json_parser.add_data("humidity", humidity)
-                except Exception as e:
-                    json_parser.add_data("error_bme280", f"Error reading BME280 data: {e}")
-                    error_print(f"Error reading BME280 data: {e}")
-                    temp = None
-                    pressure_hpa = None
-                    humidity = None
+                latest.publish("flame", False)
+        except Exception as e:
+            latest.publish_once("error_ky026", f"Error reading KY026: {e}")
+            error_print(f"Error reading KY026: {e}")
+
+    flame_pending = False  # A flame event the callback could not queue, sent by the uart_tx task
+
+    def on_flame(timestamp_us):
+        # Scheduled right after the flame interrupt, it may run in the middle of any
+        # task: KY006 only takes a request here, and the UART refuses the event if
+        # the callback interrupted it, leaving it to the uart_tx task
+        nonlocal flame_pending
+        if ENABLE_KY006 and ky006:
+            ky006.sound_alarm('flame')
+        if comm and not comm.send_urgent(FLAME_EVENT):
+            flame_pending = True
+
+    def poll_uart():
+        nonlocal flame_pending
+        if flame_pending:
+            flame_pending = False
+            comm.send_message(FLAME_EVENT, priority=True)
+        comm.poll()
+
+    def read_mq135():
+        try:
+            temp = latest.get("temperature")
+            humidity = latest.get("humidity")
+            if temp is not None and humidity is not None:
+                co2, nh3 = mq135.get_gas_concentrations(temp, humidity)
             else:
-                temp = None
-                pressure_hpa = None
-                humidity = None
-            
-            if any(ENABLE_HC020K.values()):
-                try:
-                    for key, sensor in hc020k.items():
-                        speed = sensor.get_speed_cmps()
-                        if speed is not None:
-                            info_print(f"[{datetime_str}] HC020K {key} - Speed: {speed:.3f} cm/s")
-                            json_parser.add_data(f"speed.{key}", speed)
-                        distance = sensor.get_distance_traveled_m()
-                        if distance is not None:
-                            info_print(f"[{datetime_str}] HC020K {key} - Distance: {distance:.3f} m")
-                            json_parser.add_data(f"traveled.{key}", distance)
-                except Exception as e:
-                    json_parser.add_data("error_hc020k", f"Error reading HC020K data: {e}")
-                    error_print(f"Error reading HC020K data: {e}")
-            
-            if any(ENABLE_HCSR04.values()):
-                try:
-                    for key, sensor in hcsr04.items():
-                        distance = sensor.measure_median()
-                        if distance is not None:
-                            info_print(f"[{datetime_str}] HCSR04 {key} - Distance: {distance:.3f} cm")
-                            json_parser.add_data(f"distance.{key}", distance)
-                except Exception as e:
-                    json_parser.add_data("error_hcsr04", f"Error reading HCSR04 data: {e}")
-                    error_print(f"Error reading HCSR04 data: {e}")
-            
-            if ENABLE_INA219 and ENABLE_I2C:
-                try:
-                    json_parser.add_data("bus_voltage", ina.voltage())
-                    json_parser.add_data("current", ina.current())
-                    json_parser.add_data("power", ina.power())
-                    json_parser.add_data("battery_percentage", ina.battery_percentage())
-                    info_print(f"[{datetime_str}] INA219 - Bus Voltage: %.3f V, Current: %.3f mA, Power: %.3f mW, Battery: %.3f%%" % (ina.voltage(), ina.current(), ina.power(), ina.battery_percentage()))
-                except Exception as e:
-                    json_parser.add_data("error_ina219", f"Error reading INA219: {e}")
-                    error_print(f"Error reading INA219: {e}")
-            
-            if ENABLE_KY026:
-                try:
-                    if ky026.is_flame_detected():
-                        info_print(f"[{datetime_str}] Flame detected!")
-                        if ENABLE_KY006:
-                            ky006.sound_alarm('flame')
-                        json_parser.add_data("flame", True)
-                    else:
-                        info_print(f"[{datetime_str}] No flame detected.")
-                        json_parser.add_data("flame", False)
-                except Exception as e:
-                    json_parser.add_data("error_ky026", f"Error reading KY026: {e}")
-                    error_print(f"Error reading KY026: {e}")
-            
-            if ENABLE_MQ135:
-                raw_nh3 = mq135.read_raw_data()
-                info_print(f"[{datetime_str}] Raw MQ135 ADC: {raw_nh3}")
-                json_parser.add_data("raw_nh3", raw_nh3)
-                try:
-                    if temp is not None and humidity is not None:
-                        co2, nh3 = mq135.get_gas_concentrations(temp, humidity)
-                    else:
-                        co2, nh3 = mq135.get_gas_concentrations()
-                    if nh3 is not None:
-                        info_print(f"[{datetime_str}] MQ135 - Ammonia (NH3) concentration: {nh3:.3f} ppb")
-                        json_parser.add_data("nh3", nh3)
-                        if nh3 > NH3_THRESHOLD:
-                            if ENABLE_KY006:
-                                ky006.sound_alarm('nh3')
-                            json_parser.add_data("nh3_alarm", True)
-                        else:
-                            json_parser.add_data("nh3_alarm", False)
-                except Exception as e:
-                    json_parser.add_data("error_mq135", f"Error reading MQ135 data: {e}")
-                    error_print(f"Error reading MQ135 data: {e}")
-            
-            if ENABLE_L3GD20 and ENABLE_I2C:
-                try:
-                    gyro_data = l3gd20.gyro
-                    json_parser.add_data("gyroscope.x", gyro_data[0])
-                    json_parser.add_data("gyroscope.y", gyro_data[1])
-                    json_parser.add_data("gyroscope.z", gyro_data[2])
-                    info_print(f"[{datetime_str}] L3GD20 - Gyroscope: %.3f rad/s, %.3f rad/s, %.3f rad/s" % (gyro_data[0], gyro_data[1], gyro_data[2]))
-                except Exception as e:
-                    json_parser.add_data("error_l3gd20", f"Error reading L3GD20: {e}")
-                    error_print(f"Error reading L3GD20: {e}")
-                
-            if ENABLE_LSM303D and ENABLE_I2C:
-                try:
-                    accel_data = lsm303d.read_accel()
-                    mag_data = lsm303d.read_mag()
-                    json_parser.add_data("accelerometer.x", accel_data[0])
-                    json_parser.add_data("accelerometer.y", accel_data[1])
-                    json_parser.add_data("accelerometer.z", accel_data[2])
-                    json_parser.add_data("magnetometer.x", mag_data[0])
-                    json_parser.add_data("magnetometer.y", mag_data[1])
-                    json_parser.add_data("magnetometer.z", mag_data[2])
-                    info_print(f"[{datetime_str}] LSM303D - Accelerometer: %.3f m/s^2, %.3f m/s^2, %.3f m/s^2, Magnetometer: %.3f uT, %.3f uT, %.3f uT" % (accel_data[0], accel_data[1], accel_data[2], mag_data[0], mag_data[1], mag_data[2]))
-                except Exception as e:
-                    json_parser.add_data("error_lsm303d", f"Error reading LSM303D: {e}")
-                    error_print(f"Error reading LSM303D: {e}")
-                    
-            if ENABLE_SCD41 and ENABLE_I2C:
-                try:
-                    if ENABLE_BME280 and pressure_hpa is not None:
-                        co2_scd41, t_scd41, rh_scd41 = scd41.read_measurement(int(pressure_hpa))
-                    else:
-                        co2_scd41, t_scd41, rh_scd41 = scd41.read_measurement()
-                    if co2_scd41 is not None and co2_scd41 > 0:
-                        info_print(f"[{datetime_str}] SCD41 - Carbon dioxide (CO2) concentration: {co2_scd41:.0f} ppm")
-                        json_parser.add_data("co2", co2_scd41)
-                        if co2_scd41 > CO2_THRESHOLD:
-                            if ENABLE_KY006:
-                                ky006.sound_alarm('co2')
-                            json_parser.add_data("co2_alarm", True)
-                        else:
-                            json_parser.add_data("co2_alarm", False)
-                    else:
-                        info_print("Failed to read SCD41 measurement")
-                except Exception as e:
-                    json_parser.add_data("error_scd41", f"Error reading SCD41 data: {e}")
-                    error_print(f"Error reading SCD41 data: {e}")
-                    
-            message = json_parser.get_json_message()
-            info_print(f"JSON message: {message}")
-            
-            if ENABLE_UART_COMM:
-                if message:
-                    comm.send_message(message)
-            
-            time.sleep(0.1)
-            
-            json_parser.clear_json_message()
-            
+                co2, nh3 = mq135.get_gas_concentrations()
+            raw_nh3 = mq135.raw_adc
+            info_print(f"[{now()}] Raw MQ135 ADC: {raw_nh3}")
+            latest.publish("raw_nh3", raw_nh3)
+            if nh3 is not None:
+                info_print(f"[{now()}] MQ135 - Ammonia (NH3) concentration: {nh3:.3f} ppb")
+                latest.publish("nh3", nh3)
+                if nh3 > NH3_THRESHOLD:
+                    latest.publish("nh3_alarm", True)
+                    if ENABLE_KY006:
+                        ky006.sound_alarm('nh3')
+                else:
+                    latest.publish("nh3_alarm", False)
+        except Exception as e:
+            latest.publish_once("error_mq135", f"Error reading MQ135 data: {e}")
+            error_print(f"Error reading MQ135 data: {e}")
+
+    def read_l3gd20():
+        try:
+            block = l3gd20.read_fifo()
+            n = len(block) // 3
+            if n == 0:
+                return
+            # Every sample since the last run, averaged for the telemetry
+            gyro_data = [0.0, 0.0, 0.0]
+            for i in range(len(block)):
+                gyro_data[i % 3] += block[i]
+            for axis in range(3):
+                gyro_data[axis] /= n
+            latest.publish("gyroscope.x", gyro_data[0])
+            latest.publish("gyroscope.y", gyro_data[1])
+            latest.publish("gyroscope.z", gyro_data[2])
+            info_print(f"[{now()}] L3GD20 - Gyroscope: %.3f rad/s, %.3f rad/s, %.3f rad/s" % (gyro_data[0], gyro_data[1], gyro_data[2]))
+        except Exception as e:
+            latest.publish_once("error_l3gd20", f"Error reading L3GD20: {e}")
+            error_print(f"Error reading L3GD20: {e}")
+
+    def read_lsm303d():
+        try:
+            accel_data, mag_data = lsm303d.read_accel_mag()
+            latest.publish("accelerometer.x", accel_data[0])
+            latest.publish("accelerometer.y", accel_data[1])
+            latest.publish("accelerometer.z", accel_data[2])
+            latest.publish("magnetometer.x", mag_data[0])
+            latest.publish("magnetometer.y", mag_data[1])
+            latest.publish("magnetometer.z", mag_data[2])
+            info_print(f"[{now()}] LSM303D - Accelerometer: %.3f m/s^2, %.3f m/s^2, %.3f m/s^2, Magnetometer: %.3f uT, %.3f uT, %.3f uT" % (accel_data[0], accel_data[1], accel_data[2], mag_data[0], mag_data[1], mag_data[2]))
+        except Exception as e:
+            latest.publish_once("error_lsm303d", f"Error reading LSM303D: {e}")
+            error_print(f"Error reading LSM303D: {e}")
+
+    def read_imu():
+        try:
+            # Every gyroscope sample since the last run, with the latest accelerometer and magnetometer values
+            block = l3gd20.read_fifo()
+            accel_data, mag_data = lsm303d.read_accel_mag()
+            ax, ay, az = accel_data
+            mx, my, mz = mag_data
+            for i in range(0, len(block), 3):
+                fusion.update(block[i], block[i + 1], block[i + 2], ax, ay, az, mx, my, mz, fusion_dt)
+            q = fusion.q
+            heading = fusion.heading()
+            pitch = fusion.pitch()
+            roll = fusion.roll()
+            latest.publish("orientation.heading", heading)
+            latest.publish("orientation.pitch", pitch)
+            latest.publish("orientation.roll", roll)
+            latest.publish("quaternion.w", q[0])
+            latest.publish("quaternion.x", q[1])
+            latest.publish("quaternion.y", q[2])
+            latest.publish("quaternion.z", q[3])
+            info_print(f"[{now()}] IMU - Heading: %.1f deg, Pitch: %.1f deg, Roll: %.1f deg" % (heading, pitch, roll))
+        except Exception as e:
+            latest.publish_once("error_imu", f"Error reading IMU: {e}")
+            error_print(f"Error reading IMU: {e}")
+
+    def update_odometry():
+        nonlocal odometry_ms
+        try:
+            current_ms = ticks_ms()
+            dt = ticks_diff(current_ms, odometry_ms) / 1000
+            odometry_ms = current_ms
+            yaw = fusion.yaw() if fusion and ODOMETRY_USE_GYRO else None
+            odometry.update(yaw, dt)
+            x, y, heading = odometry.pose()
+            p = odometry.covariance
+            latest.publish("position.x", x)
+            latest.publish("position.y", y)
+            latest.publish("position.heading", heading)
+            latest.publish("position.var_x", p[0])
+            latest.publish("position.var_y", p[3])
+            latest.publish("position.cov_xy", p[1])
+            latest.publish("position.var_heading", p[5])
+        except Exception as e:
+            latest.publish_once("error_odometry", f"Error updating odometry: {e}")
+            error_print(f"Error updating odometry: {e}")
+
+    def reset_odometry(args):
+        odometry.reset(args.get("x", 0.0), args.get("y", 0.0), args.get("heading", 0.0))
+
+    def read_scd41():
+        try:
+            pressure_hpa = latest.get("pressure")
+            if ENABLE_BME280 and pressure_hpa is not None:
+                updated = scd41.update(int(pressure_hpa))
+            else:
+                updated = scd41.update()
+            if updated:
+                co2_scd41 = scd41.co2
+                info_print(f"[{now()}] SCD41 - Carbon dioxide (CO2) concentration: {co2_scd41:.0f} ppm")
+                latest.publish("co2", co2_scd41)
+                if co2_scd41 > CO2_THRESHOLD:
+                    latest.publish("co2_alarm", True)
+                    if ENABLE_KY006:
+                        ky006.sound_alarm('co2')
+                else:
+                    latest.publish("co2_alarm", False)
+            else:
+                staleness = scd41.staleness_ms()
+                if staleness is not None and staleness > SCD41_STALE_MS:
+                    latest.publish_once("error_scd41", f"SCD41 data stale for {staleness} ms ({scd41.errors} errors)")
         except Exception as e:
-            error_print(f"An error occurred: {e}")
+            latest.publish_once("error_scd41", f"Error reading SCD41 data: {e}")
+            error_print(f"Error reading SCD41 data: {e}")
+
+    frame_encoder = BinaryFrameEncoder() if TELEMETRY_FORMAT == "binary" else None
+    reported_misses = 0
+    reported_i2c_failures = 0
+
+    def send_binary_telemetry():
+        nonlocal reported_misses, reported_i2c_failures
+        length = frame_encoder.encode_record(record)
+        if ENABLE_UART_COMM:
+            comm.send_frame(frame_encoder.buffer, length)  # Full state, a newer one may replace it
+
+        # Errors and new deadline misses are rare, they go in an extra frame only when present;
+        # it is sent once, so it must not be replaced
+        extras = latest.pop_events()
+        total_misses = scheduler.total_deadline_misses()
+        if total_misses != reported_misses:
+            reported_misses = total_misses
+            if extras is None:
+                extras = {}
+            for name, misses in scheduler.deadline_misses().items():
+                extras[f"deadline_misses.{name}"] = misses
+        failures = i2c.total_failures() if i2c else 0
+        if failures != reported_i2c_failures:
+            reported_i2c_failures = failures
+            if extras is None:
+                extras = {}
+            extras["i2c_failures"] = failures
+            extras["i2c_frequency"] = i2c.frequency  # Errors may have lowered the clock
+        if extras:
+            frame = frame_encoder.encode(extras)
+            info_print(f"Binary frame: {len(frame)} bytes")
+            if ENABLE_UART_COMM and not comm.send_frame(frame, replaceable=False):
+                for key, value in extras.items():
+                    latest.publish_once(key, value)  # Retried with the next cycle
+
+    def send_telemetry():
+        if frame_encoder:
+            send_binary_telemetry()
+            return
+
+        one_shot = bool(latest.events)
+        snapshot = latest.snapshot()
+        for name, misses in scheduler.deadline_misses().items():
+            snapshot[f"deadline_misses.{name}"] = misses
+        if i2c:
+            snapshot["i2c_failures"] = i2c.total_failures()
+            snapshot["i2c_frequency"] = i2c.frequency
+
+        for key, value in snapshot.items():
+            json_parser.add_data(key, value)
+        message = json_parser.get_json_message()
+        info_print(f"JSON message: {message}")
+
+        if ENABLE_UART_COMM:
+            if message:
+                # Only a full state without one-shot values can be replaced by the next one:
+                # a lost delta leaves the host state wrong until the next keyframe
+                if not comm.send_message(message, replaceable=json_parser.keyframe and not one_shot):
+                    json_parser.request_keyframe()  # The host missed the changes this message carried
+
+        json_parser.clear_json_message()
+
+    commands = CommandHandler()
+
+    def set_period(args):
+        name = args.get("task")
+        period = args.get("period")
+        if name == "hcsr04" and ranging and period is not None:
+            ranging.set_spacing(period)  # The engine fires one group per period; raises before the task changes
+        return scheduler.configure(name, period, args.get("deadline"), args.get("priority"))
+
+    def get_stats(args):
+        name = args.get("task")
+        if name is not None:
+            if name not in scheduler.tasks:
+                raise ValueError(f"Unknown task {name}")
+            return scheduler.tasks[name].stats()
+        stats = {
+            "utilization": scheduler.utilization(),
+            "deadline_misses": scheduler.deadline_misses(),
+            "uart": comm.stats(),
+            "commands": commands.stats()
+        }
+        if ky026:
+            stats["flame"] = ky026.stats()
+        if scd41:
+            stats["scd41"] = scd41.stats()
+        stats["register_cache"] = {name: device.registers.stats() for name, device in (("bme280", bme), ("ina219", ina), ("scd41", scd41)) if device}
+        return stats
+
+    def request_keyframe(args):
+        json_parser.request_keyframe()
+
+    def set_time(args):
+        # [year, month, day, weekday, hour, minute, second], weekday 0 = Sunday
+        date_time = args.get("datetime")
+        if not ds1302:
+            raise ValueError("DS1302 not available")
+        if not isinstance(date_time, list) or len(date_time) != 7:
+            raise ValueError("datetime must be [year, month, day, weekday, hour, minute, second]")
+        ds1302.date_time(date_time)
+        read_ds1302()
+        return latest.get("timestamp")
+
+    def calibrate_mq135(args):
+        # Only in clean air; temperature and humidity default to the last BME280 readings
+        if not mq135:
+            raise ValueError("MQ135 not available")
+        temp = args.get("temperature", latest.get("temperature"))
+        humidity = args.get("humidity", latest.get("humidity"))
+        if temp is None or humidity is None:
+            return mq135.calibrate()
+        return mq135.calibrate(temp, humidity)
+
+    commands.register("set_period", set_period)
+    commands.register("enable", lambda args: scheduler.set_enabled(args.get("task"), True))
+    commands.register("disable", lambda args: scheduler.set_enabled(args.get("task"), False))
+    commands.register("tasks", lambda args: list(scheduler.tasks))
+    commands.register("stats", get_stats)
+    commands.register("keyframe", request_keyframe)
+    commands.register("set_time", set_time)
+    commands.register("calibrate_mq135", calibrate_mq135)
+    commands.register("battery", lambda args: battery.stats() if battery else {})
+    commands.register("battery_reset", lambda args: battery.reset(args.get("soc", 100)) if battery else None)
+    commands.register("odometry_reset", lambda args: reset_odometry(args) if odometry else None)
+    commands.register("odometry_direction", lambda args: odometry.set_direction(args.get("left", 1), args.get("right", 1)) if odometry else None)
+    commands.register("timers", lambda args: timers.stats())
+    commands.register("i2c", lambda args: {"clock": i2c.clock_stats(), "devices": i2c.stats()} if i2c else {})
+
+    def process_commands():
+        for message in comm.read_messages():
+            if message:
+                comm.send_message(commands.handle(message), replaceable=False)
+
+    if ENABLE_DS1302 and ds1302:
+        scheduler.add_task("ds1302", read_ds1302)
+    if ENABLE_BME280 and bme:
+        scheduler.add_task("bme280", read_bme280)
+    if hc020k:
+        for key, sensor in hc020k.items():
+            scheduler.add_task(f"hc020k.{key}", hc020k_reader(key, sensor))
+    if ranging:
+        scheduler.add_task("hcsr04", read_hcsr04, period_ms=ranging.spacing_ms)
+    if ENABLE_INA219 and ina:
+        scheduler.add_task("ina219", read_ina219)
+    if ENABLE_KY026 and ky026:
+        scheduler.add_task("ky026", read_ky026)
+        try:
+            ky026.watch(on_flame, digital_pin=KY026_DIGITAL_PIN)
+        except Exception as e:
+            error_print(f"Error watching KY026: {e}")
+    if ENABLE_MQ135 and mq135:
+        scheduler.add_task("mq135", read_mq135)
+    if fusion:
+        scheduler.add_task("imu", read_imu)
+    else:
+        if ENABLE_L3GD20 and l3gd20:
+            scheduler.add_task("l3gd20", read_l3gd20)
+        if ENABLE_LSM303D and lsm303d:
+            scheduler.add_task("lsm303d", read_lsm303d)
+    if ENABLE_SCD41 and scd41:
+        scheduler.add_task("scd41", read_scd41)
+    if odometry:
+        scheduler.add_task("odometry", update_odometry)
+    scheduler.add_task("telemetry", send_telemetry)
+    if ENABLE_UART_COMM and comm:
+        scheduler.add_task("uart_tx", poll_uart)
+        scheduler.add_task("commands", process_commands)
+
+    scheduler.run()
 
 if __name__ == "__main__":
     main()
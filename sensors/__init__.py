@@ -4,9 +4,12 @@ Sensor Module
 This module contains sensor drivers.
 """
 
+from .adc_sampler import ADCSampler, build_lut
+from .battery import BatteryEstimator
 from .bme280 import BME280
 from .hc020k import HC020K
-from .hcsr04 import HCSR04
+from .hcsr04 import HCSR04, HCSR04Array
+from .i2c_bus import I2CBus
 from .ina219 import INA219
 from .ky026 import KY026
 from .l3gd20 import L3GD20
@@ -0,0 +1,207 @@
+# ADC acquisition service
+# Samples the analog channels on a timer into ring buffers, so the drivers get
+# oversampled values without blocking on the ADC.
+
+from machine import ADC, Pin, Timer
+from array import array
+import time
+
+class ADCSampler:
+    """
+    Timer-driven sampler for several ADC channels.
+
+    Every period_ms the timer callback reads each channel once and stores the
+    raw value in the channel's ring buffer (array('H'), preallocated). mean(),
+    median() and max() then summarize the last n samples from the buffer.
+
+    ESP32 ADC readings are not linear, mostly near both ends of the range. An
+    optional lookup table, built with build_lut() from calibration points,
+    replaces each raw reading with the corrected one as it is stored.
+
+    watch() makes the callback check a channel against a threshold on every
+    sample, for events that cannot wait for the next read.
+    """
+    TIMER_ID = 1
+    PERIOD_MS = 5
+    BUFFER_SIZE = 64
+    MAX_RAW = 4095
+
+    def __init__(self, timer_id=TIMER_ID, period_ms=PERIOD_MS, size=BUFFER_SIZE, lut=None, timers=None):
+        """
+        :param timer_id: Hardware timer used for sampling, when no TimerService is given.
+        :param period_ms: Time between two samples of each channel.
+        :param size: Samples kept per channel.
+        :param lut: Optional array('H') of MAX_RAW + 1 corrected values, indexed by raw value.
+        :param timers: Optional TimerService to sample from instead of a hardware timer of its own.
+        """
+        if lut is not None and len(lut) != self.MAX_RAW + 1:
+            raise ValueError(f"Lookup table must have {self.MAX_RAW + 1} entries")
+        self.timer_id = timer_id
+        self.timer = None
+        self.timers = timers
+        self.job = None
+        self.period_ms = period_ms
+        self.size = size
+        self.lut = lut
+        self.pins = []
+        self.adcs = []
+        self.buffers = []
+        self.heads = array('i')  # Next write position of each channel
+        self.counts = array('i')  # Valid samples of each channel, up to size
+        self.thresholds = array('i')  # Watch threshold of each channel, -1 if not watched
+        self.above = bytearray()  # Watched channels currently above their threshold
+        self.watchers = []
+        self.scratch = array('H', [0] * size)  # Median sorting space
+        self.samples = 0
+
+    def add_channel(self, pin, atten=ADC.ATTN_11DB):
+        """
+        Registers an ADC pin, or returns the existing channel if it was already added.
+
+        :return: The channel index, used by the read methods.
+        """
+        if pin in self.pins:
+            return self.pins.index(pin)
+        adc = ADC(Pin(pin, Pin.IN))
+        adc.atten(atten)
+        # Lists only grow here, before the timer runs, so the callback never sees them change size
+        self.pins.append(pin)
+        self.adcs.append(adc)
+        self.buffers.append(array('H', [0] * self.size))
+        self.heads.append(0)
+        self.counts.append(0)
+        self.thresholds.append(-1)
+        self.above.append(0)
+        self.watchers.append(None)
+        return len(self.pins) - 1
+
+    def watch(self, channel, threshold, handler):
+        """
+        Calls handler(ticks_us) from the timer callback when a channel rises above threshold.
+
+        The handler runs in interrupt context: it must be short and should defer
+        the work with micropython.schedule().
+        """
+        self.watchers[channel] = handler
+        self.above[channel] = 0
+        self.thresholds[channel] = threshold
+
+    def start(self):
+        """Starts sampling. Add all channels before."""
+        if self.timers is not None:
+            if self.job is None:
+                self.job = self.timers.add("adc", self._sample, self.period_ms)
+            else:
+                self.timers.schedule(self.job)
+            return
+        if self.timer is None:
+            self.timer = Timer(self.timer_id)
+        self.timer.init(period=self.period_ms, mode=Timer.PERIODIC, callback=self._sample)
+
+    def stop(self):
+        if self.job is not None:
+            self.timers.cancel(self.job)
+        if self.timer is not None:
+            self.timer.deinit()
+
+    def _sample(self, timer):
+        lut = self.lut
+        size = self.size
+        for i in range(len(self.adcs)):
+            raw = self.adcs[i].read()
+            if lut is not None:
+                raw = lut[raw]
+            threshold = self.thresholds[i]
+            if threshold >= 0:
+                if raw > threshold:
+                    if not self.above[i]:
+                        self.above[i] = 1
+                        self.watchers[i](time.ticks_us())
+                else:
+                    self.above[i] = 0
+            head = self.heads[i]
+            self.buffers[i][head] = raw
+            self.heads[i] = (head + 1) % size
+            if self.counts[i] < size:
+                self.counts[i] += 1
+        self.samples += 1
+
+    def _window(self, channel, n):
+        count = self.counts[channel]
+        if n is None or n > count:
+            return count
+        return n
+
+    def latest(self, channel):
+        """Returns the last sample of a channel, or None before the first sample."""
+        if self.counts[channel] == 0:
+            return None
+        return self.buffers[channel][(self.heads[channel] - 1) % self.size]
+
+    def mean(self, channel, n=None):
+        """Returns the mean of the last n samples (all buffered samples by default), or None if there are none."""
+        n = self._window(channel, n)
+        if n == 0:
+            return None
+        buffer = self.buffers[channel]
+        head = self.heads[channel]
+        total = 0
+        for j in range(1, n + 1):
+            total += buffer[(head - j) % self.size]
+        return total / n
+
+    def max(self, channel, n=None):
+        """Returns the largest of the last n samples, or None if there are none."""
+        n = self._window(channel, n)
+        if n == 0:
+            return None
+        buffer = self.buffers[channel]
+        head = self.heads[channel]
+        highest = 0
+        for j in range(1, n + 1):
+            value = buffer[(head - j) % self.size]
+            if value > highest:
+                highest = value
+        return highest
+
+    def median(self, channel, n=None):
+        """Returns the median of the last n samples, or None if there are none."""
+        n = self._window(channel, n)
+        if n == 0:
+            return None
+        buffer = self.buffers[channel]
+        head = self.heads[channel]
+        scratch = self.scratch
+        # Insertion sort into the preallocated scratch array
+        for j in range(n):
+            value = buffer[(head - 1 - j) % self.size]
+            k = j
+            while k > 0 and scratch[k - 1] > value:
+                scratch[k] = scratch[k - 1]
+                k -= 1
+            scratch[k] = value
+        middle = n // 2
+        if n % 2 == 0:
+            return (scratch[middle - 1] + scratch[middle]) / 2
+        return scratch[middle]
+
+def build_lut(points, max_raw=ADCSampler.MAX_RAW):
+    """
+    Builds an ADC correction table by linear interpolation between calibration points.
+
+    :param points: (raw, corrected) pairs sorted by raw value, e.g. measured with a
+                   reference voltage, with corrected in ideal raw units (voltage / full scale * max_raw).
+    :return: array('H') of max_raw + 1 corrected values.
+    """
+    if len(points) < 2:
+        raise ValueError("At least two calibration points are needed")
+    lut = array('H', [0] * (max_raw + 1))
+    segment = 0
+    for raw in range(max_raw + 1):
+        while segment < len(points) - 2 and raw > points[segment + 1][0]:
+            segment += 1
+        raw0, value0 = points[segment]
+        raw1, value1 = points[segment + 1]
+        value = value0 + (value1 - value0) * (raw - raw0) / (raw1 - raw0)
+        lut[raw] = 0 if value < 0 else max_raw if value > max_raw else int(value + 0.5)
+    return lut
@@ -0,0 +1,152 @@
+# Battery state-of-charge estimator
+# Counts the charge drawn from the battery with the INA219 current readings
+# (coulomb counting) and corrects the drift with the open-circuit voltage
+# when the robot has been resting long enough for the voltage to settle.
+
+import json
+import time
+
+class BatteryEstimator:
+    """
+    State of charge from integrated current, with rest-voltage correction.
+
+    Feed update() with every INA219 sample; each call does constant work. The
+    remaining charge is saved to a file every SAVE_INTERVAL_MS and loaded at
+    boot, unless the resting voltage at boot shows the battery was charged or
+    swapped in the meantime.
+    """
+    CAPACITY_MAH = 2600
+    # Open-circuit voltage of the 4S pack (V) against state of charge (%), increasing
+    OCV_TABLE = (
+        (12.0, 0),
+        (13.6, 5),
+        (14.0, 10),
+        (14.4, 20),
+        (14.7, 30),
+        (14.9, 40),
+        (15.1, 50),
+        (15.3, 60),
+        (15.6, 70),
+        (15.9, 80),
+        (16.3, 90),
+        (16.8, 100)
+    )
+    REST_CURRENT_MA = 80  # Below this current, either way, the battery is resting
+    REST_TIME_MS = 120000  # Rest needed before the voltage is trusted
+    REST_GAIN = 0.05  # Share of the voltage estimate blended in per rested sample
+    RESYNC_SOC = 25  # Difference (%) at boot that makes the voltage replace the saved charge
+    AVERAGE_TIME_MS = 60000  # Time constant of the average current
+    SAVE_INTERVAL_MS = 300000
+    FILE = "battery.json"
+
+    def __init__(self, capacity_mah=CAPACITY_MAH, file=FILE):
+        self.capacity_mah = capacity_mah
+        self.file = file
+        self.charge_mah = self._load()  # None until the first sample when nothing was saved
+        self.average_current = 0  # mA
+        self.rest_ms = 0
+        self.corrections = 0
+        self.last_ms = None
+        self.saved_ms = time.ticks_ms()
+
+    def _load(self):
+        try:
+            with open(self.file) as f:
+                charge = json.load(f).get("charge_mah")
+            if charge is not None:
+                return min(max(charge, 0), self.capacity_mah)
+        except (OSError, ValueError, AttributeError, TypeError) as e:
+            print(f"No battery charge loaded: {e}")
+        return None
+
+    def save(self):
+        try:
+            with open(self.file, "w") as f:
+                json.dump({"charge_mah": self.charge_mah}, f)
+        except OSError as e:
+            print(f"Error saving battery charge: {e}")
+        self.saved_ms = time.ticks_ms()
+
+    def soc_from_voltage(self, voltage):
+        """Returns the state of charge (%) of a resting voltage, interpolated in OCV_TABLE."""
+        table = self.OCV_TABLE
+        if voltage <= table[0][0]:
+            return table[0][1]
+        for i in range(1, len(table)):
+            if voltage < table[i][0]:
+                v0, soc0 = table[i - 1]
+                v1, soc1 = table[i]
+                return soc0 + (soc1 - soc0) * (voltage - v0) / (v1 - v0)
+        return table[-1][1]
+
+    def update(self, current_ma, voltage, now_ms=None):
+        """
+        Adds one sample.
+
+        :param current_ma: Battery current in mA, positive discharging and negative charging.
+        :param voltage: Battery voltage in V.
+        """
+        if now_ms is None:
+            now_ms = time.ticks_ms()
+        if self.last_ms is None:
+            self.last_ms = now_ms
+            self.average_current = current_ma
+            if abs(current_ma) < self.REST_CURRENT_MA:
+                estimate = self.soc_from_voltage(voltage) * self.capacity_mah / 100
+                if self.charge_mah is None or abs(estimate - self.charge_mah) > self.RESYNC_SOC * self.capacity_mah / 100:
+                    self.charge_mah = estimate
+            if self.charge_mah is None:
+                # Loaded battery and no saved charge: the voltage is all there is
+                self.charge_mah = self.soc_from_voltage(voltage) * self.capacity_mah / 100
+            return
+
+        elapsed_ms = time.ticks_diff(now_ms, self.last_ms)
+        self.last_ms = now_ms
+        if elapsed_ms <= 0:
+            return
+
+        charge = self.charge_mah - current_ma * elapsed_ms / 3600000
+        weight = min(1.0, elapsed_ms / self.AVERAGE_TIME_MS)
+        self.average_current += (current_ma - self.average_current) * weight
+
+        if abs(current_ma) < self.REST_CURRENT_MA:  # Charging voltage is no resting voltage either
+            self.rest_ms += elapsed_ms
+            if self.rest_ms >= self.REST_TIME_MS:
+                estimate = self.soc_from_voltage(voltage) * self.capacity_mah / 100
+                charge += (estimate - charge) * self.REST_GAIN
+                self.corrections += 1
+        else:
+            self.rest_ms = 0
+        self.charge_mah = min(max(charge, 0), self.capacity_mah)
+
+        if time.ticks_diff(now_ms, self.saved_ms) >= self.SAVE_INTERVAL_MS:
+            self.save()
+
+    def reset(self, soc=100):
+        """Sets the state of charge (%), e.g. after a full charge."""
+        self.charge_mah = self.capacity_mah * soc / 100
+        self.rest_ms = 0
+        self.save()
+
+    @property
+    def soc(self):
+        """State of charge in %, or None before the first sample."""
+        if self.charge_mah is None:
+            return None
+        return self.charge_mah * 100 / self.capacity_mah
+
+    def remaining_minutes(self):
+        """Runtime left at the average draw, or None while resting."""
+        if self.charge_mah is None or self.average_current < self.REST_CURRENT_MA:
+            return None
+        return self.charge_mah / self.average_current * 60
+
+    def stats(self):
+        return {
+            "soc": self.soc,
+            "charge_mah": self.charge_mah,
+            "average_current": self.average_current,
+            "remaining_minutes": self.remaining_minutes(),
+            "rest_ms": self.rest_ms,
+            "corrections": self.corrections
+        }
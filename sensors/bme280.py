@@ -5,6 +5,8 @@ import time
 from ustruct import unpack
 from array import array
 
+from .register_cache import RegisterCache
+
 class BME280:
     # BME280 default address
     BME280_I2CADDR = 0x76
@@ -16,6 +18,8 @@ class BME280:
     BME280_OSAMPLE_8 = 4
     BME280_OSAMPLE_16 = 5
 
+    BME280_REGISTER_CHIP_ID = 0xD0
+    BME280_CHIP_ID = 0x60
     BME280_REGISTER_CONTROL_HUM = 0xF2
     BME280_REGISTER_STATUS = 0xF3
     BME280_REGISTER_CONTROL = 0xF4
@@ -42,6 +46,7 @@ class BME280:
         if i2c is None:
             raise ValueError('An I2C object is required.')
         self.i2c = i2c
+        self.registers = RegisterCache(i2c, address)
         self.__sealevel = 101325
 
         # load calibration data
@@ -60,28 +65,46 @@ class BME280:
         # temporary data holders which stay allocated
         self._l1_barray = bytearray(1)
         self._l8_barray = bytearray(8)
+        self._status_data_blocks = ((self.BME280_REGISTER_STATUS, 1), (0xF7, 8))
+        self._read_batch = getattr(i2c, "read_batch", None)  # I2CBus only, a machine.I2C reads the data alone
+        # Maximum measurement time from the datasheet, oversampling codes 1..5 are x1..x16
+        self._measure_ms = int(1.25 + 2.3 * (1 << (self._mode_temp - 1)) + 2.3 * (1 << (self._mode_press - 1)) + 0.575 + 2.3 * (1 << (self._mode_hum - 1)) + 0.575) + 1
         self._l3_resultarray = array("i", [0, 0, 0])
 
         self._l1_barray[0] = self._mode_temp << 5 | self._mode_press << 2 | self.MODE_SLEEP
-        self.i2c.writeto_mem(self.address, self.BME280_REGISTER_CONTROL, self._l1_barray)
+        self.registers.write(self.BME280_REGISTER_CONTROL, self._l1_barray, force=True)
         self.t_fine = 0
 
+    def check_id(self):
+        """Reads the chip ID, a known value to validate the bus"""
+        return self.i2c.readfrom_mem(self.address, self.BME280_REGISTER_CHIP_ID, 1)[0] == self.BME280_CHIP_ID
+
     def read_raw_data(self, result):
         self._l1_barray[0] = self._mode_hum
-        self.i2c.writeto_mem(self.address, self.BME280_REGISTER_CONTROL_HUM, self._l1_barray)
+        self.registers.write(self.BME280_REGISTER_CONTROL_HUM, self._l1_barray)
+        # Writing forced mode starts the measurement, and the sensor returns to sleep after it, so always send it
         self._l1_barray[0] = self._mode_temp << 5 | self._mode_press << 2 | self.MODE_FORCED
-        self.i2c.writeto_mem(self.address, self.BME280_REGISTER_CONTROL, self._l1_barray)
-
-        for _ in range(self.BME280_TIMEOUT):
-            if self.i2c.readfrom_mem(self.address, self.BME280_REGISTER_STATUS, 1)[0] & 0x08:
-                time.sleep(0.000001)
+        self.registers.write(self.BME280_REGISTER_CONTROL, self._l1_barray, force=True)
+
+        # Wait the conversion out, then the status and the data registers, 3 bytes
+        # apart, are read in one burst; the 1-byte status is polled only if not done
+        time.sleep_ms(self._measure_ms)
+        readout = None
+        if self._read_batch is not None:
+            status, readout = self._read_batch(self.address, self._status_data_blocks)
+            if status[0] & 0x08:
+                readout = None
+        if readout is None:
+            for _ in range(self.BME280_TIMEOUT):
+                if self.i2c.readfrom_mem(self.address, self.BME280_REGISTER_STATUS, 1)[0] & 0x08:
+                    time.sleep(0.000001)
+                else:
+                    break
             else:
-                break
-        else:
-            raise RuntimeError("Sensor BME280 not ready")
+                raise RuntimeError("Sensor BME280 not ready")
+            self.i2c.readfrom_mem_into(self.address, 0xF7, self._l8_barray)
+            readout = self._l8_barray
 
-        self.i2c.readfrom_mem_into(self.address, 0xF7, self._l8_barray)
-        readout = self._l8_barray
         raw_press = ((readout[0] << 16) | (readout[1] << 8) | readout[2]) >> 4
         raw_temp = ((readout[3] << 16) | (readout[4] << 8) | readout[5]) >> 4
         raw_hum = (readout[6] << 8) | readout[7]
@@ -1,52 +1,124 @@
-from machine import Pin, Timer
+from machine import Pin, disable_irq, enable_irq
+from array import array
 import time
 
 class HC020K:
+    """
+    Optical wheel encoder.
+
+    The interrupt only increments pulses, which never resets: each reader
+    keeps the count it saw last and works on the difference, so the speed
+    timer, the distance and the odometry do not steal pulses from each other.
+
+    The interrupt also stores the ticks_us of each edge in a preallocated ring
+    buffer, so get_speed_cmps() measures the time between the last pulses
+    instead of counting them over a second: at a few pulses per second it
+    follows the wheel after one or two pulses. Below FAST_PERIOD_US between
+    pulses, the interrupt latency jitter weighs on the period, and the speed
+    counted over the timer window is used instead.
+
+    ticks_us differences are only valid for about 9 minutes, so a wheel left
+    parked must not be compared with its last edge: the stop test uses the
+    ticks_ms of the last pulse, and a speed window without any pulse drops
+    the older edges from the period average.
+    """
     PULSES_PER_REVOLUTION = 20  # Number of pulses per revolution
     WHEEL_DIAMETER_CM = 6.77 # Diameter of the wheel in cm
-    timer_counter = 70  # Static variable to keep track of timer IDs
+    EDGE_BUFFER_SIZE = 16  # Edge timestamps kept, a power of two
+    PERIOD_SAMPLES = 4  # Pulse periods averaged for the speed
+    MIN_PERIOD_US = 500  # Shorter periods are switch bounce and not counted
+    # With ~50 us of interrupt latency jitter over PERIOD_SAMPLES periods, the period is less
+    # precise than one pulse counted in the 1 s window below 3.5 ms (~280 pulses/s, 3 m/s here)
+    FAST_PERIOD_US = 3500
+    STOP_MS = 1000  # No pulse for this long means the wheel stopped
+    SPEED_WINDOW_MS = 1000  # Window of the counted speed
     
-    def __init__(self, pin, interrupt_type, pulses_per_revolution=PULSES_PER_REVOLUTION, wheel_diameter_cm=WHEEL_DIAMETER_CM):
+    def __init__(self, pin, interrupt_type, pulses_per_revolution=PULSES_PER_REVOLUTION, wheel_diameter_cm=WHEEL_DIAMETER_CM, timers=None):
+        """
+        :param timers: Optional TimerService running the counted speed window; without it
+                       the window is closed by get_speed_cmps() once it has elapsed.
+        """
         self.pin = Pin(pin, Pin.IN)
         self.slots = pulses_per_revolution
         self.wheel_diameter = wheel_diameter_cm
-        self.pulse_count = 0
+        self.cm_per_pulse = wheel_diameter_cm * 3.14159 / pulses_per_revolution
+        self.pulses = 0  # Total since boot, only written by the interrupt
+        self.edges = array('i', [0] * self.EDGE_BUFFER_SIZE)  # ticks_us of the last edges, indexed by pulses
+        self.bounces = 0
+        self.last_pulse_ms = time.ticks_ms()
+        self.period_start = 0  # First pulse whose edge counts in the period average
+        self.speed_pulses = 0  # pulses at the last speed calculation
         self.last_time = time.ticks_ms()
         self.speed_rps = 0
-        self.distance_traveled_cm = 0
+        self.speed_cmps = 0
 
         # Set up the interrupt on the pin
-        self.pin.irq(trigger=interrupt_type, handler=self._pulse_handler)
+        self.pin.irq(trigger=interrupt_type, handler=self._pulse_handler, hard=True)
 
-        # Set up a timer to calculate speed periodically
-        self.timer_id = HC020K.timer_counter
-        HC020K.timer_counter += 1
-        self.timer = Timer(self.timer_id)
-        self.timer.init(period=1000, mode=Timer.PERIODIC, callback=self._calculate_speed)
+        # Close the counted speed window periodically
+        self.timers = timers
+        self.job = timers.add(f"hc020k.{pin}", self._calculate_speed, self.SPEED_WINDOW_MS) if timers is not None else None
 
     def _pulse_handler(self, pin):
-        self.pulse_count += 1
+        # Hard interrupt: no allocation, only integer stores into the ring buffer
+        now = time.ticks_us()
+        pulses = self.pulses
+        if pulses and time.ticks_diff(now, self.edges[(pulses - 1) & (self.EDGE_BUFFER_SIZE - 1)]) < self.MIN_PERIOD_US:
+            self.bounces += 1
+            return
+        self.edges[pulses & (self.EDGE_BUFFER_SIZE - 1)] = now
+        self.last_pulse_ms = time.ticks_ms()
+        self.pulses = pulses + 1
 
     def _calculate_speed(self, timer):
         current_time = time.ticks_ms()
-        elapsed_time = (current_time - self.last_time) / 1000  # Convert to seconds
+        elapsed_time = time.ticks_diff(current_time, self.last_time) / 1000  # Convert to seconds
         if (elapsed_time <= 0):
-            elapsed_time = 1 / 1000  # Avoid division by zero
+            return
         self.last_time = current_time
+        pulses = self.pulses  # One read, the interrupt may add more meanwhile
+        count = pulses - self.speed_pulses
+        self.speed_pulses = pulses
+        if count == 0:
+            self.period_start = pulses  # Parked: the old edges may be older than the ticks_us range
 
         # Calculate speed in revolutions per second (RPS)
-        self.speed_rps = (self.pulse_count / self.slots) / elapsed_time
-        self.pulse_count = 0
+        self.speed_rps = (count / self.slots) / elapsed_time
+        self.speed_cmps = count * self.cm_per_pulse / elapsed_time
+
+    def read_pulses(self):
+        """Returns the pulses counted since boot; readers subtract their previous value."""
+        return self.pulses
 
-        # Calculate distance traveled in cm
-        circumference_cm = self.wheel_diameter * 3.14159
-        self.speed_cmps = self.speed_rps * circumference_cm
-        self.distance_traveled_cm += self.speed_rps * circumference_cm * elapsed_time
+    def period_us(self):
+        """
+        Returns the mean period of the last pulses in microseconds, or None if
+        the wheel is stopped or has not made two pulses yet.
+        """
+        mask = self.EDGE_BUFFER_SIZE - 1
+        state = disable_irq()  # The timestamps must come from the same count
+        pulses = self.pulses
+        n = min(pulses - 1 - self.period_start, self.PERIOD_SAMPLES)
+        last = self.edges[(pulses - 1) & mask]
+        first = self.edges[(pulses - 1 - n) & mask] if n > 0 else last
+        last_pulse_ms = self.last_pulse_ms
+        enable_irq(state)
+        if n <= 0 or time.ticks_diff(time.ticks_ms(), last_pulse_ms) >= self.STOP_MS:
+            return None
+        since_last = time.ticks_diff(time.ticks_us(), last)  # Less than STOP_MS, so within the valid range
+        period = time.ticks_diff(last, first) / n
+        # Slowing down: the next pulse is already later than the mean period
+        return since_last if since_last > period else period
 
     def get_speed_cmps(self):
-        self._calculate_speed(self.timer)
-        return self.speed_cmps
+        if self.timers is None and time.ticks_diff(time.ticks_ms(), self.last_time) >= self.SPEED_WINDOW_MS:
+            self._calculate_speed(None)
+        period = self.period_us()
+        if period is None:
+            return 0
+        if period < self.FAST_PERIOD_US:
+            return self.speed_cmps
+        return self.cm_per_pulse * 1000000 / period
     
     def get_distance_traveled_m(self):
-        self._calculate_speed(self.timer)
-        return self.distance_traveled_cm / 100
+        return self.pulses * self.cm_per_pulse / 100
@@ -1,48 +1,213 @@
 from machine import Pin, time_pulse_us
+from array import array
 import time
 
+from utils.filters import RunningMedian
+
 class HCSR04:
-    def __init__(self, trig_pin, echo_pin):
+    WINDOW = 5
+    MAX_RATE_CM_S = 300  # Fastest plausible change of distance (robot and obstacle speeds)
+    RATE_MARGIN_CM = 5  # Allowed jump on top of the rate, for the sensor resolution
+    MAX_REJECTS = 3  # Consecutive rejected readings after which the filter relocks on the new distance
+
+    def __init__(self, trig_pin, echo_pin, window=WINDOW, max_rate=MAX_RATE_CM_S):
         self.trig = Pin(trig_pin, Pin.OUT)
         self.echo = Pin(echo_pin, Pin.IN)
         self.trig.off()
-        
-    def calculate_median(self, values):
-        sorted_values = sorted(values)
-        n = len(sorted_values)
-        middle = n // 2
-
-        if n % 2 == 0:
-            return (sorted_values[middle - 1] + sorted_values[middle]) / 2
-        else:
-            return sorted_values[middle]
-
-    def measure_median(self, readings=5, timeout=30000):
-        distances = []
-
-        for _ in range(readings):
-            self.trig.off()
-            time.sleep(0.000002)
-            self.trig.on()
-            time.sleep(0.00001)
-            self.trig.off()
-
-            try:
-                duration = time_pulse_us(self.echo, 1, timeout)
-                if duration < 0:
-                    continue
-                distance = duration * 0.0343 / 2
-                if distance < 0:
-                    continue
-                distances.append(distance)
-            except OSError as e:
-                print(f"Error: {e}")
-
-            time.sleep(0.05)
-
-        if len(distances) < 3:
-            return -1
-
-        median_distance = self.calculate_median(distances)
-        # print(f"Median distance: {median_distance} cm")
-        return median_distance
+        self.filter = RunningMedian(window)
+        self.max_rate = max_rate
+        self.last_ms = None  # Time of the last accepted reading
+        self.rejects = 0  # Consecutive rejected readings
+        self.rejected = 0
+        self.value = -1
+
+    def update(self, distance, now_ms=None):
+        """
+        Feeds one reading to the streaming filter.
+
+        A reading that moved away from the current median faster than max_rate
+        is rejected as an outlier (multipath echo, crosstalk); after MAX_REJECTS
+        rejections in a row the jump is taken as real and the window restarts
+        from the new distance.
+
+        :return: The filtered distance in cm, or -1 before the first valid reading.
+        """
+        if now_ms is None:
+            now_ms = time.ticks_ms()
+        median = self.filter.median()
+        if median is not None:
+            elapsed = time.ticks_diff(now_ms, self.last_ms) / 1000
+            if abs(distance - median) > self.max_rate * elapsed + self.RATE_MARGIN_CM:
+                self.rejected += 1
+                self.rejects += 1
+                if self.rejects < self.MAX_REJECTS:
+                    return self.value
+                self.filter.reset()
+        self.rejects = 0
+        self.last_ms = now_ms
+        self.value = self.filter.update(distance)
+        return self.value
+
+    def measure(self, timeout=30000):
+        """Fires one ping and returns the filtered distance in cm, or -1 before the first valid reading."""
+        distance = self._ping(timeout)
+        if distance is not None:
+            return self.update(distance)
+        return self.value
+
+    def _ping(self, timeout):
+        """Fires one ping and returns the distance in cm, or None if no valid echo"""
+        self.trig.off()
+        time.sleep(0.000002)
+        self.trig.on()
+        time.sleep(0.00001)
+        self.trig.off()
+
+        try:
+            duration = time_pulse_us(self.echo, 1, timeout)
+            if duration < 0:
+                return None
+            distance = duration * 0.0343 / 2
+            if distance < 0:
+                return None
+            return distance
+        except OSError as e:
+            print(f"Error: {e}")
+            return None
+
+class HCSR04Array:
+    """
+    Interleaved ranging engine for several HC-SR04 sensors.
+
+    Sensors are fired in groups, round-robin, one group every spacing_ms; the
+    sensors of a group face away from each other, so they can share a slot
+    without crosstalk. Echoes are timed by pin IRQs on both edges with
+    ticks_us instead of busy-waiting in time_pulse_us, and each reading goes
+    through the streaming filter of its sensor (see HCSR04.update).
+
+    The echo timeout follows from max_range_cm, and the spacing must cover it,
+    since the echoes of a group must end before the next group fires, and
+    give every sensor its CYCLE_MS measurement cycle before it fires again.
+    Without an object in range the echo pin stays high for about 38 ms, well
+    past the timeout. After MAX_TIMEOUTS timeouts in a row the reading of the
+    sensor is dropped to -1, so an obstacle that left is not reported forever.
+
+    With the default 2 groups and 4 m range the spacing is 30 ms and every
+    sensor updates at ~16 Hz. Call step() every spacing_ms.
+    """
+    MAX_RANGE_CM = 400
+    CYCLE_MS = 60  # Measurement cycle of one sensor, from its datasheet
+    TRIGGER_DELAY_US = 500  # From the trigger to the echo rise
+    MAX_TIMEOUTS = 3
+    GROUPS = (("front", "rear"), ("left", "right"))
+    SOUND_SPEED_CM_US = 0.0343
+
+    def __init__(self, sensors, groups=GROUPS, max_range_cm=MAX_RANGE_CM, spacing_ms=None):
+        """
+        :param sensors: Dictionary of HCSR04 instances by name.
+        :param groups: Tuples of sensor names fired together. Sensors in no group are fired alone.
+        :param max_range_cm: Farthest distance measured; longer echoes are timeouts.
+        :param spacing_ms: Time between two groups, by default the shortest one the range and cycle allow.
+        """
+        self.names = tuple(sensors)
+        self.sensors = tuple(sensors[name] for name in self.names)
+        grouped = [tuple(self.names.index(name) for name in group if name in sensors) for group in groups]
+        grouped = [group for group in grouped if group]
+        for i, name in enumerate(self.names):
+            if not any(i in group for group in grouped):
+                grouped.append((i,))
+        self.groups = tuple(grouped)
+        self.group_index = len(self.groups) - 1
+        self.fired = False
+        self.max_range_cm = max_range_cm
+        self.timeout_us = int(2 * max_range_cm / self.SOUND_SPEED_CM_US)
+        self.spacing_ms = 0
+        self.set_spacing(self.min_spacing_ms() if spacing_ms is None else spacing_ms)
+
+        count = len(self.names)
+        self.rise_us = [0] * count
+        self.echo_us = [0] * count  # Written by the IRQ handlers, 0 while waiting
+        self.filtered = array('f', [-1.0] * count)
+        self.updates = array('i', [0] * count)
+        self.timeouts = array('i', [0] * count)
+        self.misses = array('i', [0] * count)  # Consecutive timeouts
+        self.start_ms = time.ticks_ms()
+
+        for i, sensor in enumerate(self.sensors):
+            sensor.echo.irq(trigger=Pin.IRQ_RISING | Pin.IRQ_FALLING, handler=self._make_echo_handler(i), hard=True)
+
+    def min_spacing_ms(self):
+        """Returns the shortest group spacing for the range and the sensor cycle."""
+        echo_ms = (self.TRIGGER_DELAY_US + self.timeout_us) // 1000 + 1
+        cycle_ms = -(-self.CYCLE_MS // len(self.groups))
+        return max(echo_ms, cycle_ms)
+
+    def set_spacing(self, spacing_ms):
+        """
+        Changes the time between two groups; step() must then be called at that period.
+
+        :raises ValueError: If it is shorter than min_spacing_ms().
+        """
+        minimum = self.min_spacing_ms()
+        if spacing_ms < minimum:
+            raise ValueError(f"HC-SR04 spacing must be at least {minimum} ms for a {self.max_range_cm} cm range and the {self.CYCLE_MS} ms sensor cycle")
+        self.spacing_ms = spacing_ms
+
+    def _make_echo_handler(self, i):
+        rise_us = self.rise_us
+        echo_us = self.echo_us
+
+        def handler(pin):
+            now = time.ticks_us()
+            if pin.value():
+                rise_us[i] = now
+            else:
+                echo_us[i] = time.ticks_diff(now, rise_us[i])
+        return handler
+
+    def step(self):
+        """Collects the echoes of the group fired last and fires the next group."""
+        if self.fired:
+            for i in self.groups[self.group_index]:
+                echo = self.echo_us[i]
+                if 0 < echo <= self.timeout_us:
+                    self.misses[i] = 0
+                    self._update(i, echo * self.SOUND_SPEED_CM_US / 2)
+                else:
+                    self.timeouts[i] += 1
+                    self.misses[i] += 1
+                    if self.misses[i] == self.MAX_TIMEOUTS:
+                        self._invalidate(i)
+
+        self.group_index = (self.group_index + 1) % len(self.groups)
+        group = self.groups[self.group_index]
+        for i in group:
+            self.echo_us[i] = 0
+            self.sensors[i].trig.on()
+        time.sleep_us(10)
+        for i in group:
+            self.sensors[i].trig.off()
+        self.fired = True
+
+    def _update(self, i, distance):
+        self.updates[i] += 1
+        self.filtered[i] = self.sensors[i].update(distance)
+
+    def _invalidate(self, i):
+        # Nothing in range any more: forget the old distance
+        sensor = self.sensors[i]
+        sensor.filter.reset()
+        sensor.rejects = 0
+        sensor.value = -1
+        self.filtered[i] = -1.0
+
+    def distance(self, name):
+        """Returns the filtered distance in cm of a sensor, or -1 without a valid echo lately."""
+        return self.filtered[self.names.index(name)]
+
+    def update_rate(self, name):
+        """Returns the measured valid update rate of a sensor in Hz."""
+        elapsed = time.ticks_diff(time.ticks_ms(), self.start_ms)
+        if elapsed <= 0:
+            return 0
+        return self.updates[self.names.index(name)] * 1000 / elapsed
@@ -0,0 +1,305 @@
+# Shared I2C bus manager
+# Wraps the machine.I2C object with the same methods, so the drivers use it
+# unchanged, and adds locking, a per-device retry policy and statistics.
+
+from array import array
+import time
+
+try:
+    import _thread
+except ImportError:
+    _thread = None
+
+class _BusLock:
+    # Re-entrant, so a batch can hold the bus across the transactions it makes
+    def __init__(self):
+        self.lock = _thread.allocate_lock() if _thread is not None else None
+        self.owner = None
+        self.depth = 0
+
+    def __enter__(self):
+        if self.lock is not None:
+            me = _thread.get_ident()
+            if self.owner != me:
+                self.lock.acquire()
+                self.owner = me
+        self.depth += 1
+        return self
+
+    def __exit__(self, *args):
+        self.depth -= 1
+        if self.depth == 0 and self.lock is not None:
+            self.owner = None
+            self.lock.release()
+        return False
+
+class I2CDeviceStats:
+    """Transaction counters and latency histogram of one device."""
+    # Upper bounds of the latency histogram buckets in microseconds; the last bucket has no bound
+    BUCKETS_US = (100, 250, 500, 1000, 2500, 5000, 10000)
+
+    def __init__(self, retries, timeout_ms):
+        self.retries = retries
+        self.timeout_ms = timeout_ms
+        self.transactions = 0
+        self.errors = 0  # Failed attempts, retried or not
+        self.failures = 0  # Transactions failed after all retries
+        self.timeouts = 0  # Transactions abandoned because of the timeout
+        self.bytes = 0
+        self.histogram = array('i', [0] * (len(self.BUCKETS_US) + 1))
+        self.max_latency_us = 0
+
+    def record(self, latency_us, length):
+        self.transactions += 1
+        self.bytes += length
+        if latency_us > self.max_latency_us:
+            self.max_latency_us = latency_us
+        bucket = 0
+        for bound in self.BUCKETS_US:
+            if latency_us < bound:
+                break
+            bucket += 1
+        self.histogram[bucket] += 1
+
+    def error_rate(self):
+        attempts = self.transactions + self.failures
+        return self.failures / attempts if attempts else 0
+
+    def to_dict(self):
+        return {
+            "transactions": self.transactions,
+            "bytes": self.bytes,
+            "errors": self.errors,
+            "failures": self.failures,
+            "timeouts": self.timeouts,
+            "error_rate": self.error_rate(),
+            "max_latency_us": self.max_latency_us,
+            "latency_us": {f"<{bound}" if bound else "more": count for bound, count in zip(self.BUCKETS_US + (None,), self.histogram)}
+        }
+
+class I2CBus:
+    """
+    I2C bus shared by all the drivers.
+
+    Every transaction holds the bus lock, so tasks running on other threads
+    cannot interleave with it; batch(address) holds it across several
+    transactions to the same device. A failed transaction is retried up to the
+    device's retry count, but never once its timeout has elapsed, and then
+    raises OSError like machine.I2C. The device timeout is only checked
+    between attempts: a single hung transaction is cut by the timeout of the
+    machine.I2C object itself (main.py builds it with I2C_TIMEOUT_US). The
+    drivers call batch() and read_batch() only when the bus provides them, so
+    they also run on a plain machine.I2C. Each device keeps a latency histogram and
+    error counters, returned by stats().
+
+    Given a factory that builds the machine.I2C object for a clock frequency,
+    autotune() raises the clock step by step while the devices keep answering
+    known values without errors, and the bus steps back down at runtime when
+    the error rate rises (see clock_stats()).
+    """
+    RETRIES = 1
+    TIMEOUT_MS = 100
+    MAX_BATCH_GAP = 8  # Unused bytes read_batch() accepts between two blocks to merge them
+    FREQUENCIES = (100000, 400000, 800000, 1000000)
+    TUNE_READS = 20  # Reads of each known value per frequency step
+    FALLBACK_WINDOW = 100  # Transactions per error rate check
+    FALLBACK_ERROR_RATE = 0.05  # Failed attempts ratio that lowers the clock
+
+    def __init__(self, i2c, retries=RETRIES, timeout_ms=TIMEOUT_MS, factory=None, frequency=None, frequencies=FREQUENCIES):
+        """
+        :param i2c: The machine.I2C object, or None to build it with factory(frequency).
+        :param factory: Optional function(frequency) returning a machine.I2C object, needed to change the clock.
+        :param frequency: The clock frequency of i2c, for the reports.
+        :param frequencies: Clock frequencies tried by autotune() and the runtime fallback, in increasing order.
+        """
+        self.factory = factory
+        self.frequency = frequency
+        self.frequencies = frequencies
+        self.i2c = i2c if i2c is not None else factory(frequency)
+        self.retries = retries
+        self.timeout_ms = timeout_ms
+        self.lock = _BusLock()
+        self.devices = {}
+        self.batch_buffer = bytearray(32)
+        self.tune_errors = {}  # Errors seen at each frequency tried by autotune()
+        self.fallbacks = 0
+        self.tuning = False
+        self.window_transactions = 0
+        self.window_errors = 0
+
+    def set_policy(self, address, retries=None, timeout_ms=None):
+        """Sets the retry count and timeout of one device."""
+        device = self._device(address)
+        if retries is not None:
+            device.retries = retries
+        if timeout_ms is not None:
+            device.timeout_ms = timeout_ms
+
+    def _device(self, address):
+        device = self.devices.get(address)
+        if device is None:
+            device = I2CDeviceStats(self.retries, self.timeout_ms)
+            self.devices[address] = device
+        return device
+
+    def _run(self, address, length, func, *args):
+        device = self._device(address)
+        attempt = 0
+        with self.lock:
+            start = time.ticks_us()  # Bus time only, not the wait for the lock
+            while True:
+                try:
+                    result = func(*args)
+                    device.record(time.ticks_diff(time.ticks_us(), start), length)
+                    self._count(False)
+                    return result
+                except OSError:
+                    device.errors += 1
+                    self._count(True)
+                    attempt += 1
+                    timed_out = time.ticks_diff(time.ticks_us(), start) >= device.timeout_ms * 1000
+                    if attempt > device.retries or timed_out:
+                        device.failures += 1
+                        if timed_out:
+                            device.timeouts += 1
+                        raise
+
+    def _count(self, error):
+        if self.tuning:
+            return
+        self.window_transactions += 1
+        if error:
+            self.window_errors += 1
+        if self.window_transactions >= self.FALLBACK_WINDOW:
+            if self.window_errors > self.FALLBACK_ERROR_RATE * self.window_transactions:
+                self._fall_back()
+            self.window_transactions = 0
+            self.window_errors = 0
+
+    def _fall_back(self):
+        lower = [frequency for frequency in self.frequencies if self.frequency is None or frequency < self.frequency]
+        if self.factory is None or not lower:
+            return
+        self.fallbacks += 1
+        print(f"I2C error rate too high at {self.frequency} Hz, falling back to {lower[-1]} Hz")
+        self.set_frequency(lower[-1])
+
+    def set_frequency(self, frequency):
+        """Rebuilds the bus at another clock frequency."""
+        if self.factory is None:
+            raise ValueError("Changing the I2C clock needs a factory")
+        with self.lock:
+            self.i2c = self.factory(frequency)
+            self.frequency = frequency
+
+    def autotune(self, probes, reads=TUNE_READS):
+        """
+        Raises the clock while every probe keeps passing without bus errors.
+
+        :param probes: Functions returning True when a device answered its known value (chip ID...).
+        :return: The frequency kept.
+        """
+        if self.factory is None or not probes:
+            return self.frequency
+        chosen = None
+        self.tuning = True
+        try:
+            for frequency in self.frequencies:
+                self.set_frequency(frequency)
+                errors_before = sum(device.errors for device in self.devices.values())
+                errors = 0
+                for _ in range(reads):
+                    for probe in probes:
+                        try:
+                            if not probe():
+                                errors += 1
+                        except OSError:
+                            errors += 1
+                errors += sum(device.errors for device in self.devices.values()) - errors_before
+                self.tune_errors[frequency] = errors
+                if errors:
+                    break
+                chosen = frequency
+        finally:
+            self.tuning = False
+        if chosen is None:
+            chosen = self.frequencies[0]  # Nothing was clean, keep the slowest clock
+        self.set_frequency(chosen)
+        self.window_transactions = 0
+        self.window_errors = 0
+        return chosen
+
+    def clock_stats(self):
+        return {
+            "frequency": self.frequency,
+            "autotune_errors": {str(frequency): errors for frequency, errors in self.tune_errors.items()},
+            "fallbacks": self.fallbacks
+        }
+
+    def batch(self, address):
+        """Holds the bus for a sequence of transactions: with bus.batch(address): ..."""
+        return self.lock
+
+    def scan(self):
+        with self.lock:
+            return self.i2c.scan()
+
+    def readfrom(self, address, nbytes, stop=True):
+        return self._run(address, nbytes, self.i2c.readfrom, address, nbytes, stop)
+
+    def readfrom_into(self, address, buffer, stop=True):
+        return self._run(address, len(buffer), self.i2c.readfrom_into, address, buffer, stop)
+
+    def writeto(self, address, buffer, stop=True):
+        return self._run(address, len(buffer), self.i2c.writeto, address, buffer, stop)
+
+    def readfrom_mem(self, address, register, nbytes, addrsize=8):
+        return self._run(address, nbytes, self.i2c.readfrom_mem, address, register, nbytes, addrsize)
+
+    def readfrom_mem_into(self, address, register, buffer, addrsize=8):
+        return self._run(address, len(buffer), self.i2c.readfrom_mem_into, address, register, buffer, addrsize)
+
+    def writeto_mem(self, address, register, buffer, addrsize=8):
+        return self._run(address, len(buffer), self.i2c.writeto_mem, address, register, buffer, addrsize)
+
+    def read_batch(self, address, blocks, auto_increment=0):
+        """
+        Reads several register blocks of one device, merging blocks close to each other into one burst.
+
+        :param blocks: (register, length) pairs sorted by register.
+        :param auto_increment: Bits to set in the register address for a burst (0x80 on ST sensors).
+        :return: A memoryview of each block, valid until the next read_batch() call.
+        """
+        spans = []  # (first register, length, first block, end block)
+        i = 0
+        while i < len(blocks):
+            first = blocks[i][0]
+            end = first + blocks[i][1]
+            j = i + 1
+            while j < len(blocks) and blocks[j][0] - end <= self.MAX_BATCH_GAP:
+                end = max(end, blocks[j][0] + blocks[j][1])
+                j += 1
+            spans.append((first, end - first, i, j))
+            i = j
+        total = sum(span[1] for span in spans)
+        if total > len(self.batch_buffer):
+            self.batch_buffer = bytearray(total)
+
+        views = []
+        buffer = memoryview(self.batch_buffer)
+        offset = 0
+        with self.lock:
+            for first, length, i, j in spans:
+                self.readfrom_mem_into(address, first | auto_increment, buffer[offset:offset + length])
+                for k in range(i, j):
+                    start = offset + blocks[k][0] - first
+                    views.append(buffer[start:start + blocks[k][1]])
+                offset += length
+        return views
+
+    def stats(self):
+        """Returns the statistics of every device, by hexadecimal address."""
+        return {hex(address): device.to_dict() for address, device in self.devices.items()}
+
+    def total_failures(self):
+        return sum(device.failures for device in self.devices.values())
@@ -6,6 +6,8 @@ from math import trunc
 from micropython import const
 from machine import I2C
 
+from .register_cache import RegisterCache
+
 class INA219:
     """Provides all the functionality to interact with the INA219 sensor."""
     MAX_VOLTAGE = 16.8 # Maximum voltage of the battery
@@ -81,6 +83,8 @@ class INA219:
     __GAIN_VOLTS = [0.04, 0.08, 0.16, 0.32]
 
     __CONT_SH_BUS = 7
+    __TRIG_SH_BUS = 3
+    __CONVERSION_TIMEOUT_MS = 150  # Longer than 2 x 68.10ms, the slowest averaging of both ADCs
 
     __AMP_ERR_MSG = ('Expected current %.3fA is greater '
                      'than max possible current %.3fA')
@@ -125,14 +129,18 @@ class INA219:
         """
         self._i2c = i2c
         self._address = address
+        self.registers = RegisterCache(i2c, address)  # Configuration and calibration registers
         self._shunt_ohms = shunt_ohms
         self._max_expected_amps = max_expected_amps
         self._min_device_current_lsb = self._calculate_min_current_lsb()
         self._gain = None
         self._auto_gain_enabled = False
+        self._triggered = False
+        self._buffer = bytearray(2)
+        self._snapshot = INA219Snapshot()
         self.configure()
 
-    def configure(self, voltage_range=RANGE_32V, gain=GAIN_AUTO, bus_adc=ADC_12BIT, shunt_adc=ADC_12BIT):
+    def configure(self, voltage_range=RANGE_32V, gain=GAIN_AUTO, bus_adc=ADC_12BIT, shunt_adc=ADC_12BIT, triggered=False):
         """Configure and calibrate how the INA219 will take measurements.
 
         Arguments:
@@ -155,8 +163,12 @@ class INA219:
             ADC_10BIT, ADC_11BIT, ADC_12BIT (default),
             ADC_2SAMP, ADC_4SAMP, ADC_8SAMP, ADC_16SAMP,
             ADC_32SAMP, ADC_64SAMP, ADC_128SAMP
+        triggered -- convert only when snapshot() asks for a sample instead
+            of continuously, so both ADCs measure the same moment and the
+            chip idles in between.
         """
         self.__validate_voltage_range(voltage_range)
+        self._triggered = triggered
         self._voltage_range = voltage_range
 
         if self._max_expected_amps is not None:
@@ -188,7 +200,10 @@ class INA219:
 
     def voltage(self):
         """Return the bus voltage in volts."""
-        value = (float(self._voltage_register()) * self.__BUS_MILLIVOLTS_LSB / 1000)
+        return self._bus_volts(self._voltage_register())
+
+    def _bus_volts(self, register_value):
+        value = (float(register_value) * self.__BUS_MILLIVOLTS_LSB / 1000)
         if value <= self.MIN_VOLTAGE - self.OFFSET_VOLTAGE:
             offset = self.OFFSET_VOLTAGE
         elif value >= self.MAX_VOLTAGE:
@@ -250,6 +265,52 @@ class INA219:
         # 40us delay to recover from powerdown (p14 of spec)
         time.sleep(0.00004)
 
+    def snapshot(self):
+        """Return one consistent sample of every measurement.
+
+        Reads the bus voltage, shunt voltage, current and power registers
+        once each into a preallocated buffer and checks overflow once (with
+        auto gain, the gain is raised and the sample read again). In
+        triggered mode a conversion is started and waited for first.
+
+        Unlike current(), the current keeps its sign, so charging reads
+        negative. The returned INA219Snapshot is reused by the next call.
+        """
+        for _ in range(len(self.__GAIN_VOLTS)):
+            if self._triggered:
+                self._trigger()
+            bus = self._read_into(self.__REG_BUSVOLTAGE)
+            if bus & self.__OVF:
+                if not self._auto_gain_enabled:
+                    raise DeviceRangeError(self.__GAIN_VOLTS[self._gain])
+                self._increase_gain()
+                continue
+            snapshot = self._snapshot
+            snapshot.voltage = self._bus_volts(bus >> 3)
+            snapshot.shunt_voltage = self._read_into(self.__REG_SHUNTVOLTAGE, True) * self.__SHUNT_MILLIVOLTS_LSB
+            snapshot.current = self._read_into(self.__REG_CURRENT, True) * self._current_lsb * 1000  # Negative while charging
+            snapshot.power = self._read_into(self.__REG_POWER) * self._power_lsb * 1000  # Unsigned register: a magnitude
+            snapshot.supply_voltage = snapshot.voltage + snapshot.shunt_voltage / 1000
+            snapshot.battery_percentage = self.battery_percentage(snapshot.voltage)
+            return snapshot
+        raise DeviceRangeError(self.__GAIN_VOLTS[self._gain], True)
+
+    def _trigger(self):
+        # Writing the configuration starts a conversion; CNVR is set when it is done
+        self.registers.write(self.__REG_CONFIG, self.registers.read(self.__REG_CONFIG, 2), force=True)
+        start = time.ticks_ms()
+        while not self._read_into(self.__REG_BUSVOLTAGE) & self.__CNVR:
+            if time.ticks_diff(time.ticks_ms(), start) > self.__CONVERSION_TIMEOUT_MS:
+                raise OSError("INA219 conversion timeout")
+            time.sleep_ms(1)
+
+    def _read_into(self, register, negative_value_supported=False):
+        self._i2c.readfrom_mem_into(self._address, register, self._buffer)
+        register_value = (self._buffer[0] << 8) | self._buffer[1]
+        if negative_value_supported and register_value > 32767:
+            register_value -= 65536
+        return register_value
+
     def current_overflow(self):
         """Return true if the sensor has detect current overflow.
 
@@ -257,9 +318,20 @@ class INA219:
         """
         return self._has_current_overflow()
 
+    def check_id(self):
+        """Return true if the configuration register reads back as written.
+
+        The INA219 has no ID register, so this is the known value used to
+        validate the bus.
+        """
+        expected = self.registers.values.get(self.__REG_CONFIG)
+        actual = self._i2c.readfrom_mem(self._address, self.__REG_CONFIG, 2)
+        return expected is None or actual == expected
+
     def reset(self):
         """Reset the INA219 to its default configuration."""
         self._configuration_register(1 << self.__RST)
+        self.registers.invalidate()
 
     def _handle_current_overflow(self):
         if self._auto_gain_enabled:
@@ -291,7 +363,8 @@ class INA219:
             raise DeviceRangeError(self.__GAIN_VOLTS[gain], True)
 
     def _configure(self, voltage_range, gain, bus_adc, shunt_adc):
-        configuration = (voltage_range << self.__BRNG | gain << self.__PG0 | bus_adc << self.__BADC1 | shunt_adc << self.__SADC1 | self.__CONT_SH_BUS)
+        mode = self.__TRIG_SH_BUS if self._triggered else self.__CONT_SH_BUS
+        configuration = (voltage_range << self.__BRNG | gain << self.__PG0 | bus_adc << self.__BADC1 | shunt_adc << self.__SADC1 | mode)
         self._configuration_register(configuration)
 
     def _calibrate(self, bus_volts_max, shunt_volts_max, max_expected_amps=None):
@@ -339,7 +412,7 @@ class INA219:
         self.__write_register(self.__REG_CONFIG, register_value)
 
     def _read_configuration(self):
-        return self.__read_register(self.__REG_CONFIG)
+        return int.from_bytes(self.registers.read(self.__REG_CONFIG, 2), 'big')
 
     def _calculate_min_current_lsb(self):
         return self.__CALIBRATION_FACTOR / (self._shunt_ohms * self.__MAX_CALIBRATION_VALUE)
@@ -387,9 +460,7 @@ class INA219:
 
     def __write_register(self, register, register_value):
         self.__log_register_operation("write", register, register_value)
-
-        register_bytes = self.__to_bytes(register_value)
-        self._i2c.writeto_mem(self._address, register, register_bytes)
+        self.registers.write(register, self.__to_bytes(register_value))
 
     def __to_bytes(self, register_value):
         return bytearray([(register_value >> 8) & 0xFF, register_value & 0xFF])
@@ -416,9 +487,10 @@ class INA219:
         else:
             return ', max expected amps: %.3fA' % max_expected_amps
 
-    def battery_percentage(self):
-        """Return the battery percentage."""
-        voltage = self.voltage()
+    def battery_percentage(self, voltage=None):
+        """Return the battery percentage, from the given bus voltage or a new reading."""
+        if voltage is None:
+            voltage = self.voltage()
         if voltage < self.MIN_VOLTAGE:
             return 0
         elif voltage > self.MAX_VOLTAGE:
@@ -430,6 +502,18 @@ class INA219:
         """Return the I2C address."""
         return self.__ADDRESS
 
+class INA219Snapshot:
+    """One sample of all the INA219 measurements, returned by INA219.snapshot()."""
+    __slots__ = ("voltage", "shunt_voltage", "current", "power", "supply_voltage", "battery_percentage")
+
+    def __init__(self):
+        self.voltage = 0  # Bus voltage, V
+        self.shunt_voltage = 0  # mV
+        self.current = 0  # mA
+        self.power = 0  # mW
+        self.supply_voltage = 0  # V
+        self.battery_percentage = 0
+
 class DeviceRangeError(Exception):
     """This exception is thrown to prevent invalid readings.
 
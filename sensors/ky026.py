@@ -1,17 +1,127 @@
 # Infrared flame sensor KY-026
 
-from machine import ADC, Pin
+from machine import ADC, Pin, disable_irq, enable_irq
+from array import array
+import micropython
+import time
 
 class KY026:
+    """
+    Flame sensor, read by polling is_flame_detected() and optionally watched.
+
+    watch() reports a flame as soon as it appears, through the module digital
+    output on a pin IRQ or through an ADCSampler threshold check on every
+    sample. The interrupt only latches a timestamp in a preallocated ring
+    buffer and schedules the callback, which runs soon after outside the
+    interrupt; the delay from the flame edge to the end of the callback is kept
+    in last_latency_us and max_latency_us.
+    """
     ADC_PIN = 4
     FLAME_THRESHOLD = 1000
+    SAMPLES = 3  # Samples in the median when reading through an ADCSampler
+    EVENT_BUFFER_SIZE = 8
 
-    def __init__(self, pin=ADC_PIN, threshold=FLAME_THRESHOLD):
-        self.sensor = ADC(Pin(pin, Pin.IN))
+    def __init__(self, pin=ADC_PIN, threshold=FLAME_THRESHOLD, sampler=None):
+        """
+        :param sampler: Optional ADCSampler; the sensor is then read from its buffer instead of the ADC.
+        """
         self.threshold = threshold
+        self.sampler = sampler
+        if sampler is not None:
+            self.sensor = None
+            self.channel = sampler.add_channel(pin)
+        else:
+            self.sensor = ADC(Pin(pin, Pin.IN))
+        self.digital = None
+        self.callback = None
+        self.latched = False  # Set by a flame event, cleared by is_flame_detected()
+        self.event_us = array('i', [0] * self.EVENT_BUFFER_SIZE)
+        self.event_head = 0
+        self.event_count = 0
+        self.events = 0
+        self.lost_events = 0
+        self.scheduled = False
+        self.last_latency_us = 0
+        self.max_latency_us = 0
+        self._dispatch_ref = self._dispatch  # Bound once, scheduling from the interrupt must not allocate
+
+    def watch(self, callback, digital_pin=None, active_high=True):
+        """
+        Calls callback(ticks_us) as soon as a flame is detected.
+
+        :param callback: Runs outside the interrupt with the ticks_us of the detection.
+        :param digital_pin: Pin of the module digital output. Without it, the ADC
+                            threshold is checked by the sampler on every sample.
+        :param active_high: Whether the digital output goes high on flame.
+        """
+        self.callback = callback
+        if digital_pin is not None:
+            self.digital = Pin(digital_pin, Pin.IN)
+            trigger = Pin.IRQ_RISING if active_high else Pin.IRQ_FALLING
+            self.digital.irq(trigger=trigger, handler=self._pin_handler, hard=True)
+        elif self.sampler is not None:
+            self.sampler.watch(self.channel, self.threshold, self._on_flame)
+        else:
+            raise ValueError("Watching needs the digital pin or an ADC sampler")
+
+    def _pin_handler(self, pin):
+        self._on_flame(time.ticks_us())
+
+    def _on_flame(self, timestamp_us):
+        # Interrupt context: store the timestamp and defer the rest
+        self.latched = True
+        if self.event_count < self.EVENT_BUFFER_SIZE:
+            self.event_us[(self.event_head + self.event_count) % self.EVENT_BUFFER_SIZE] = timestamp_us
+            self.event_count += 1
+        else:
+            self.lost_events += 1
+        if not self.scheduled:
+            self.scheduled = True
+            try:
+                micropython.schedule(self._dispatch_ref, 0)
+            except RuntimeError:
+                self.scheduled = False  # Schedule queue full, the next event retries
+
+    def _dispatch(self, _):
+        while True:
+            state = disable_irq()
+            self.scheduled = False
+            if self.event_count == 0:
+                enable_irq(state)
+                return
+            timestamp_us = self.event_us[self.event_head]
+            self.event_head = (self.event_head + 1) % self.EVENT_BUFFER_SIZE
+            self.event_count -= 1
+            enable_irq(state)
+
+            self.events += 1
+            try:
+                if self.callback is not None:
+                    self.callback(timestamp_us)
+            except Exception as e:
+                print(f"An error occurred in the flame callback: {e}")
+            latency = time.ticks_diff(time.ticks_us(), timestamp_us)
+            self.last_latency_us = latency
+            if latency > self.max_latency_us:
+                self.max_latency_us = latency
+
+    def stats(self):
+        return {
+            "events": self.events,
+            "lost_events": self.lost_events,
+            "last_latency_us": self.last_latency_us,
+            "max_latency_us": self.max_latency_us
+        }
+
+    def read(self):
+        """Returns the sensor value (median of the last samples with a sampler), or None before the first sample"""
+        if self.sampler is not None:
+            return self.sampler.median(self.channel, self.SAMPLES)
+        return self.sensor.read()
 
     def is_flame_detected(self):
-        sensor_value = self.sensor.read()
+        sensor_value = self.read()
         # print(f"Reading flame sensor: {sensor_value}")
-        return self.sensor.read() > self.threshold  # Verifies if value read is greater than threshold
-    
\ No newline at end of file
+        latched = self.latched  # A flame seen by watch() since the last call counts even if it is gone
+        self.latched = False
+        return latched or (sensor_value is not None and sensor_value > self.threshold)  # Verifies if value read is greater than threshold
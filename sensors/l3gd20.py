@@ -2,6 +2,7 @@
 # https://github.com/adafruit/Adafruit_CircuitPython_L3GD20
 # https://github.com/jackw01/l3gd20-python
 
+from array import array
 from math import radians
 from struct import unpack
 from micropython import const
@@ -28,10 +29,15 @@ class L3GD20:
                     * :const:`L3DS20_RATE_800HZ`
 
                     Defaults to :const:`L3DS20_RATE_100HZ`
+
+    Polling gyro at the task rate misses most of the motion between two reads.
+    start_stream() keeps the samples in the 32-level FIFO at the full output
+    rate, and read_fifo() drains all of them in one burst read.
     """
 
     L3GD20_ADDRESS = const(0x69)
     L3GD20_REGISTER_WHO_AM_I = const(0x0F)
+    L3GD20_IDS = (0xD4, 0xD7)  # L3GD20, L3GD20H
     L3GD20_REGISTER_CTRL_REG1 = const(0x20)
     L3GD20_REGISTER_CTRL_REG2 = const(0x21)
     L3GD20_REGISTER_CTRL_REG3 = const(0x22)
@@ -73,6 +79,23 @@ class L3GD20:
     L3DS20_RATE_400HZ = const(0x80)
     L3DS20_RATE_800HZ = const(0xC0)
 
+    # Actual output data rates of the rate settings
+    L3GD20_RATE_HZ = {
+        L3DS20_RATE_100HZ: 95,
+        L3DS20_RATE_200HZ: 190,
+        L3DS20_RATE_400HZ: 380,
+        L3DS20_RATE_800HZ: 760,
+    }
+
+    FIFO_SIZE = const(32)
+    FIFO_MODE_BYPASS = const(0x00)
+    FIFO_MODE_FIFO = const(0x20)
+    FIFO_MODE_STREAM = const(0x40)
+    FIFO_ENABLE = const(0x40)  # CTRL_REG5 FIFO_EN
+    FIFO_SRC_OVERRUN = const(0x40)
+    FIFO_SRC_EMPTY = const(0x20)
+    FIFO_SRC_LEVEL = const(0x1F)
+
     def __init__(self, i2c: I2C, address: int = L3GD20_ADDRESS, rng: int = RANGE_250DPS, rate: int = L3DS20_RATE_100HZ) -> None:
         self.i2c = i2c
         self.address = address
@@ -82,6 +105,11 @@ class L3GD20:
 
         self.set_range(rng)
         self.write_register(self.L3GD20_REGISTER_CTRL_REG1, rate | 0x0F)
+        self.rate_hz = self.L3GD20_RATE_HZ[rate]
+        self.streaming = False
+        self.fifo_overruns = 0
+        self._buffer = bytearray(6 * self.FIFO_SIZE)  # Raw FIFO content, reused by every burst
+        self._samples = array('f', [0] * (3 * self.FIFO_SIZE))  # Converted samples, x, y, z interleaved
 
     def set_range(self, new_range: int) -> None:
         'Set range'
@@ -106,9 +134,14 @@ class L3GD20:
         """
         return self.i2c.readfrom_mem(self.address, register, 1)[0]
 
+    def check_id(self) -> bool:
+        """Reads WHO_AM_I, a known value to validate the bus"""
+        return self.read_register(self.L3GD20_REGISTER_WHO_AM_I) in self.L3GD20_IDS
+
     def read(self) -> Tuple[float, float, float]:
         'Read raw angular velocity values in degrees/second'
-        buffer = self.i2c.readfrom_mem(self.address, self.L3GD20_REGISTER_OUT_X_L | 0x80, 6)
+        buffer = memoryview(self._buffer)[:6]
+        self.i2c.readfrom_mem_into(self.address, self.L3GD20_REGISTER_OUT_X_L | 0x80, buffer)
         gyro_raw = unpack('<hhh', buffer)
         return (
             gyro_raw[0] * self._dps_per_lsb,
@@ -125,6 +158,51 @@ class L3GD20:
         raw = self.read()
         return tuple(radians(v) for v in raw)
 
+    def start_stream(self, watermark: int = 0) -> None:
+        """
+        Starts buffering every sample in the FIFO, keeping the newest 32.
+
+        :param watermark: FIFO level (1 to 31) that sets the WTM flag of FIFO_SRC, 0 for none.
+        """
+        if not 0 <= watermark < self.FIFO_SIZE:
+            raise ValueError("Watermark must be between 0 and 31")
+        self.set_fifo_ctrl(self.FIFO_MODE_BYPASS)  # Empties the FIFO
+        self.write_register(self.L3GD20_REGISTER_CTRL_REG5, self.FIFO_ENABLE)
+        self.set_fifo_ctrl(self.FIFO_MODE_STREAM | watermark)
+        self.streaming = True
+
+    def stop_stream(self) -> None:
+        'Return to reading the output registers directly'
+        self.set_fifo_ctrl(self.FIFO_MODE_BYPASS)
+        self.write_register(self.L3GD20_REGISTER_CTRL_REG5, 0x00)
+        self.streaming = False
+
+    def read_fifo(self) -> memoryview:
+        """
+        Drains the FIFO in one auto-increment burst, the output address rolling
+        over from OUT_Z_H to OUT_X_L between samples.
+
+        :return: The samples in rad/s, x, y, z interleaved, oldest first, as a view
+                 of a preallocated array('f') valid until the next call.
+        """
+        source = self.read_fifo_src()
+        if source & self.FIFO_SRC_EMPTY:
+            return memoryview(self._samples)[:0]
+        count = source & self.FIFO_SRC_LEVEL
+        if source & self.FIFO_SRC_OVERRUN:
+            self.fifo_overruns += 1  # Samples were lost since the last read
+            count = self.FIFO_SIZE
+        buffer = self._buffer
+        self.i2c.readfrom_mem_into(self.address, self.L3GD20_REGISTER_OUT_X_L | 0x80, memoryview(buffer)[:6 * count])
+        samples = self._samples
+        scale = radians(self._dps_per_lsb)
+        for i in range(3 * count):
+            value = buffer[2 * i] | (buffer[2 * i + 1] << 8)
+            if value & 0x8000:
+                value -= 0x10000
+            samples[i] = value * scale
+        return memoryview(samples)[:3 * count]
+
     def read_temperature(self) -> int:
         'Read temperature'
         return self.read_register(self.L3GD20_REGISTER_OUT_TEMP)
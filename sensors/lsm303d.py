@@ -28,6 +28,9 @@ class LSM303:
     LSM303_REGISTER_MAG_OUT_Z_L_M = 0x06
     LSM303_REGISTER_MAG_OUT_Y_H_M = 0x07
     LSM303_REGISTER_MAG_OUT_Y_L_M = 0x08
+    LSM303_REGISTER_MAG_IRA_REG_M = 0x0A
+    LSM303_MAG_ID = b'H43'  # Identification registers A, B and C
+    ACCEL_CTRL_REG1 = 0b01000111
 
     MAG_GAIN_1_3 = 0x20  # +/- 1.3
     MAG_GAIN_1_9 = 0x40  # +/- 1.9
@@ -47,7 +50,7 @@ class LSM303:
         # Enable the accelerometer - all 3 channels
         self._bus.writeto_mem(self.LSM303_ADDRESS_ACCEL,
                               self.LSM303_REGISTER_ACCEL_CTRL_REG1_A,
-                              bytearray([0b01000111]))
+                              bytearray([self.ACCEL_CTRL_REG1]))
 
         # Select hi-res (12-bit) or low-res (10-bit) output mode.
         # Low-res mode uses less power and sustains a higher update rate,
@@ -68,6 +71,12 @@ class LSM303:
 
         self.set_mag_gain(self.MAG_GAIN_1_3)
 
+    def check_id(self):
+        'Read known values of both devices (magnetometer ID, accelerometer configuration) to validate the bus'
+        if self._bus.readfrom_mem(self.LSM303_ADDRESS_MAG, self.LSM303_REGISTER_MAG_IRA_REG_M, 3) != self.LSM303_MAG_ID:
+            return False
+        return self._bus.readfrom_mem(self.LSM303_ADDRESS_ACCEL, self.LSM303_REGISTER_ACCEL_CTRL_REG1_A, 1)[0] == self.ACCEL_CTRL_REG1
+
     def read_accel(self):
         'Read raw acceleration in meters/second squared'
         # Read as signed 12-bit little endian values
@@ -131,6 +140,14 @@ class LSM303:
             mag_raw[1] / self._lsb_per_gauss_z * self.GAUSS_TO_MICROTESLA
         )
         
+    def read_accel_mag(self):
+        'Read acceleration and magnetic field as one sample, holding the bus across both reads on an I2CBus'
+        batch = getattr(self._bus, "batch", None)
+        if batch is None:
+            return self.read_accel(), self.read_mag()
+        with batch(self.LSM303_ADDRESS_ACCEL):
+            return self.read_accel(), self.read_mag()
+
     def get_accel_i2c_address(self):
         return self.LSM303_ADDRESS_ACCEL
     
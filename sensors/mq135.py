@@ -2,7 +2,7 @@
 # https://github.com/ncdcommunity/Raspberry_Pi_ADC121C_MQ135_Amonia_Gas_Detection_Sensor_Python_Library
 # https://github.com/rubfi/MQ135
 
-import time
+import json
 from machine import ADC, Pin
 import math
 
@@ -10,6 +10,8 @@ class MQ135:
     # MQ135 configuration
     MEASURE_RL = 20.0
     MQ_SAMPLE_TIME = 5
+    OVERSAMPLING = 64  # ADC reads averaged into one Rs sample
+    RO_FILE = "mq135.json"  # Persisted clean-air calibration
     MEASURED_RO_IN_CLEAN_AIR = 3.7
     NH3_OFFSET = -2.8 # NH3 offset in ppm
     
@@ -40,16 +42,35 @@ class MQ135:
     # CO2 atmospheric concentration for calibration
     ATMOCO2 = 397.13
 
-    def __init__(self, adc_pin=ADC_PIN):
-        self.sensor = ADC(Pin(adc_pin, Pin.IN))
-        self.sensor.atten(ADC.ATTN_11DB)  # Configures the ADC to read from 0 to 3.3V
+    # Curves: log10(ratio) = a * ln(concentration) + b
+    CO2_A = -0.32
+    CO2_B = 1.0
+    NH3_A = -0.41
+    NH3_B = 1.0
+
+    def __init__(self, adc_pin=ADC_PIN, ro_file=RO_FILE, sampler=None):
+        """
+        :param sampler: Optional ADCSampler; Rs is then averaged from its buffer instead of reading the ADC.
+        """
+        self.sampler = sampler
+        if sampler is not None:
+            self.sensor = None
+            self.channel = sampler.add_channel(adc_pin, ADC.ATTN_11DB)
+        else:
+            self.sensor = ADC(Pin(adc_pin, Pin.IN))
+            self.sensor.atten(ADC.ATTN_11DB)  # Configures the ADC to read from 0 to 3.3V
         self.raw_adc = 0
         self.rs_air = 0
         self.ratio = 0
+        self.ro_file = ro_file
+        self.ro = self.load_ro()  # Clean-air resistance, None until calibrated
 
     def read_raw_data(self):
         """Reads the raw data from the sensor"""
-        self.raw_adc = self.sensor.read()
+        if self.sampler is not None:
+            self.raw_adc = self.sampler.latest(self.channel) or 0
+        else:
+            self.raw_adc = self.sensor.read()
         return self.raw_adc
 
     def get_correction_factor(self, temperature, humidity):
@@ -72,72 +93,92 @@ class MQ135:
             return self.get_resistance()
         return self.get_resistance() / correction_factor
 
-    def measure_Ro(self, temperature, humidity):
-        """Calculates the resistance of the sensor in clean air"""
-        Measure_Ro = 0.0
-        for _ in range(self.MQ_SAMPLE_TIME):
-            self.read_raw_data()
-            self.rs_air = self.get_corrected_resistance(temperature, humidity)
-            Measure_Ro += self.rs_air
-            time.sleep(0.000001)
-        Measure_Ro = Measure_Ro / self.MQ_SAMPLE_TIME
-        Measure_Ro = Measure_Ro / self.MEASURED_RO_IN_CLEAN_AIR
-        return Measure_Ro
+    def ready(self):
+        """Returns True once Rs can be measured: the sampler holds a full window (always with a direct ADC)"""
+        if self.sampler is None:
+            return True
+        return self.sampler.counts[self.channel] >= min(self.OVERSAMPLING, self.sampler.size)
+
+    def load_ro(self):
+        """Returns the persisted clean-air resistance, or None if the sensor was never calibrated"""
+        try:
+            with open(self.ro_file) as f:
+                ro = json.load(f).get("ro")
+            if ro is not None and ro > 0:
+                return ro
+        except (OSError, ValueError, AttributeError, TypeError) as e:
+            print(f"No MQ135 calibration loaded: {e}")
+        return None
+
+    def calibrate(self, temperature=CNTP_TEMPERATURE, humidity=CNTP_HUMIDITY, samples=MQ_SAMPLE_TIME):
+        """
+        Measures Ro in clean air and persists it, so it is not measured again at each reading.
+
+        :return: The new Ro in kOhm.
+        """
+        if not self.ready():
+            raise ValueError("MQ135 sampler window not filled yet, try again")
+        if self.sampler is not None:
+            # The sampler mean already covers the whole window, averaging it again adds nothing
+            rs = self.measure_Rs(temperature, humidity)
+        else:
+            rs = 0.0
+            for _ in range(samples):
+                rs += self.measure_Rs(temperature, humidity)
+            rs /= samples
+        ro = rs / self.MEASURED_RO_IN_CLEAN_AIR
+        if ro <= 0.0:
+            raise ValueError("Invalid MQ135 calibration, check the sensor wiring")
+        self.ro = ro
+        try:
+            with open(self.ro_file, "w") as f:
+                json.dump({"ro": ro}, f)
+        except OSError as e:
+            print(f"Error saving MQ135 calibration: {e}")
+        print(f"MQ135 calibrated: Ro = {ro:.3f} kOhm")
+        return ro
 
     def measure_Rs(self, temperature, humidity):
-        Measure_Rs = 0.0
-        self.rs_air = 0.0
-        for _ in range(self.MQ_SAMPLE_TIME):
-            self.read_raw_data()
-            self.rs_air = self.get_corrected_resistance(temperature, humidity)
-            Measure_Rs += self.rs_air
-            time.sleep(0.000001)
-        Measure_Rs = Measure_Rs / self.MQ_SAMPLE_TIME
-        return Measure_Rs
+        """Returns the corrected resistance of the sensor averaged over OVERSAMPLING ADC reads"""
+        if self.sampler is not None:
+            self.raw_adc = self.sampler.mean(self.channel, self.OVERSAMPLING) or 0
+        else:
+            total = 0
+            for _ in range(self.OVERSAMPLING):
+                total += self.sensor.read()
+            self.raw_adc = total / self.OVERSAMPLING
+        if self.raw_adc <= 1.0:
+            self.rs_air = 0.0
+            return self.rs_air
+        self.rs_air = (4096. / self.raw_adc - 1.) * self.RLOAD
+        correction_factor = self.get_correction_factor(temperature, humidity)
+        if correction_factor > 0.0:
+            self.rs_air /= correction_factor
+        return self.rs_air
 
     def measure_ratio(self, temperature, humidity):
-        if self.measure_Ro(temperature, humidity) <= 0.0:
-            self.ratio = self.measure_Rs(temperature, humidity)
-        Measure_Ro = self.measure_Ro(temperature, humidity)
-        if Measure_Ro <= 0.0:
-            self.ratio = self.measure_Rs(temperature, humidity)
-        else:
-            self.ratio = self.measure_Rs(temperature, humidity) / Measure_Ro
+        """Measures Rs/Ro, calibrating first if no Ro was stored (first boot)"""
+        if self.ro is None:
+            self.calibrate(temperature, humidity)
+        self.ratio = self.measure_Rs(temperature, humidity) / self.ro
         # print("Ratio = {:.3f}".format(self.ratio))
+        return self.ratio
 
     def calculate_ppm_CO2(self, temperature, humidity):
         """Calculates the final concentration of CO2 corrected for temperature/humidity"""
-        self.measure_ratio(temperature, humidity)
-        a = -0.32
-        b = 1.0
-        if self.ratio <= 0.0:
-            return 0.0
-        ppm = math.exp(((math.log(self.ratio, 10)) - b) / a)
-        return ppm
+        return self.get_gas_concentrations(temperature, humidity)[0]
 
     def calculate_ppb_NH3(self, temperature, humidity):
         """Calculates the final concentration of NH3 corrected for temperature/humidity"""
-        self.measure_ratio(temperature, humidity)
-        a = -0.41
-        b = 1.0
-        if self.ratio <= 0.0:
-            return 0.0
-        ppb = (math.exp(((math.log(self.ratio, 10)) - b) / a) + self.NH3_OFFSET) * 1000
-        return ppb
+        return self.get_gas_concentrations(temperature, humidity)[1]
 
     def get_gas_concentrations(self, temperature=CNTP_TEMPERATURE, humidity=CNTP_HUMIDITY):
-        """Obtains the final concentrations of CO2 and NH3 corrected for temperature/humidity"""
-        co2_values = []
-        nh3_values = []
-        for _ in range(20):
-            co2_values.append(self.calculate_ppm_CO2(temperature, humidity))
-            nh3_values.append(self.calculate_ppb_NH3(temperature, humidity))
-            time.sleep(0.04)  # Small delay between measurements
-
-        co2_values.sort()
-        nh3_values.sort()
-
-        median_co2 = co2_values[len(co2_values) // 2]
-        median_nh3 = nh3_values[len(nh3_values) // 2]
-
-        return median_co2, median_nh3
+        """Obtains the final concentrations of CO2 (ppm) and NH3 (ppb) corrected for temperature/humidity, None before the sampler window is full"""
+        if not self.ready():
+            return None, None
+        if self.measure_ratio(temperature, humidity) <= 0.0:
+            return 0.0, 0.0
+        log_ratio = math.log(self.ratio) / math.log(10)
+        ppm = math.exp((log_ratio - self.CO2_B) / self.CO2_A)
+        ppb = (math.exp((log_ratio - self.NH3_B) / self.NH3_A) + self.NH3_OFFSET) * 1000
+        return ppm, ppb
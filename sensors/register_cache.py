@@ -0,0 +1,77 @@
+# Write-through register cache for I2C drivers
+# Keeps the last value written to (or read from) configuration registers, so
+# writing a register with the value it already holds costs no bus transaction.
+
+class RegisterCache:
+    """
+    Cache of the configuration registers of one I2C device.
+
+    write() sends a register only when its value differs from the cached one;
+    read() answers from the cache when it can. Only registers the device never
+    changes by itself may be cached: use force=True for writes that must reach
+    the device anyway (triggers), and call invalidate() after a device reset.
+    A failed transfer invalidates the register, since its content is unknown.
+    """
+
+    def __init__(self, i2c, address, writer=None, reader=None):
+        """
+        :param writer: Optional function(register, data) replacing writeto_mem, for devices with other framing.
+        :param reader: Optional function(register, length) replacing readfrom_mem.
+        """
+        self.i2c = i2c
+        self.address = address
+        self.writer = writer
+        self.reader = reader
+        self.values = {}
+        self.writes = 0
+        self.reads = 0
+        self.saved = 0  # Transactions skipped thanks to the cache
+
+    def write(self, register, data, force=False):
+        """
+        Writes a register unless it already holds data.
+
+        :return: True if a transaction was made.
+        """
+        if not force and self.values.get(register) == data:
+            self.saved += 1
+            return False
+        try:
+            if self.writer is not None:
+                self.writer(register, data)
+            else:
+                self.i2c.writeto_mem(self.address, register, data)
+        except OSError:
+            self.values.pop(register, None)
+            raise
+        self.values[register] = bytes(data)
+        self.writes += 1
+        return True
+
+    def read(self, register, length):
+        """Returns the register content, from the cache if it is known."""
+        data = self.values.get(register)
+        if data is not None and len(data) == length:
+            self.saved += 1
+            return data
+        try:
+            if self.reader is not None:
+                data = bytes(self.reader(register, length))
+            else:
+                data = self.i2c.readfrom_mem(self.address, register, length)
+        except OSError:
+            self.values.pop(register, None)
+            raise
+        self.values[register] = data
+        self.reads += 1
+        return data
+
+    def invalidate(self, register=None):
+        """Forgets one register, or all of them (after a reset)."""
+        if register is None:
+            self.values.clear()
+        else:
+            self.values.pop(register, None)
+
+    def stats(self):
+        return {"writes": self.writes, "reads": self.reads, "saved": self.saved}
@@ -4,27 +4,108 @@
 import time
 from machine import I2C
 
+from .register_cache import RegisterCache
+
 class SCD41:
+    """
+    SCD41 driver with a non-blocking acquisition state machine.
+
+    The sensor measures on its own cadence (5 s in periodic mode, 30 s in
+    low-power periodic mode, on request in single-shot mode), so update() does
+    nothing until the next sample is due and then reads it in a couple of short
+    transactions. A failed transaction is retried after an exponential backoff
+    within a per-cycle budget; once the budget is spent the cycle is given up
+    and the driver waits for the next sample. Failures are counted (see stats())
+    instead of printed, and staleness_ms() tells how old the last value is.
+    """
     SCD41_I2C_ADDRESS = 0x62
-    I2C_RETRY_COUNT = 1000
+    I2C_RETRY_COUNT = 2  # Quick retries of one transaction; update() backs off beyond that
     I2C_RETRY_DELAY_uS = 1
     CO2_OFFSET = -140
     co2 = 0
     temperature = 0
     humidity = 0
+
+    MODE_PERIODIC = "periodic"
+    MODE_LOW_POWER = "low_power"
+    MODE_SINGLE_SHOT = "single_shot"
+    MODE_COMMANDS = {
+        MODE_PERIODIC: 0x21B1,
+        MODE_LOW_POWER: 0x21AC,
+        MODE_SINGLE_SHOT: 0x219D
+    }
+    MODE_INTERVALS_MS = {
+        MODE_PERIODIC: 5000,
+        MODE_LOW_POWER: 30000,
+        MODE_SINGLE_SHOT: 5000  # Measurement duration
+    }
+
+    STATE_IDLE = 0  # Single shot: waiting to request the next measurement
+    STATE_MEASURING = 1  # Waiting for the sample to be ready
+
+    COMMAND_DELAY_MS = 1  # Execution time of read commands
+    STOP_DELAY_MS = 500  # The sensor ignores commands this long after stopping
+    NOT_READY_RETRY_MS = 100  # Poll interval when a sample is a little late
+    BACKOFF_BASE_MS = 50
+    BACKOFF_MAX_MS = 2000
+    RETRY_BUDGET = 5  # Failed transactions allowed per cycle
     
-    def __init__(self, i2c: I2C, address: int = SCD41_I2C_ADDRESS):
+    def __init__(self, i2c: I2C, address: int = SCD41_I2C_ADDRESS, mode: str = MODE_PERIODIC, interval_ms: int = None):
+        """
+        :param mode: MODE_PERIODIC, MODE_LOW_POWER or MODE_SINGLE_SHOT.
+        :param interval_ms: Time between two single-shot measurements, at least the measurement duration.
+        """
         self.i2c = i2c
         self.address = address
+        self.registers = RegisterCache(i2c, address, writer=self._write_register)  # Ambient pressure
         self._error = 0
         self._settingsChanged = False
         self._isValid = False
+        self.mode = None
+        self.interval_ms = interval_ms
+        self.state = self.STATE_IDLE
+        self.due_ms = time.ticks_ms()
+        self.cycle_start_ms = self.due_ms
+        self.attempts = 0
+        self.last_update_ms = None
+        self.measurements = 0
+        self.errors = 0
+        self.failed_cycles = 0
+        self.out_of_range = 0
         self.begin()
         self.set_calibration_mode(False)
         self.save_settings()
-        self.start_periodic_measurement()
+        self.set_mode(mode, interval_ms)
         # print(f"SCD41 initialized with address {self.address}")
 
+    @staticmethod
+    def mode_for_period(period_ms: int) -> str:
+        """Returns the lowest-power mode that still delivers a sample every period_ms"""
+        if period_ms < SCD41.MODE_INTERVALS_MS[SCD41.MODE_LOW_POWER]:
+            return SCD41.MODE_PERIODIC
+        if period_ms < 2 * SCD41.MODE_INTERVALS_MS[SCD41.MODE_LOW_POWER]:
+            return SCD41.MODE_LOW_POWER
+        return SCD41.MODE_SINGLE_SHOT
+
+    def set_mode(self, mode: str, interval_ms: int = None) -> int:
+        """Stops the current measurement mode and starts another one"""
+        if mode not in self.MODE_COMMANDS:
+            raise ValueError(f"Unknown SCD41 mode {mode}")
+        if self.mode is not None and self.mode != self.MODE_SINGLE_SHOT:
+            self.stop_periodic_measurement()
+        self.mode = mode
+        self.interval_ms = max(interval_ms or 0, self.MODE_INTERVALS_MS[mode])
+        now = time.ticks_ms()
+        if mode == self.MODE_SINGLE_SHOT:
+            self.state = self.STATE_IDLE
+            self.due_ms = now
+        else:
+            self._command_sequence(self.MODE_COMMANDS[mode])
+            if self._error != 0:
+                print(f"Periodic measurement started with error: {self.get_error_text(self._error)}")
+            self._start_cycle(now)
+        return self._error
+
     def begin(self) -> int:
         try:
             # Iniciar transmissão I2C para o endereço do sensor
@@ -39,7 +120,6 @@ class SCD41:
     def is_connected(self) -> bool:
         # print("Checking if SCD41 is connected...")
         self.stop_periodic_measurement()
-        time.sleep(0.000001)
 
         if self._error != 0:
             print(f"SCD4x returned endTransmission error {self._error}")
@@ -58,23 +138,105 @@ class SCD41:
 
     def start_periodic_measurement(self) -> int:
         # print("Starting periodic measurement...")
-        self._command_sequence(0x21B1)
-        if self._error != 0:
-            print(f"Periodic measurement started with error: {self.get_error_text(self._error)}")
-        return self._error
+        return self.set_mode(self.MODE_PERIODIC)
 
     def stop_periodic_measurement(self) -> int:
         # print("Stopping periodic measurement...")
         self._command_sequence(0x3F86)
         if self._error != 0:
             print(f"Periodic measurement stopped with error: {self.get_error_text(self._error)}")
+        time.sleep_ms(self.STOP_DELAY_MS)
         return self._error
 
+    def _start_cycle(self, now):
+        self.state = self.STATE_MEASURING
+        self.cycle_start_ms = now
+        self.due_ms = time.ticks_add(now, self.MODE_INTERVALS_MS[self.mode])
+        self.attempts = 0
+
+    def _next_cycle(self, now):
+        self.attempts = 0
+        if self.mode == self.MODE_SINGLE_SHOT:
+            self.state = self.STATE_IDLE
+            self.due_ms = time.ticks_add(self.cycle_start_ms, self.interval_ms)
+            if time.ticks_diff(self.due_ms, now) < 0:
+                self.due_ms = now
+        else:
+            # The sensor keeps its own cadence: the next sample comes one interval after this one
+            self._start_cycle(now)
+
+    def _fail(self, now):
+        self.errors += 1
+        self.attempts += 1
+        if self.attempts >= self.RETRY_BUDGET:
+            self.failed_cycles += 1
+            self._next_cycle(now)
+            return
+        # Retry the same step later
+        self.due_ms = time.ticks_add(now, min(self.BACKOFF_MAX_MS, self.BACKOFF_BASE_MS << (self.attempts - 1)))
+
+    def update(self, pressure=None) -> bool:
+        """
+        Advances the state machine. Call it often; it returns at once when nothing is due.
+
+        :param pressure: Ambient pressure in hPa for the sensor compensation, or None.
+        :return: True if a new measurement was read.
+        """
+        now = time.ticks_ms()
+        if time.ticks_diff(now, self.due_ms) < 0:
+            return False
+        try:
+            if self.state == self.STATE_IDLE:
+                # Single shot: request the next measurement
+                self._command_sequence(self.MODE_COMMANDS[self.MODE_SINGLE_SHOT])
+                self._check_error()
+                self._start_cycle(now)
+                return False
+
+            if not self.is_data_ready():
+                self._check_error()
+                self.due_ms = time.ticks_add(now, self.NOT_READY_RETRY_MS)
+                return False
+
+            updated = self._read_measurement()
+            if updated and pressure is not None:
+                self.set_ambient_pressure(pressure)
+            self._next_cycle(now)
+            return updated
+        except OSError:
+            self._fail(now)
+            return False
+
+    def _check_error(self):
+        if self._error != 0:
+            raise OSError(self._error)
+
+    def staleness_ms(self):
+        """Returns the age of the last measurement in ms, or None if there was none"""
+        if self.last_update_ms is None:
+            return None
+        return time.ticks_diff(time.ticks_ms(), self.last_update_ms)
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "measurements": self.measurements,
+            "errors": self.errors,
+            "failed_cycles": self.failed_cycles,
+            "out_of_range": self.out_of_range,
+            "staleness": self.staleness_ms()
+        }
+
     def read_measurement(self, pressure=None) -> tuple:
-        if not self.is_data_ready():
-            return self.co2, self.temperature, self.humidity
+        """Advances the state machine and returns the last measurement"""
+        self.update(pressure)
+        return self.co2, self.temperature, self.humidity
+
+    def _read_measurement(self) -> bool:
         # print("Reading measurement...")
-        self._write_bytes(0xEC05, b'')
+        self._command_sequence(0xEC05)
+        self._check_error()
+        time.sleep_ms(self.COMMAND_DELAY_MS)
         data = self._read_bytes(9)
 
         if len(data) == 9:
@@ -83,23 +245,20 @@ class SCD41:
             humidity = 100 * ((data[6] << 8) | data[7]) / 65536
 
             if not self._in_range(co2, 40000, 0) or not self._in_range(temperature, 60, -10) or not self._in_range(humidity, 100, 0):
-                print(f"Measurement out of range: {co2},{temperature},{humidity}")
+                self.out_of_range += 1
                 self._error = 7
-                return self.co2, self.temperature, self.humidity
+                return False
 
             self.co2 = co2
             self.temperature = temperature
             self.humidity = humidity
-            
-            if pressure is not None:
-                self.set_ambient_pressure(pressure)
-                
+            self.measurements += 1
+            self.last_update_ms = time.ticks_ms()
             # print(f"Measurement read: CO2={co2}, Temperature={temperature}, Humidity={humidity}")
-            return self.co2, self.temperature, self.humidity
+            return True
         else:
             self._error = 6
-            print(f"Failed to read measurement, error: {self.get_error_text(self._error)}")
-            return self.co2, self.temperature, self.humidity
+            raise OSError(self._error)
 
     def is_data_ready(self) -> bool:
         # print("Checking if data is ready...")
@@ -107,6 +266,14 @@ class SCD41:
         # print(f"Data ready: {ready}")
         return ready
 
+    def check_id(self) -> bool:
+        """Reads the data-ready status and checks its CRC, to validate the bus (works in every mode)"""
+        self._command_sequence(0xE4B8)
+        self._check_error()
+        time.sleep_ms(self.COMMAND_DELAY_MS)
+        data = self.i2c.readfrom(self.address, 3)
+        return self._crc8((data[0] << 8) | data[1]) == data[2]
+
     def set_calibration_mode(self, enable_auto_calibration: bool) -> int:
         # print(f"Setting calibration mode to {'auto' if enable_auto_calibration else 'manual'}...")
         self.stop_periodic_measurement()
@@ -134,6 +301,7 @@ class SCD41:
         time.sleep(0.000001)
 
         self._command_sequence(0x3632)
+        self.registers.invalidate()
         time.sleep(0.000001)
 
         if self._error != 0:
@@ -174,13 +342,17 @@ class SCD41:
 
     def _read_sequence(self, register_address: int) -> int:
         # print(f"Reading sequence from register {register_address:04X}")
+        self._command_sequence(register_address)
+        if self._error != 0:
+            return 0
+        time.sleep_ms(self.COMMAND_DELAY_MS)
         data = self._read_bytes(3)
         if len(data) == 3:
             result = (data[0] << 8) | data[1]
             # print(f"Read sequence result: {result:04X}")
             return result
         else:
-            print("Failed to read sequence")
+            self._error = 6
             return 0
 
     def _write_sequence(self, register_address: int, value: int, checksum: int):
@@ -200,7 +372,6 @@ class SCD41:
                 last_error_code = e.args[0]
                 time.sleep(self.I2C_RETRY_DELAY_uS / 1000000)
         self._error = last_error_code
-        print(f"Failed to write to register {register_address:04X} after {self.I2C_RETRY_COUNT} attempts with error: {self.get_error_text(self._error)}")
 
     def _read_bytes(self, num_bytes: int) -> bytes:
         # print(f"Reading {num_bytes} bytes from address {self.address:02X}")
@@ -216,16 +387,31 @@ class SCD41:
                 last_error_code = e.args[0]
                 time.sleep(self.I2C_RETRY_DELAY_uS / 1000000)
         self._error = last_error_code
-        print(f"Failed to read {num_bytes} bytes from address {self.address:02X} after {self.I2C_RETRY_COUNT} attempts with error: {self.get_error_text(self._error)}")
         return b''
     
     def set_ambient_pressure(self, pressure: int):
         if pressure < 0 or pressure > 1200:
             raise ValueError("Pressure must be between 0 and 1200 hPa")
-        self._write_bytes(0xE000, bytes([pressure >> 8, pressure & 0xFF]))
-        if self._error != 0:
-            print(f"Setting ambient pressure failed with error: {self.get_error_text(self._error)}")
+        # Sent only when the pressure changed by at least 1 hPa
+        try:
+            self.registers.write(0xE000, bytes([pressure >> 8, pressure & 0xFF, self._crc8(pressure)]))
+        except OSError:
+            pass
         return self._error
 
+    def _write_register(self, register_address: int, data: bytes):
+        self._write_bytes(register_address, data)
+        if self._error != 0:
+            raise OSError(self._error)
+
+    def _crc8(self, value: int) -> int:
+        # Sensirion CRC-8 of a 16-bit word: polynomial 0x31, initial value 0xFF
+        crc = 0xFF
+        for byte in (value >> 8, value & 0xFF):
+            crc ^= byte
+            for _ in range(8):
+                crc = ((crc << 1) ^ 0x31) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+        return crc
+
     def get_i2c_address(self):
         return self.SCD41_I2C_ADDRESS
\ No newline at end of file
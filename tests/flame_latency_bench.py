@@ -0,0 +1,70 @@
+# Flame detection to UART latency of the KY026 watch path
+# Run from tests/ on CPython, which uses the simulated modules in tests/sim:
+# the simulated UART sends at 9600 baud 8E2 like main.py's, so txdone() and
+# the time each byte leaves the wire are modeled. A flame appears at a random
+# point of a long telemetry line being sent by the uart_tx task; the latency
+# is measured from the sample that sees it to the last byte of the flame
+# event leaving the UART. As in main.py, the scheduled flame callback queues
+# the event itself, which cuts the telemetry at the chunk on the wire.
+# Expect about 35 ms median and 45 ms max: up to one 16-byte chunk (20 ms)
+# still on the wire, then 25 ms for the 20-byte event itself.
+
+import random
+import sys
+import time
+
+sys.path.append('..')
+sys.path.append('sim')
+from communication import UARTComm
+from sensors import ADCSampler, KY026
+from utils import ticks_diff, ticks_us
+from utils.constants import FLAME_EVENT, UART_BAUD_RATE
+
+TRIALS = 30
+TELEMETRY = '{"telemetry": "' + 'x' * 600 + '"}'
+UART_TX_PERIOD_MS = 10
+
+comm = UARTComm(baudrate=UART_BAUD_RATE, parity=0, stop=2)
+sampler = ADCSampler()
+ky026 = KY026(sampler=sampler)
+flame_pending = [False]
+
+def on_flame(timestamp_us):
+    if not comm.send_urgent(FLAME_EVENT):
+        flame_pending[0] = True
+
+def poll_uart():
+    if flame_pending[0]:
+        flame_pending[0] = False
+        comm.send_message(FLAME_EVENT, priority=True)
+    comm.poll()
+
+ky026.watch(on_flame)
+adc = sampler.adcs[ky026.channel]
+event = FLAME_EVENT.encode()
+latencies = []
+for _ in range(TRIALS):
+    comm.send_message(TELEMETRY)  # Telemetry in the way
+    adc.raw = 0
+    sampler._sample(None)
+    deadline = time.ticks_add(time.ticks_ms(), random.randint(0, 60))
+    while time.ticks_diff(deadline, time.ticks_ms()) > 0:  # Part of the telemetry already sent
+        poll_uart()
+        time.sleep_ms(UART_TX_PERIOD_MS)
+    adc.raw = 4095
+    sent = len(comm.uart.tx)
+    start = ticks_us()
+    sampler._sample(None)  # The sample that sees the flame
+    while comm.uart.tx.find(event, sent) < 0:
+        time.sleep_ms(UART_TX_PERIOD_MS)
+        poll_uart()
+    last = comm.uart.tx.find(event, sent) + len(event)  # The newline after the event
+    end = comm.uart.sent_us(last)
+    while not comm.uart.txdone():
+        time.sleep_ms(1)
+    latencies.append(ticks_diff(end, start))
+
+latencies.sort()
+print(f"Flame event on the wire: median {latencies[TRIALS // 2]} us, max {latencies[-1]} us")
+print(f"Worst case with sampling every {sampler.period_ms} ms: {sampler.period_ms * 1000 + latencies[-1]} us, of which {(len(event) + 2) * comm.uart.byte_us} us to send the event")
+print(f"KY026 callback latency (detection to the event queued): {ky026.stats()}")
@@ -0,0 +1,35 @@
+# Madgwick filter update rate and heap use per update
+# Run from tests/ on the board (mpremote run) or on CPython, which uses the simulated modules in tests/sim.
+# Compare the updates/second with the gyroscope output rate (95 to 760 Hz).
+
+import gc
+import sys
+
+sys.path.append('..')
+sys.path.append('sim')  # Only reached on CPython, the board has the built-in modules
+from utils import MadgwickAHRS, ticks_diff, ticks_us
+
+UPDATES = 2000
+DT = 1 / 95
+
+fusion = MadgwickAHRS()
+
+def run(update_imu):
+    gc.collect()
+    free = gc.mem_free() if hasattr(gc, "mem_free") else None
+    start = ticks_us()
+    for i in range(UPDATES):
+        if update_imu:
+            fusion.update_imu(0.01, -0.02, 0.5, 0.1, 0.2, 9.8, DT)
+        else:
+            fusion.update(0.01, -0.02, 0.5, 0.1, 0.2, 9.8, 20.0, 1.0, -40.0, DT)
+    elapsed = ticks_diff(ticks_us(), start)
+    name = "update_imu" if update_imu else "update"
+    print(f"{name}: {UPDATES * 1000000 // elapsed} updates/s, {elapsed / UPDATES:.1f} us per update")
+    if free is not None:
+        # Float temporaries are short-lived heap objects on ports with boxed floats, native code included
+        print(f"{name}: {(free - gc.mem_free()) / UPDATES:.1f} bytes allocated per update")
+
+run(False)
+run(True)
+print(f"Heading {fusion.heading():.1f} deg, pitch {fusion.pitch():.1f} deg, roll {fusion.roll():.1f} deg")
@@ -0,0 +1,73 @@
+# HCSR04Array update rate and filtered distances against a simulated echo model
+# Run from tests/ on CPython: the echoes and the clock are simulated (tests/sim).
+# Every fired sensor sees its echo rise 460 us after the trigger and fall after
+# the round trip to its target, with 0.5 cm of noise; without a target in range
+# the echo stays high for 38 ms, as the sensor does. Halfway through, the left
+# obstacle leaves: its reading must drop to -1 instead of staying at 120 cm.
+
+import random
+import sys
+import time
+
+sys.path.append('..')
+sys.path.append('sim')
+import machine  # Simulated, installs the ticks functions replaced below
+
+SIMULATED_MS = 4000
+TRIGGER_TO_ECHO_US = 460
+NO_ECHO_US = 38000
+TARGETS_CM = {"front": 50, "left": 120, "right": 300, "rear": 30}
+LEAVES = "left"
+
+clock_us = [0]
+time.ticks_us = lambda: clock_us[0]
+time.ticks_ms = lambda: clock_us[0] // 1000
+time.ticks_diff = lambda end, start: end - start
+time.sleep_us = lambda us: None
+
+from sensors import HCSR04, HCSR04Array
+
+sensors = {name: HCSR04(trig_pin=i, echo_pin=100 + i) for i, name in enumerate(TARGETS_CM)}
+ranging = HCSR04Array(sensors)
+
+fired = []
+for name, sensor in sensors.items():
+    def on(name=name, trig=sensor.trig):
+        trig.value(1)
+        fired.append(name)
+    sensor.trig.on = on
+
+def echo_us(name):
+    target = TARGETS_CM[name]
+    if target is None or target > ranging.max_range_cm:
+        return NO_ECHO_US
+    return int(2 * (target + random.gauss(0, 0.5)) / HCSR04Array.SOUND_SPEED_CM_US)
+
+events = []  # (time_us, pin, level)
+end_us = SIMULATED_MS * 1000
+left_at = None
+while clock_us[0] < end_us:
+    if left_at is None and clock_us[0] >= end_us // 2:
+        TARGETS_CM[LEAVES] = None
+        left_at = clock_us[0]
+    fired.clear()
+    ranging.step()
+    start = clock_us[0]
+    for name in fired:
+        rise = start + TRIGGER_TO_ECHO_US
+        events.append((rise, sensors[name].echo, 1))
+        events.append((rise + echo_us(name), sensors[name].echo, 0))
+    next_step = start + ranging.spacing_ms * 1000
+    events.sort(key=lambda event: event[0])
+    while events and events[0][0] < next_step:
+        clock_us[0], pin, level = events.pop(0)
+        pin.fire(level)
+    clock_us[0] = next_step
+    if left_at is not None and ranging.distance(LEAVES) == -1 and left_at > 0:
+        print(f"{LEAVES} obstacle gone: reading dropped after {(clock_us[0] - left_at) // 1000} ms")
+        left_at = 0
+
+print(f"Spacing {ranging.spacing_ms} ms, timeout {ranging.timeout_us} us")
+for name in sensors:
+    i = ranging.names.index(name)
+    print(f"{name}: target {TARGETS_CM[name]} cm, filtered {ranging.distance(name):.1f} cm, {ranging.update_rate(name):.1f} Hz, {ranging.timeouts[i]} timeouts")
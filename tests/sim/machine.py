@@ -0,0 +1,215 @@
+# Simulated machine module, to run the bench scripts on CPython
+# On the board the built-in machine module is found first and this directory
+# is never used. Importing it also gives CPython the MicroPython time
+# functions (wrapping at 2^30 like on the board) and builtins the drivers use.
+
+import builtins
+import time
+
+TICKS_PERIOD = 1 << 30
+
+if not hasattr(time, "ticks_us"):
+    time.ticks_ms = lambda: int(time.monotonic() * 1000) & (TICKS_PERIOD - 1)
+    time.ticks_us = lambda: int(time.monotonic() * 1000000) & (TICKS_PERIOD - 1)
+    time.ticks_diff = lambda end, start: ((end - start + TICKS_PERIOD // 2) & (TICKS_PERIOD - 1)) - TICKS_PERIOD // 2
+    time.ticks_add = lambda ticks, delta: (ticks + delta) & (TICKS_PERIOD - 1)
+    time.sleep_ms = lambda ms: time.sleep(ms / 1000)
+    time.sleep_us = lambda us: time.sleep(us / 1000000)
+
+if not hasattr(builtins, "const"):
+    builtins.const = lambda value: value  # MicroPython's compiler knows const() without an import
+if not hasattr(builtins, "Tuple"):
+    from typing import Tuple
+    builtins.Tuple = Tuple  # Annotations are not evaluated by MicroPython
+
+class Pin:
+    IN = 0
+    OUT = 1
+    PULL_UP = 1
+    IRQ_RISING = 1
+    IRQ_FALLING = 2
+
+    def __init__(self, pin, mode=None, pull=None):
+        self.pin = pin
+        self._value = 0
+        self.handler = None
+
+    def init(self, *args, **kwargs):
+        pass
+
+    def value(self, value=None):
+        if value is None:
+            return self._value
+        self._value = value
+
+    def on(self):
+        self._value = 1
+
+    def off(self):
+        self._value = 0
+
+    def irq(self, trigger=None, handler=None, hard=False):
+        self.handler = handler
+
+    def fire(self, value):
+        """Sets the pin level and runs its interrupt handler, as an edge would."""
+        self._value = value
+        if self.handler is not None:
+            self.handler(self)
+
+class ADC:
+    ATTN_11DB = 3
+    WIDTH_12BIT = 3
+
+    def __init__(self, pin):
+        self.raw = 500
+
+    def atten(self, atten):
+        pass
+
+    def width(self, width):
+        pass
+
+    def read(self):
+        return self.raw
+
+    def read_u16(self):
+        return self.raw << 4
+
+class PWM:
+    def __init__(self, pin, freq=1, duty_u16=0):
+        self._freq = freq
+        self._duty = duty_u16
+
+    def freq(self, freq=None):
+        if freq is None:
+            return self._freq
+        self._freq = freq
+
+    def duty_u16(self, duty=None):
+        if duty is None:
+            return self._duty
+        self._duty = duty
+
+class Timer:
+    """Never fires by itself: the benches call the callback when they need it."""
+    PERIODIC = 1
+    ONE_SHOT = 0
+
+    def __init__(self, timer_id):
+        self.callback = None
+
+    def init(self, period=0, mode=PERIODIC, callback=None, freq=None):
+        self.callback = callback
+
+    def deinit(self):
+        self.callback = None
+
+class UART:
+    """
+    Sends at the configured baud rate: txdone() is False until the written
+    bytes would have left the wire, and sent_us() tells when a byte did.
+    Received bytes are appended to rx by the bench; asking for more than is
+    waiting blocks for the timeout, as on the board, and counts in blocked_ms.
+    """
+
+    def __init__(self, uart_num, baudrate=9600, bits=8, parity=None, stop=1, timeout=0, **kwargs):
+        self.byte_us = (1 + bits + (parity is not None) + stop) * 1000000 // baudrate
+        self.timeout = timeout
+        self.tx = bytearray()
+        self.rx = bytearray()
+        self.writes = []  # (first byte index, ticks_us the first byte starts)
+        self.tx_end_us = time.ticks_us()
+        self.blocked_ms = 0
+
+    def write(self, data):
+        now = time.ticks_us()
+        start = self.tx_end_us if time.ticks_diff(self.tx_end_us, now) > 0 else now
+        self.writes.append((len(self.tx), start))
+        self.tx += data
+        self.tx_end_us = time.ticks_add(start, len(data) * self.byte_us)
+        return len(data)
+
+    def txdone(self):
+        return time.ticks_diff(time.ticks_us(), self.tx_end_us) >= 0
+
+    def sent_us(self, index):
+        """Returns the ticks_us at which byte index of tx has left the wire."""
+        for first, start in reversed(self.writes):
+            if first <= index:
+                return time.ticks_add(start, (index - first + 1) * self.byte_us)
+        return None
+
+    def any(self):
+        return len(self.rx)
+
+    def _wait(self, nbytes):
+        if nbytes > len(self.rx) and self.timeout:
+            time.sleep_ms(self.timeout)
+            self.blocked_ms += self.timeout
+
+    def read(self, nbytes=None):
+        if nbytes is not None:
+            self._wait(nbytes)
+        if not self.rx:
+            return None
+        nbytes = len(self.rx) if nbytes is None else min(nbytes, len(self.rx))
+        data = bytes(self.rx[:nbytes])
+        del self.rx[:nbytes]
+        return data
+
+    def readinto(self, buffer, nbytes=None):
+        nbytes = len(buffer) if nbytes is None else nbytes
+        self._wait(nbytes)
+        nbytes = min(nbytes, len(self.rx))
+        if not nbytes:
+            return None
+        buffer[:nbytes] = self.rx[:nbytes]
+        del self.rx[:nbytes]
+        return nbytes
+
+class I2C:
+    """Register memory per address; reads of unwritten registers return zeros."""
+
+    def __init__(self, *args, **kwargs):
+        self.memory = {}
+
+    def scan(self):
+        return sorted(self.memory)
+
+    def _read(self, address, register, nbytes):
+        registers = self.memory.get(address, {})
+        return bytes(registers.get(register + i, 0) for i in range(nbytes))
+
+    def readfrom_mem(self, address, register, nbytes, addrsize=8):
+        return self._read(address, register & 0x7F, nbytes)
+
+    def readfrom_mem_into(self, address, register, buffer, addrsize=8):
+        buffer[:] = self._read(address, register & 0x7F, len(buffer))
+
+    def writeto_mem(self, address, register, buffer, addrsize=8):
+        registers = self.memory.setdefault(address, {})
+        for i, value in enumerate(buffer):
+            registers[register + i] = value
+
+    def readfrom(self, address, nbytes, stop=True):
+        return bytes(nbytes)
+
+    def readfrom_into(self, address, buffer, stop=True):
+        for i in range(len(buffer)):
+            buffer[i] = 0
+
+    def writeto(self, address, buffer, stop=True):
+        return len(buffer)
+
+if not hasattr(builtins, "I2C"):
+    builtins.I2C = I2C  # Used in driver annotations without an import
+
+def time_pulse_us(pin, level, timeout_us):
+    return -1
+
+def disable_irq():
+    return 0
+
+def enable_irq(state):
+    pass
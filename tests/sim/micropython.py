@@ -0,0 +1,15 @@
+# Simulated micropython module, see machine.py
+
+def const(value):
+    return value
+
+def native(function):
+    # Code emitter decorator, bytecode on CPython
+    return function
+
+def schedule(function, argument):
+    # Runs at once; on the board it runs at the next bytecode boundary
+    function(argument)
+
+def alloc_emergency_exception_buf(size):
+    pass
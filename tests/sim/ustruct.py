@@ -0,0 +1,3 @@
+# Simulated ustruct module, see machine.py
+
+from struct import *
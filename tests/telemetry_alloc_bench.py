@@ -0,0 +1,92 @@
+# Heap allocations per telemetry cycle: JSONParser vs. fixed-schema TelemetryRecord
+# Run from tests/ on the board (mpremote run) or on CPython, which uses the simulated modules in tests/sim.
+# A cycle is the whole path of main.py: every channel published into
+# LatestValues, then the JSON message or the binary frame built from it.
+# On the board, gc.mem_alloc() counts the allocations. CPython only gives the
+# heap peak, and it boxes every int above 256, which MicroPython does not, so
+# its figures are an upper bound. With the record, the board allocates one
+# float (a 16-byte heap block) per float channel published, for the scaling
+# multiply in TelemetryRecord.set(); building the frame allocates nothing.
+
+import gc
+import sys
+
+sys.path.append('..')
+sys.path.append('sim')  # Only reached on CPython, the board has the built-in modules
+from communication import BinaryFrameEncoder, JSONParser, TelemetryRecord
+from utils.scheduler import LatestValues
+
+CYCLES = 100
+
+SAMPLE = {
+    "timestamp": "2024-10-17T12:34:56",
+    "temperature": 23.45,
+    "pressure": 1013.2,
+    "humidity": 55.5,
+    "bus_voltage": 12.3,
+    "current": 512.0,
+    "power": 6300.0,
+    "battery_percentage": 54.0,
+    "flame": False,
+    "nh3": 12.3,
+    "co2": 612,
+    "gyroscope.x": 0.01,
+    "gyroscope.y": -0.2,
+    "gyroscope.z": 1.5,
+    "accelerometer.x": 0.1,
+    "accelerometer.y": -0.3,
+    "accelerometer.z": 9.8,
+    "distance.front": 123.4,
+    "distance.left": 80.0,
+    "distance.right": 55.5,
+    "distance.rear": 300.1
+}
+
+def json_cycle(latest, parser):
+    for key, value in SAMPLE.items():
+        latest.publish(key, value)
+    for key, value in latest.snapshot().items():
+        parser.add_data(key, value)
+    parser.get_json_message()
+    parser.clear_json_message()
+
+def record_cycle(latest, encoder):
+    for key, value in SAMPLE.items():
+        latest.publish(key, value)
+    encoder.encode_record(latest.record)
+
+def encode_cycle(record, encoder):
+    encoder.encode_record(record)
+
+def measure(name, cycle, *args):
+    cycle(*args)  # Warm up
+    if hasattr(gc, "mem_alloc"):
+        gc.collect()
+        gc.disable()
+        before = gc.mem_alloc()
+        for _ in range(CYCLES):
+            cycle(*args)
+        allocated = gc.mem_alloc() - before
+        gc.enable()
+        print(f"{name}: {allocated / CYCLES:.1f} bytes allocated per cycle")
+    else:
+        # CPython has no allocation counter, so report the heap peak above the baseline instead
+        import tracemalloc
+        tracemalloc.start()
+        peak_total = 0
+        for _ in range(CYCLES):
+            base = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            cycle(*args)
+            peak_total += tracemalloc.get_traced_memory()[1] - base
+        tracemalloc.stop()
+        print(f"{name}: {peak_total / CYCLES:.1f} bytes peak heap growth per cycle")
+
+floats = sum(1 for value in SAMPLE.values() if isinstance(value, float))
+print(f"{len(SAMPLE)} channels, {floats} of them floats")
+measure("JSONParser", json_cycle, LatestValues(), JSONParser())
+measure("TelemetryRecord", record_cycle, LatestValues(TelemetryRecord()), BinaryFrameEncoder())
+record = LatestValues(TelemetryRecord())
+for key, value in SAMPLE.items():
+    record.publish(key, value)
+measure("TelemetryRecord, frame only", encode_cycle, record.record, BinaryFrameEncoder())
@@ -0,0 +1,31 @@
+# Receive path of UARTComm with commands arriving a few bytes at a time
+# Run from tests/ on CPython, which uses the simulated UART in tests/sim: it
+# blocks for the UART timeout whenever more bytes are asked for than are
+# waiting, like the board does. A drain of the receive buffer must never
+# wait on the line, whatever the timeout main.py opens the UART with.
+
+import sys
+
+sys.path.append('..')
+sys.path.append('sim')
+from communication import UARTComm
+from utils import ticks_diff, ticks_us
+from utils.constants import UART_TIMEOUT
+
+TRIALS = 20
+COMMAND = b'{"cmd": "ping", "id": 1}\n'
+PIECES = (7, 11)  # Split points: the line arrives in three parts
+
+comm = UARTComm(timeout=UART_TIMEOUT)
+messages = 0
+max_us = 0
+for _ in range(TRIALS):
+    start = 0
+    for end in PIECES + (len(COMMAND),):
+        comm.uart.rx += COMMAND[start:end]
+        start = end
+        t0 = ticks_us()
+        messages += len(list(comm.read_messages()))
+        max_us = max(max_us, ticks_diff(ticks_us(), t0))
+
+print(f"{messages}/{TRIALS} commands received, longest drain {max_us} us, blocked {comm.uart.blocked_ms} ms with a {UART_TIMEOUT} ms timeout")
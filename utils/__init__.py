@@ -5,4 +5,9 @@ Este módulo contém funções e constantes utilitárias usadas no projeto.
 """
 
 from .constants import *
+from .filters import *
+from .fusion import *
 from .helpers import *
+from .odometry import *
+from .scheduler import *
+from .timer_service import *
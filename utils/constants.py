@@ -1,12 +1,50 @@
 # Constants
 I2C_SCL_PIN = 22
 I2C_SDA_PIN = 21
-I2C_FREQ = 9600
+I2C_FREQ = 100000  # Starting clock; with I2C_AUTOTUNE the fastest clean one of I2C_FREQUENCIES is kept
+I2C_FREQUENCIES = (100000, 400000, 800000, 1000000)
+I2C_AUTOTUNE = True
+I2C_TIMEOUT_US = 50000  # Bound of one I2C transaction, the I2CBus device timeouts only apply between retries
 UART_BAUD_RATE = 9600 # Hz
 UART_TIMEOUT = 5000 # in milliseconds
+TELEMETRY_FORMAT = "json" # "json" or "binary" (see communication/binary_frame.py)
+TELEMETRY_DELTA = False # JSON only: send changed keys between periodic keyframes
+KEYFRAME_INTERVAL = 10 # Messages between two full keyframes in delta mode, 0 for a keyframe every message
+# Minimum change for a key to be resent in delta mode, by full key or by its first part
+TELEMETRY_DEADBANDS = {
+    "temperature": 0.1,
+    "pressure": 0.5,
+    "humidity": 0.5,
+    "bus_voltage": 0.05,
+    "current": 5,
+    "power": 50,
+    "battery_percentage": 1,
+    "raw_nh3": 20,
+    "nh3": 1,
+    "co2": 10,
+    "gyroscope": 0.01,
+    "accelerometer": 0.05,
+    "magnetometer": 0.5,
+    "orientation": 0.5,
+    "quaternion": 0.001,
+    "distance": 1,
+    "speed": 0.5,
+    "traveled": 0.01,
+    "position": 0.01
+}
 
 NH3_THRESHOLD = 80
 CO2_THRESHOLD = 1000
+KY026_DIGITAL_PIN = None  # KY026 digital output for the flame IRQ; None watches the ADC threshold instead
+BATTERY_CAPACITY_MAH = 2600
+SCD41_SAMPLE_INTERVAL = 5000  # ms between CO2 samples; 30000 and above use the SCD41 low-power modes
+SCD41_STALE_MS = 15000  # Report the CO2 value as stale when older than this
+ODOMETRY_TRACK_CM = 20.0  # Distance between the left and right wheels
+ODOMETRY_USE_GYRO = True  # Take the heading changes from the IMU fusion when it runs
+FUSION_BETA = 0.1  # Madgwick gain; higher corrects the gyroscope drift faster but passes more vibration
+TIMER_SERVICE_ID = 0  # Hardware timer shared by the encoder windows, ADC sampling and alarm tones
+TIMER_TICK_MS = 5  # Resolution of the timer service; every tick costs a Python callback
+FLAME_EVENT = '{"event": "flame"}'  # Sent ahead of any telemetry when a flame appears
 
 # Flags to enable/disable components
 ENABLE_I2C = True
@@ -31,7 +69,31 @@ ENABLE_L3GD20 = True
 ENABLE_LSM303D = True
 ENABLE_MQ135 = True
 ENABLE_SCD41 = True
+ENABLE_IMU_FUSION = True  # Send the fused orientation instead of the raw L3GD20 and LSM303D values
 ENABLE_UART_COMM = True
 
+# Sampling profile of each task: period and relative deadline in milliseconds, and
+# priority (lower runs first; rate-monotonic, so shorter periods get lower numbers)
+SAMPLING_PROFILE = {
+    "ky026": {"period": 50, "deadline": 50, "priority": 0},
+    "uart_tx": {"period": 10, "deadline": 10, "priority": 0},
+    "commands": {"period": 20, "deadline": 20, "priority": 1},
+    "l3gd20": {"period": 100, "deadline": 100, "priority": 1},
+    "lsm303d": {"period": 100, "deadline": 100, "priority": 1},
+    "odometry": {"period": 50, "deadline": 50, "priority": 1},  # Fixed rate, independent of the telemetry
+    "imu": {"period": 100, "deadline": 100, "priority": 1},  # Fuses every FIFO sample; 32 samples last 336 ms at 95 Hz
+    "hcsr04": {"priority": 1},  # One group of the ranging engine per period, which is its spacing (set_period changes both)
+    "hc020k.front_left": {"period": 1000, "deadline": 1000, "priority": 3},
+    "hc020k.front_right": {"period": 1000, "deadline": 1000, "priority": 3},
+    "hc020k.rear_left": {"period": 1000, "deadline": 1000, "priority": 3},
+    "hc020k.rear_right": {"period": 1000, "deadline": 1000, "priority": 3},
+    "ina219": {"period": 100, "deadline": 100, "priority": 1},  # Fast enough to integrate the motor current
+    "bme280": {"period": 1000, "deadline": 1000, "priority": 3},
+    "ds1302": {"period": 1000, "deadline": 1000, "priority": 3},
+    "telemetry": {"period": 1000, "deadline": 1000, "priority": 3},
+    "mq135": {"period": 2000, "deadline": 2000, "priority": 4},
+    "scd41": {"period": 1000, "deadline": 1000, "priority": 3}  # Polls the state machine; samples follow SCD41_SAMPLE_INTERVAL
+}
+
 ENABLE_INFO_PRINT = True
 ENABLE_ERROR_PRINT = True
@@ -0,0 +1,78 @@
+# Streaming filters with preallocated storage
+
+from array import array
+
+class RunningMedian:
+    """
+    Median of the last window values, updated in place.
+
+    Values are kept both in arrival order (to know which one leaves the
+    window) and in sorted order; each update finds positions by binary search
+    and shifts the values in between, so nothing is re-sorted and no container
+    is allocated. The search is O(log window) but the shift is O(window), so an
+    update is O(window): fine for the few samples of a sensor filter, while a
+    long window would need a skip list or two heaps.
+    """
+
+    def __init__(self, window):
+        if window < 1:
+            raise ValueError("Window must be at least 1")
+        self.window = window
+        self.ring = array('f', [0.0] * window)
+        self.sorted = array('f', [0.0] * window)
+        self.count = 0
+        self.position = 0
+
+    def reset(self):
+        self.count = 0
+        self.position = 0
+
+    def _search(self, value, n):
+        # First index in sorted[:n] whose value is >= value
+        low = 0
+        high = n
+        values = self.sorted
+        while low < high:
+            middle = (low + high) >> 1
+            if values[middle] < value:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def update(self, value):
+        """Adds a value, dropping the oldest one when the window is full. Returns the new median."""
+        values = self.sorted
+        n = self.count
+        if n < self.window:
+            index = self._search(value, n)
+            i = n
+            while i > index:
+                values[i] = values[i - 1]
+                i -= 1
+            values[index] = value
+            self.count = n + 1
+        else:
+            old = self.ring[self.position]
+            i = self._search(old, n)
+            # Slide the values between the old and the new position over the old slot
+            while i > 0 and value < values[i - 1]:
+                values[i] = values[i - 1]
+                i -= 1
+            while i < n - 1 and value > values[i + 1]:
+                values[i] = values[i + 1]
+                i += 1
+            values[i] = value
+        self.ring[self.position] = value
+        self.position = (self.position + 1) % self.window
+        return self.median()
+
+    def median(self):
+        """Returns the current median, or None if no value was added yet."""
+        n = self.count
+        if n == 0:
+            return None
+        middle = n >> 1
+        if n & 1:
+            return self.sorted[middle]
+        return (self.sorted[middle - 1] + self.sorted[middle]) / 2
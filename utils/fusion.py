@@ -0,0 +1,198 @@
+# Orientation estimation from the gyroscope, accelerometer and magnetometer
+
+from array import array
+from math import asin, atan2, degrees, sqrt
+import micropython
+
+class MadgwickAHRS:
+    """
+    Madgwick gradient-descent orientation filter.
+
+    update() integrates one gyroscope sample and pulls the estimate toward the
+    gravity and magnetic field directions, by beta rad/s at most. The state is
+    a quaternion kept in a preallocated array('f') and updated in place; the
+    step creates no containers. The steps are compiled to native code, which
+    runs the arithmetic faster than bytecode, but the ESP32 port still boxes
+    every float result (viper has no float type): update() leaves about 280
+    short-lived 16-byte floats (4.5 kB) per sample and update_imu() about 140
+    (2.2 kB), counted from the operations; fusion_bench.py measures them.
+    heading(), pitch() and roll() convert the state when it is reported.
+    """
+    BETA = 0.1  # Correction gain: higher trusts the accelerometer and magnetometer more
+
+    def __init__(self, beta=BETA):
+        self.beta = beta
+        self.q = array('f', [1.0, 0.0, 0.0, 0.0])  # w, x, y, z
+        self.updates = 0
+
+    def reset(self):
+        q = self.q
+        q[0] = 1.0
+        q[1] = 0.0
+        q[2] = 0.0
+        q[3] = 0.0
+
+    @micropython.native
+    def update(self, gx, gy, gz, ax, ay, az, mx, my, mz, dt):
+        """
+        Advances the orientation by one sample.
+
+        :param gx, gy, gz: Angular rate in rad/s.
+        :param ax, ay, az: Acceleration, any unit.
+        :param mx, my, mz: Magnetic field, any unit; all zero to ignore it.
+        :param dt: Time since the previous sample in seconds.
+        """
+        if mx == 0.0 and my == 0.0 and mz == 0.0:
+            self.update_imu(gx, gy, gz, ax, ay, az, dt)
+            return
+        q = self.q
+        q0 = q[0]
+        q1 = q[1]
+        q2 = q[2]
+        q3 = q[3]
+
+        # Rate of change of the quaternion from the gyroscope
+        qdot0 = 0.5 * (-q1 * gx - q2 * gy - q3 * gz)
+        qdot1 = 0.5 * (q0 * gx + q2 * gz - q3 * gy)
+        qdot2 = 0.5 * (q0 * gy - q1 * gz + q3 * gx)
+        qdot3 = 0.5 * (q0 * gz + q1 * gy - q2 * gx)
+
+        norm = ax * ax + ay * ay + az * az
+        if norm > 0.0:
+            norm = 1.0 / sqrt(norm)
+            ax *= norm
+            ay *= norm
+            az *= norm
+            norm = 1.0 / sqrt(mx * mx + my * my + mz * mz)
+            mx *= norm
+            my *= norm
+            mz *= norm
+
+            _2q0mx = 2.0 * q0 * mx
+            _2q0my = 2.0 * q0 * my
+            _2q0mz = 2.0 * q0 * mz
+            _2q1mx = 2.0 * q1 * mx
+            _2q0 = 2.0 * q0
+            _2q1 = 2.0 * q1
+            _2q2 = 2.0 * q2
+            _2q3 = 2.0 * q3
+            _2q0q2 = 2.0 * q0 * q2
+            _2q2q3 = 2.0 * q2 * q3
+            q0q0 = q0 * q0
+            q0q1 = q0 * q1
+            q0q2 = q0 * q2
+            q0q3 = q0 * q3
+            q1q1 = q1 * q1
+            q1q2 = q1 * q2
+            q1q3 = q1 * q3
+            q2q2 = q2 * q2
+            q2q3 = q2 * q3
+            q3q3 = q3 * q3
+
+            # Reference direction of the Earth's magnetic field
+            hx = mx * q0q0 - _2q0my * q3 + _2q0mz * q2 + mx * q1q1 + _2q1 * my * q2 + _2q1 * mz * q3 - mx * q2q2 - mx * q3q3
+            hy = _2q0mx * q3 + my * q0q0 - _2q0mz * q1 + _2q1mx * q2 - my * q1q1 + my * q2q2 + _2q2 * mz * q3 - my * q3q3
+            _2bx = sqrt(hx * hx + hy * hy)
+            _2bz = -_2q0mx * q2 + _2q0my * q1 + mz * q0q0 + _2q1mx * q3 - mz * q1q1 + _2q2 * my * q3 - mz * q2q2 + mz * q3q3
+            _4bx = 2.0 * _2bx
+            _4bz = 2.0 * _2bz
+
+            # Gradient of the objective function
+            fax = 2.0 * q1q3 - _2q0q2 - ax
+            fay = 2.0 * q0q1 + _2q2q3 - ay
+            faz = 1.0 - 2.0 * q1q1 - 2.0 * q2q2 - az
+            fmx = _2bx * (0.5 - q2q2 - q3q3) + _2bz * (q1q3 - q0q2) - mx
+            fmy = _2bx * (q1q2 - q0q3) + _2bz * (q0q1 + q2q3) - my
+            fmz = _2bx * (q0q2 + q1q3) + _2bz * (0.5 - q1q1 - q2q2) - mz
+            s0 = -_2q2 * fax + _2q1 * fay - _2bz * q2 * fmx + (-_2bx * q3 + _2bz * q1) * fmy + _2bx * q2 * fmz
+            s1 = _2q3 * fax + _2q0 * fay - 4.0 * q1 * faz + _2bz * q3 * fmx + (_2bx * q2 + _2bz * q0) * fmy + (_2bx * q3 - _4bz * q1) * fmz
+            s2 = -_2q0 * fax + _2q3 * fay - 4.0 * q2 * faz + (-_4bx * q2 - _2bz * q0) * fmx + (_2bx * q1 + _2bz * q3) * fmy + (_2bx * q0 - _4bz * q2) * fmz
+            s3 = _2q1 * fax + _2q2 * fay + (-_4bx * q3 + _2bz * q1) * fmx + (-_2bx * q0 + _2bz * q2) * fmy + _2bx * q1 * fmz
+            norm = s0 * s0 + s1 * s1 + s2 * s2 + s3 * s3
+            if norm > 0.0:
+                norm = self.beta / sqrt(norm)
+                qdot0 -= norm * s0
+                qdot1 -= norm * s1
+                qdot2 -= norm * s2
+                qdot3 -= norm * s3
+
+        self._integrate(q, q0 + qdot0 * dt, q1 + qdot1 * dt, q2 + qdot2 * dt, q3 + qdot3 * dt)
+
+    @micropython.native
+    def update_imu(self, gx, gy, gz, ax, ay, az, dt):
+        """Same as update() without a magnetometer: the heading then drifts with the gyroscope bias."""
+        q = self.q
+        q0 = q[0]
+        q1 = q[1]
+        q2 = q[2]
+        q3 = q[3]
+
+        qdot0 = 0.5 * (-q1 * gx - q2 * gy - q3 * gz)
+        qdot1 = 0.5 * (q0 * gx + q2 * gz - q3 * gy)
+        qdot2 = 0.5 * (q0 * gy - q1 * gz + q3 * gx)
+        qdot3 = 0.5 * (q0 * gz + q1 * gy - q2 * gx)
+
+        norm = ax * ax + ay * ay + az * az
+        if norm > 0.0:
+            norm = 1.0 / sqrt(norm)
+            ax *= norm
+            ay *= norm
+            az *= norm
+
+            _2q0 = 2.0 * q0
+            _2q1 = 2.0 * q1
+            _2q2 = 2.0 * q2
+            _2q3 = 2.0 * q3
+            _4q0 = 4.0 * q0
+            _4q1 = 4.0 * q1
+            _4q2 = 4.0 * q2
+            _8q1 = 8.0 * q1
+            _8q2 = 8.0 * q2
+            q0q0 = q0 * q0
+            q1q1 = q1 * q1
+            q2q2 = q2 * q2
+            q3q3 = q3 * q3
+
+            s0 = _4q0 * q2q2 + _2q2 * ax + _4q0 * q1q1 - _2q1 * ay
+            s1 = _4q1 * q3q3 - _2q3 * ax + 4.0 * q0q0 * q1 - _2q0 * ay - _4q1 + _8q1 * q1q1 + _8q1 * q2q2 + _4q1 * az
+            s2 = 4.0 * q0q0 * q2 + _2q0 * ax + _4q2 * q3q3 - _2q3 * ay - _4q2 + _8q2 * q1q1 + _8q2 * q2q2 + _4q2 * az
+            s3 = 4.0 * q1q1 * q3 - _2q1 * ax + 4.0 * q2q2 * q3 - _2q2 * ay
+            norm = s0 * s0 + s1 * s1 + s2 * s2 + s3 * s3
+            if norm > 0.0:
+                norm = self.beta / sqrt(norm)
+                qdot0 -= norm * s0
+                qdot1 -= norm * s1
+                qdot2 -= norm * s2
+                qdot3 -= norm * s3
+
+        self._integrate(q, q0 + qdot0 * dt, q1 + qdot1 * dt, q2 + qdot2 * dt, q3 + qdot3 * dt)
+
+    @micropython.native
+    def _integrate(self, q, q0, q1, q2, q3):
+        norm = 1.0 / sqrt(q0 * q0 + q1 * q1 + q2 * q2 + q3 * q3)
+        q[0] = q0 * norm
+        q[1] = q1 * norm
+        q[2] = q2 * norm
+        q[3] = q3 * norm
+        self.updates += 1
+
+    def yaw(self):
+        """Yaw in radians, -pi to pi, increasing counterclockwise about z."""
+        q0, q1, q2, q3 = self.q
+        return atan2(q1 * q2 + q0 * q3, 0.5 - q2 * q2 - q3 * q3)
+
+    def heading(self):
+        """Yaw in degrees, 0 to 360."""
+        yaw = degrees(self.yaw())
+        return yaw + 360 if yaw < 0 else yaw
+
+    def pitch(self):
+        """Pitch in degrees."""
+        q0, q1, q2, q3 = self.q
+        value = -2.0 * (q1 * q3 - q0 * q2)
+        return degrees(asin(1.0 if value > 1.0 else -1.0 if value < -1.0 else value))
+
+    def roll(self):
+        """Roll in degrees."""
+        q0, q1, q2, q3 = self.q
+        return degrees(atan2(q0 * q1 + q2 * q3, 0.5 - q1 * q1 - q2 * q2))
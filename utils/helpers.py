@@ -2,6 +2,22 @@ import time
 import sys
 from .constants import ENABLE_INFO_PRINT, ENABLE_ERROR_PRINT
 
+try:
+    from time import ticks_ms, ticks_us, ticks_diff, ticks_add
+except ImportError:
+    # CPython fallback, so the runtime can be exercised off-board with a simulated machine module
+    def ticks_ms():
+        return int(time.monotonic() * 1000)
+
+    def ticks_us():
+        return int(time.monotonic() * 1000000)
+
+    def ticks_diff(end, start):
+        return end - start
+
+    def ticks_add(ticks, delta):
+        return ticks + delta
+
 def format_iso_datetime(timestamp):
     """
     Formata um timestamp em uma string ISO 8601.
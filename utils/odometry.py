@@ -0,0 +1,129 @@
+# Dead reckoning from the wheel encoders, optionally steered by the gyroscope
+
+from array import array
+from math import cos, degrees, pi, radians, sin
+
+class Odometry:
+    """
+    Pose (x, y, heading) of the robot and its covariance.
+
+    update() takes the pulses counted by each encoder since the previous call
+    (the counters are never reset, so nothing is lost between two reads),
+    averages the wheels of each side and advances the pose with the
+    differential drive model. The encoders cannot tell the direction, so the
+    sign of each side comes from set_direction(). Given a yaw, from the
+    orientation filter for instance, the heading change is taken from it
+    instead of from the wheel difference, which skid steering makes unreliable.
+
+    The covariance grows with the distance each wheel travels (WHEEL_NOISE)
+    and with time for the gyroscope yaw (YAW_NOISE), propagated through the
+    motion model. x, y are in meters from the starting point, the heading in
+    radians counterclockwise from the starting direction.
+    """
+    TRACK_CM = 20.0  # Distance between the left and right wheels
+    WHEEL_NOISE = 0.01  # Variance (cm^2) per cm traveled by a side
+    YAW_NOISE = 0.0001  # Variance (rad^2) per second of the yaw input
+
+    def __init__(self, left, right, track_cm=TRACK_CM, wheel_noise=WHEEL_NOISE, yaw_noise=YAW_NOISE):
+        """
+        :param left: Encoders (HC020K) of the left side, read_pulses() and cm_per_pulse are used.
+        :param right: Encoders of the right side.
+        """
+        if not left or not right:
+            raise ValueError("Odometry needs at least one encoder on each side")
+        self.left = left
+        self.right = right
+        self.track = track_cm / 100
+        self.wheel_noise = wheel_noise / 100  # m^2 per m
+        self.yaw_noise = yaw_noise
+        self.counts = array('i', [encoder.read_pulses() for encoder in left + right])
+        self.left_sign = 1
+        self.right_sign = 1
+        self.x = 0.0
+        self.y = 0.0
+        self.heading = 0.0
+        self.covariance = array('f', [0.0] * 6)  # xx, xy, xh, yy, yh, hh
+        self.last_yaw = None
+        self.updates = 0
+
+    def set_direction(self, left, right):
+        """Sets the direction of each side: 1 forward, -1 backward."""
+        self.left_sign = -1 if left < 0 else 1
+        self.right_sign = -1 if right < 0 else 1
+
+    def reset(self, x=0.0, y=0.0, heading=0.0):
+        """Sets the pose, heading in degrees, and forgets its uncertainty."""
+        self.x = x
+        self.y = y
+        self.heading = (radians(heading) + pi) % (2 * pi) - pi
+        for i in range(6):
+            self.covariance[i] = 0.0
+        self.last_yaw = None
+
+    def _side(self, encoders, offset):
+        # Mean distance of the encoders of one side since the last update, in m
+        counts = self.counts
+        total = 0.0
+        for i in range(len(encoders)):
+            encoder = encoders[i]
+            pulses = encoder.read_pulses()
+            total += (pulses - counts[offset + i]) * encoder.cm_per_pulse
+            counts[offset + i] = pulses
+        return total / len(encoders) / 100
+
+    def update(self, yaw=None, dt=0.0):
+        """
+        Advances the pose with the pulses counted since the previous call.
+
+        :param yaw: Optional absolute yaw in radians (counterclockwise); its change replaces the wheel estimate.
+        :param dt: Time since the previous call in seconds, for the yaw noise.
+        """
+        left = self._side(self.left, 0) * self.left_sign
+        right = self._side(self.right, len(self.left)) * self.right_sign
+        distance = (left + right) / 2
+        side_variance = self.wheel_noise * (abs(left) + abs(right)) / 2  # Of each side, taken as equal
+
+        if yaw is not None and self.last_yaw is not None:
+            turn = (yaw - self.last_yaw + pi) % (2 * pi) - pi
+            var_turn = self.yaw_noise * dt
+        else:
+            turn = (right - left) / self.track
+            var_turn = 2 * side_variance / (self.track * self.track)
+        if yaw is not None:
+            self.last_yaw = yaw
+        var_distance = side_variance / 2  # Equal side variances: distance and turn errors are uncorrelated
+
+        direction = self.heading + turn / 2
+        c = cos(direction)
+        s = sin(direction)
+        self.x += distance * c
+        self.y += distance * s
+        self.heading = (self.heading + turn + pi) % (2 * pi) - pi
+
+        # P = F P F' + G Q G', F the Jacobian with respect to the pose, G to (distance, turn)
+        p = self.covariance
+        pxx, pxy, pxh, pyy, pyh, phh = p[0], p[1], p[2], p[3], p[4], p[5]
+        a = -distance * s
+        b = distance * c
+        pxx += 2 * a * pxh + a * a * phh
+        pxy += a * pyh + b * pxh + a * b * phh
+        pxh += a * phh
+        pyy += 2 * b * pyh + b * b * phh
+        pyh += b * phh
+        e = a / 2
+        f = b / 2
+        # G = [[c, e], [s, f], [0, 1]], Q = diag(var_distance, var_turn)
+        et = e * var_turn
+        ft = f * var_turn
+        p[0] = pxx + c * c * var_distance + e * et
+        p[1] = pxy + c * s * var_distance + e * ft
+        p[2] = pxh + et
+        p[3] = pyy + s * s * var_distance + f * ft
+        p[4] = pyh + ft
+        p[5] = phh + var_turn
+        self.updates += 1
+
+    def pose(self):
+        """Returns x (m), y (m) and the heading in degrees, 0 to 360."""
+        heading = degrees(self.heading)
+        return self.x, self.y, heading + 360 if heading < 0 else heading
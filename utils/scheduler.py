@@ -0,0 +1,265 @@
+# Cooperative task-per-device scheduler (uasyncio on the board, asyncio on CPython)
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+from .helpers import ticks_ms, ticks_diff, ticks_add, error_print
+
+class LatestValues:
+    """
+    Shared table with the latest value published by each channel.
+
+    Sensor tasks publish into it at their own rate and the telemetry task
+    snapshots it, so a slow device never delays the others. If a fixed-schema
+    record (communication.TelemetryRecord) is given, the channels it knows are
+    also written into it, so binary telemetry can be built without a snapshot.
+    """
+
+    def __init__(self, record=None):
+        self.values = {}
+        self.updated_ms = {}
+        self.events = {}
+        self.record = record
+
+    def publish(self, key, value):
+        """Stores the latest value of a channel."""
+        self.values[key] = value
+        self.updated_ms[key] = ticks_ms()
+        if self.record is not None and value is not None:
+            self.record.set_key(key, value)
+
+    def publish_once(self, key, value):
+        """Stores a value (e.g. an error) that is sent in the next snapshot only."""
+        self.events[key] = value
+
+    def get(self, key, default=None):
+        return self.values.get(key, default)
+
+    def age_ms(self, key):
+        """Returns how long ago a channel was updated, or None if it never was."""
+        if key not in self.updated_ms:
+            return None
+        return ticks_diff(ticks_ms(), self.updated_ms[key])
+
+    def pop_events(self):
+        """Returns and clears the pending one-shot values, or None if there are none."""
+        if not self.events:
+            return None
+        events = self.events
+        self.events = {}
+        return events
+
+    def snapshot(self):
+        """Returns a copy of all channels plus the pending one-shot values."""
+        snapshot = dict(self.values)
+        if self.events:
+            snapshot.update(self.events)
+            self.events = {}
+        return snapshot
+
+class Task:
+    """A periodic job, its sampling profile and its timing statistics."""
+    DEFAULT_PRIORITY = 5  # Lowest of the SAMPLING_PROFILE priorities (0 to 5)
+
+    def __init__(self, name, func, period_ms, deadline_ms=None, priority=None):
+        self.name = name
+        self.func = func
+        self.period_ms = period_ms
+        self.deadline_ms = period_ms if deadline_ms is None else deadline_ms
+        self.priority = self.DEFAULT_PRIORITY if priority is None else priority
+        self.enabled = True
+        self.active = False
+        self.release = ticks_ms()  # Release time of the current (or next) job
+        self.runs = 0
+        self.errors = 0
+        self.deadline_misses = 0
+        self.last_latency_ms = 0  # Release to start of the job
+        self.max_latency_ms = 0
+        self.last_run_ms = 0  # Duration of the job
+        self.max_run_ms = 0
+        self.total_run_ms = 0
+
+    def is_waiting(self, now):
+        """True if the job is released but has not started yet."""
+        return self.enabled and not self.active and ticks_diff(now, self.release) >= 0
+
+    def stats(self):
+        return {
+            "period": self.period_ms,
+            "deadline": self.deadline_ms,
+            "priority": self.priority,
+            "runs": self.runs,
+            "errors": self.errors,
+            "misses": self.deadline_misses,
+            "latency": self.last_latency_ms,
+            "max_latency": self.max_latency_ms,
+            "run": self.last_run_ms,
+            "max_run": self.max_run_ms
+        }
+
+class Scheduler:
+    """
+    Runs each registered job as its own coroutine, following a sampling profile.
+
+    A job is a plain function or a coroutine function. Coroutines are awaited,
+    so drivers that yield while waiting on hardware let the other jobs run.
+    When several jobs are released at once, the one with the lowest priority
+    number starts first; the others wait on an event set whenever a job
+    starts, instead of polling. A job that finishes after its deadline, or whose
+    releases are skipped because it overran its period, counts as a miss.
+    """
+
+    def __init__(self, profile=None):
+        self.profile = profile if profile is not None else {}
+        self.tasks = {}
+        self.started = None  # Event set when a job starts, created in the event loop
+
+    def add_task(self, name, func, period_ms=None, deadline_ms=None, priority=None):
+        """
+        Registers a job. Timing not given explicitly is taken from the profile entry of the same name.
+
+        :param name: Device key, e.g. "hcsr04.front".
+        :param func: Function or coroutine function to run every period.
+        :param period_ms: Release period in milliseconds.
+        :param deadline_ms: Relative deadline in milliseconds, defaults to the period.
+        :param priority: Lower runs first, defaults to Task.DEFAULT_PRIORITY.
+        """
+        entry = self.profile.get(name, {})
+        if period_ms is None:
+            period_ms = entry.get("period")
+        if period_ms is None:
+            raise ValueError(f"No sampling period for task {name}")
+        if deadline_ms is None:
+            deadline_ms = entry.get("deadline")
+        if priority is None:
+            priority = entry.get("priority")
+        task = Task(name, func, period_ms, deadline_ms, priority)
+        self.tasks[name] = task
+        return task
+
+    def configure(self, name, period_ms=None, deadline_ms=None, priority=None):
+        """Changes the timing of a running task; the new period applies from its next release."""
+        task = self.tasks.get(name)
+        if task is None:
+            raise self._missing(name)
+        if period_ms is not None:
+            if period_ms <= 0:
+                raise ValueError("Period must be positive")
+            if deadline_ms is None and task.deadline_ms == task.period_ms:
+                deadline_ms = period_ms  # Implicit deadline follows the period
+            task.period_ms = period_ms
+        if deadline_ms is not None:
+            task.deadline_ms = deadline_ms
+        if priority is not None:
+            task.priority = priority
+        return task.stats()
+
+    def set_enabled(self, name, enabled):
+        """
+        Enables or disables a task, or every task of a device ("hcsr04" matches "hcsr04.front", ...).
+
+        Only tasks added at startup exist: a device disabled in the constants or
+        not detected has none, and cannot be enabled at runtime.
+
+        :return: The names of the tasks changed.
+        """
+        names = [key for key in self.tasks if key == name or key.startswith(name + ".")]
+        if not names:
+            raise self._missing(name)
+        for key in names:
+            self.tasks[key].enabled = enabled
+        if not enabled:
+            self._wake()  # The disabled tasks no longer outrank anyone
+        return names
+
+    def _missing(self, name):
+        # A name of the profile without a task belongs to a device that was never initialized
+        if isinstance(name, str) and any(key == name or key.startswith(name + ".") for key in self.profile):
+            return ValueError(f"Task {name} not initialized (device disabled or not detected)")
+        return ValueError(f"Unknown task {name}")
+
+    def stats(self):
+        return {name: task.stats() for name, task in self.tasks.items()}
+
+    def total_deadline_misses(self):
+        total = 0
+        for task in self.tasks.values():
+            total += task.deadline_misses
+        return total
+
+    def deadline_misses(self):
+        """Returns the deadline misses of every task that missed at least once."""
+        return {name: task.deadline_misses for name, task in self.tasks.items() if task.deadline_misses}
+
+    def utilization(self):
+        """Returns the measured processor utilization (sum of mean run time over period)."""
+        total = 0.0
+        for task in self.tasks.values():
+            if task.runs and task.enabled:
+                total += task.total_run_ms / task.runs / task.period_ms
+        return total
+
+    def _outranked(self, task, now):
+        for other in self.tasks.values():
+            if other is not task and other.priority < task.priority and other.is_waiting(now):
+                return True
+        return False
+
+    def _wake(self):
+        # Lets the jobs waiting for their turn check again
+        if self.started is not None:
+            self.started.set()
+            self.started.clear()
+
+    async def _run_task(self, task):
+        task.release = ticks_ms()
+        while True:
+            if task.enabled:
+                while self._outranked(task, ticks_ms()):
+                    await self.started.wait()
+                task.active = True
+                self._wake()
+                start = ticks_ms()
+                task.last_latency_ms = ticks_diff(start, task.release)
+                if task.last_latency_ms > task.max_latency_ms:
+                    task.max_latency_ms = task.last_latency_ms
+                try:
+                    result = task.func()
+                    if hasattr(result, "send"):  # Coroutine
+                        await result
+                except Exception as e:
+                    task.errors += 1
+                    error_print(f"Task {task.name} failed: {e}")
+                finish = ticks_ms()
+                task.active = False
+                task.runs += 1
+                task.last_run_ms = ticks_diff(finish, start)
+                task.total_run_ms += task.last_run_ms
+                if task.last_run_ms > task.max_run_ms:
+                    task.max_run_ms = task.last_run_ms
+                if ticks_diff(finish, task.release) > task.deadline_ms:
+                    task.deadline_misses += 1
+
+            task.release = ticks_add(task.release, task.period_ms)
+            delay = ticks_diff(task.release, ticks_ms())
+            if delay < 0:
+                # Overran the period: run the latest release now and skip the older ones
+                skipped = -delay // task.period_ms
+                if task.enabled:
+                    task.deadline_misses += skipped
+                task.release = ticks_add(task.release, skipped * task.period_ms)
+                delay = 0
+            await asyncio.sleep(delay / 1000)
+
+    async def _main(self):
+        self.started = asyncio.Event()
+        for task in self.tasks.values():
+            asyncio.create_task(self._run_task(task))
+        while True:
+            await asyncio.sleep(1)
+
+    def run(self):
+        """Starts all jobs and blocks forever."""
+        asyncio.run(self._main())
@@ -0,0 +1,177 @@
+# Timer service
+# Runs the periodic and one-shot jobs of all the drivers on one hardware timer,
+# instead of a machine.Timer per driver.
+
+from machine import Timer
+import heapq
+import time
+
+_ARM = 1
+_CANCEL = 2
+
+class TimerJob:
+    """A job of the TimerService, with its timing statistics."""
+
+    def __init__(self, name, callback, period_ms):
+        self.name = name
+        self.callback = callback
+        self.period_ms = period_ms  # 0 for a one-shot job
+        self.entry = None  # Heap entry [deadline, sequence, job] while armed
+        self.request = 0  # _ARM or _CANCEL, waiting for the next tick
+        self.request_ticks = 0  # ticks_ms deadline of an _ARM request
+        self.runs = 0
+        self.overruns = 0  # Periods skipped because the job ran too late
+        self.errors = 0
+        self.max_lateness_ms = 0
+        self.total_lateness_ms = 0
+        self.max_duration_us = 0
+
+    def to_dict(self):
+        return {
+            "period_ms": self.period_ms,
+            "runs": self.runs,
+            "overruns": self.overruns,
+            "errors": self.errors,
+            "mean_jitter_ms": self.total_lateness_ms / self.runs if self.runs else 0,
+            "max_jitter_ms": self.max_lateness_ms,
+            "max_duration_us": self.max_duration_us
+        }
+
+class TimerService:
+    """
+    Multiplexes jobs on one periodic hardware timer.
+
+    The armed jobs sit in a heap ordered by deadline; every tick only looks at
+    the earliest one, pops and runs the jobs that are due, and pushes the
+    periodic ones back with their next deadline. A periodic job that comes
+    due more than a period late skips the missed periods, counted as
+    overruns, instead of running several times in a row. Callbacks get the
+    service as argument, like a machine.Timer callback gets the timer, and
+    run in the same context as a machine.Timer callback.
+
+    The tick callback can run between any two bytecodes of the main code, so
+    schedule() and cancel() never touch the heap or the clock: they store a
+    request in the job with single attribute writes, and the tick applies
+    the requests before and after running the due jobs.
+
+    Deadlines count milliseconds since start() on a counter rebased before
+    it leaves the small integer range, so the heap order survives the
+    ticks_ms wrap. The lateness of each run (jitter, at most one tick on an
+    idle system) and the callback duration are kept per job (stats()).
+    """
+    TIMER_ID = 0
+    TICK_MS = 5  # The ADC sampling period; every tick costs a Python callback
+    REBASE_MS = 1 << 28
+
+    def __init__(self, timer_id=TIMER_ID, tick_ms=TICK_MS):
+        self.timer_id = timer_id
+        self.tick_ms = tick_ms
+        self.timer = None
+        self.heap = []
+        self.jobs = {}
+        self.sequence = 0
+        self.now = 0  # Milliseconds since start(), rebased
+        self.last_ticks = time.ticks_ms()
+        self.ticks = 0
+        self.requested = False  # Set after a job request, cleared by the tick applying them
+
+    def add(self, name, callback, period_ms=0):
+        """
+        Registers a job; a periodic one is armed right away, first due one period from now.
+
+        :param callback: Function(service), kept short like any timer callback.
+        :param period_ms: Period of the job, 0 for a one-shot job armed with schedule().
+        :return: The job, for schedule(), cancel() and its statistics.
+        """
+        if name in self.jobs:
+            raise ValueError(f"Timer job {name} already exists")
+        job = TimerJob(name, callback, period_ms)
+        self.jobs[name] = job
+        if period_ms > 0:
+            self.schedule(job)
+        return job
+
+    def schedule(self, job, delay_ms=None):
+        """(Re)arms a job to run in delay_ms, by default one period from now; applied by the next tick."""
+        job.request_ticks = time.ticks_add(time.ticks_ms(), job.period_ms if delay_ms is None else delay_ms)
+        job.request = _ARM  # Written after the deadline, the tick never sees a request without it
+        self.requested = True
+
+    def cancel(self, job):
+        """Disarms a job; applied by the next tick."""
+        job.request = _CANCEL
+        self.requested = True
+
+    def _apply_requests(self):
+        self.requested = False
+        for job in self.jobs.values():
+            request = job.request
+            if request == 0:
+                continue
+            job.request = 0
+            if request == _ARM:
+                entry = [self.now + time.ticks_diff(job.request_ticks, self.last_ticks), self.sequence, job]
+                self.sequence += 1
+                job.entry = entry  # An entry left in the heap from before is now stale and dropped when it comes up
+                heapq.heappush(self.heap, entry)
+            else:
+                job.entry = None
+
+    def start(self):
+        self.last_ticks = time.ticks_ms()
+        if self.timer is None:
+            self.timer = Timer(self.timer_id)
+        self.timer.init(period=self.tick_ms, mode=Timer.PERIODIC, callback=self._tick)
+
+    def stop(self):
+        if self.timer is not None:
+            self.timer.deinit()
+
+    def _advance(self):
+        current = time.ticks_ms()
+        self.now += time.ticks_diff(current, self.last_ticks)
+        self.last_ticks = current
+        if self.now >= self.REBASE_MS:
+            base = self.now
+            for entry in self.heap:
+                entry[0] -= base  # The same shift for all keeps the heap order
+            self.now = 0
+
+    def _tick(self, timer):
+        self._advance()
+        self.ticks += 1
+        if self.requested:
+            self._apply_requests()
+        heap = self.heap
+        while heap and heap[0][0] <= self.now:
+            entry = heapq.heappop(heap)
+            job = entry[2]
+            if job.entry is not entry:
+                continue  # Cancelled or rescheduled
+            deadline = entry[0]
+            lateness = self.now - deadline
+            job.runs += 1
+            job.total_lateness_ms += lateness
+            if lateness > job.max_lateness_ms:
+                job.max_lateness_ms = lateness
+            if job.period_ms > 0:
+                missed = lateness // job.period_ms
+                job.overruns += missed
+                entry[0] = deadline + (missed + 1) * job.period_ms
+                heapq.heappush(heap, entry)  # Pushed before running, so the callback can cancel it
+            else:
+                job.entry = None
+            start = time.ticks_us()
+            try:
+                job.callback(self)
+            except Exception as e:
+                job.errors += 1
+                print(f"An error occurred in timer job {job.name}: {e}")
+            duration = time.ticks_diff(time.ticks_us(), start)
+            if duration > job.max_duration_us:
+                job.max_duration_us = duration
+        if self.requested:
+            self._apply_requests()  # Made by the callbacks, such as a one-shot job arming its next step
+
+    def stats(self):
+        return {name: job.to_dict() for name, job in self.jobs.items()}